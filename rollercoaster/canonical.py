@@ -0,0 +1,155 @@
+import bisect
+import hashlib
+import logging
+import struct
+import threading
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import dns.name
+import dns.rdata
+import dns.rdataset
+import dns.rdatatype
+import dns.zone
+
+from rollercoaster.nsec import NsecChain
+
+logger = logging.getLogger(__name__)
+
+RR_FIXED = struct.Struct("!HHI")
+RDATA_LENGTH = struct.Struct("!H")
+
+RRsetKey = Tuple[dns.name.Name, int, int]
+
+
+class CanonicalRRset(NamedTuple):
+    """RRset in canonical form (RFC 4034, section 6)
+
+    data holds the RRs in canonical order as included in the signature
+    data (RFC 4034, section 3.1.8.1), and digest is the digest of the RRset
+    used as key in the signature cache. The rdatas the canonical form was
+    created from are kept to check that the RRset is unchanged.
+    """
+
+    rdatas: Tuple[dns.rdata.Rdata, ...]
+    rdtype: int
+    labels: int
+    ttl: int
+    data: bytes
+    digest: bytes
+
+    def matches(self, rdataset: dns.rdataset.Rdataset) -> bool:
+        """Return True if created from the same rdatas and TTL as rdataset
+
+        Rdatas are immutable and compared by identity, as nodes read in a
+        transaction hold copies of the rdatasets of the zone but share the
+        rdatas.
+        """
+        return (
+            self.ttl == rdataset.ttl
+            and len(self.rdatas) == len(rdataset)
+            and all(a is b for a, b in zip(self.rdatas, rdataset))
+        )
+
+
+def canonical_rrset(
+    name: dns.name.Name,
+    rdataset: dns.rdataset.Rdataset,
+    origin: Optional[dns.name.Name] = None,
+    keep: bool = False,
+) -> CanonicalRRset:
+    """Return RRset in canonical form, keeping the rdatas if requested"""
+    owner = name.to_digestable(origin)
+    fixed = RR_FIXED.pack(rdataset.rdtype, rdataset.rdclass, rdataset.ttl)
+    rdatas = sorted(rdata.to_digestable(origin) for rdata in rdataset)
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(owner)
+    h.update(fixed)
+    parts = []
+    for rdata in rdatas:
+        length = RDATA_LENGTH.pack(len(rdata))
+        h.update(length)
+        h.update(rdata)
+        parts.extend((owner, fixed, length, rdata))
+
+    labels = len(name) - 1
+    if name.is_wild():
+        labels -= 1
+
+    return CanonicalRRset(
+        rdatas=tuple(rdataset) if keep else (),
+        rdtype=rdataset.rdtype,
+        labels=labels,
+        ttl=rdataset.ttl,
+        data=b"".join(parts),
+        digest=h.digest(),
+    )
+
+
+class CanonicalCache:
+    """Canonical form of the RRsets signed in a prepared zone
+
+    The cache is created when the prepared zone is loaded and updated for
+    the names that change, so RRsets that are the same in every slot are
+    only converted to canonical form once. RRsets are looked up by owner
+    name and type, and a cached form is only used if it was created from
+    the very same rdatas; rdatas are never changed, and are shared by all
+    snapshots of the zone. Other RRsets signed (such as NSEC RRsets, reused
+    between slots by the NSEC chain) are added when first looked up.
+
+    The cache may be shared by zones signed in parallel, so it is only
+    changed while holding the lock.
+    """
+
+    def __init__(self, origin: dns.name.Name):
+        self.origin = origin
+        self.rrsets: Dict[RRsetKey, CanonicalRRset] = {}
+        self.names: Dict[dns.name.Name, Tuple[RRsetKey, ...]] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rrsets)
+
+    @classmethod
+    def from_zone(cls, zone: dns.zone.Zone, chain: NsecChain):
+        """Create cache for all RRsets signed in zone"""
+        res = cls(zone.origin)
+        res.update(zone, chain, chain.names)
+        logger.debug("Created canonical form of %d RRsets", len(res))
+        return res
+
+    def update(
+        self, zone: dns.zone.Zone, chain: NsecChain, names: Iterable[dns.name.Name]
+    ) -> None:
+        """Update cache after RRsets at names have been changed"""
+        for name in names:
+            with self.lock:
+                for key in self.names.pop(name, ()):
+                    del self.rrsets[key]
+            node = zone.get_node(name)
+            i = bisect.bisect_left(chain.names, name)
+            if node is None or i == len(chain.names) or chain.names[i] != name:
+                continue
+            delegation = name in chain.delegations
+            for rdataset in node.rdatasets:
+                if rdataset.rdtype == dns.rdatatype.RRSIG or (
+                    delegation and rdataset.rdtype != dns.rdatatype.DS
+                ):
+                    # only DS records are signed at delegations
+                    continue
+                self.get(name, rdataset)
+
+    def get(
+        self, name: dns.name.Name, rdataset: dns.rdataset.Rdataset
+    ) -> CanonicalRRset:
+        """Return canonical form of RRset, created again if replaced"""
+        key = (name, rdataset.rdtype, rdataset.covers)
+        cached = self.rrsets.get(key)
+        if cached is not None and cached.matches(rdataset):
+            return cached
+        res = canonical_rrset(name, rdataset, self.origin, keep=True)
+        with self.lock:
+            if key not in self.rrsets:
+                self.names[name] = self.names.get(name, ()) + (key,)
+            self.rrsets[key] = res
+        return res
@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, TextIO
+
+import dns.name
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+
+from rollercoaster.unsigned import diff_zones
+
+logger = logging.getLogger(__name__)
+
+SERIAL_MODULO = 2**32
+SERIAL_HALF = 2**31
+
+
+def serial_gt(s1: int, s2: int) -> bool:
+    """Return True if serial s1 is greater than s2 (RFC 1982)"""
+    return s1 != s2 and (s1 - s2) % SERIAL_MODULO < SERIAL_HALF
+
+
+def next_serial(previous: Optional[int], serial: int) -> int:
+    """Return serial for the next version of a zone
+
+    The serial of the unsigned zone is used if it is ahead of the previous
+    serial, otherwise the previous serial is incremented.
+    """
+    if previous is None or serial_gt(serial, previous):
+        return serial
+    return (previous + 1) % SERIAL_MODULO
+
+
+class ZoneDiff:
+    """Difference between two versions of a zone (RFC 1995)"""
+
+    def __init__(
+        self,
+        old_soa: dns.rrset.RRset,
+        new_soa: dns.rrset.RRset,
+        deleted: List[dns.rrset.RRset],
+        added: List[dns.rrset.RRset],
+    ):
+        self.old_soa = old_soa
+        self.new_soa = new_soa
+        self.deleted = deleted
+        self.added = added
+
+    def __len__(self) -> int:
+        return sum(len(rrset) for rrset in self.deleted + self.added)
+
+    @property
+    def old_serial(self) -> int:
+        return self.old_soa[0].serial
+
+    @property
+    def new_serial(self) -> int:
+        return self.new_soa[0].serial
+
+    @classmethod
+    def from_zones(cls, old: dns.zone.Zone, new: dns.zone.Zone):
+        """Create difference between old and new zone
+
+        Raises ValueError unless the serial of the new zone is greater than
+        the serial of the old zone, as the difference would not be applied.
+        """
+        old_soa = old.find_rrset(old.origin, dns.rdatatype.SOA)
+        new_soa = new.find_rrset(new.origin, dns.rdatatype.SOA)
+        if not serial_gt(new_soa[0].serial, old_soa[0].serial):
+            raise ValueError(
+                f"Serial {new_soa[0].serial} does not follow {old_soa[0].serial}"
+            )
+        deleted = []
+        added = []
+        for name, old_rdataset, new_rdataset in diff_zones(old, new):
+            if (old_rdataset or new_rdataset).rdtype == dns.rdatatype.SOA:
+                continue
+            if old_rdataset is not None and new_rdataset is not None:
+                if old_rdataset.ttl == new_rdataset.ttl:
+                    # only include records that differ
+                    old_rdataset, new_rdataset = (
+                        old_rdataset.difference(new_rdataset),
+                        new_rdataset.difference(old_rdataset),
+                    )
+            if old_rdataset:
+                deleted.append(
+                    dns.rrset.from_rdata(name, old_rdataset.ttl, *old_rdataset)
+                )
+            if new_rdataset:
+                added.append(
+                    dns.rrset.from_rdata(name, new_rdataset.ttl, *new_rdataset)
+                )
+        return cls(
+            old_soa=old_soa,
+            new_soa=new_soa,
+            deleted=deleted,
+            added=added,
+        )
+
+    def to_file(self, fp: TextIO, t: Optional[int] = None) -> None:
+        """Write difference as IXFR response in master file format"""
+        now = (
+            datetime.fromtimestamp(t, tz=timezone.utc)
+            if t
+            else datetime.now(tz=timezone.utc)
+        )
+        origin = self.new_soa.name
+        print("; IXFR data file", file=fp)
+        print(f"; zone {origin}", file=fp)
+        print(f"; from_serial {self.old_serial}", file=fp)
+        print(f"; to_serial {self.new_serial}", file=fp)
+        print("; generated_by rollercoaster", file=fp)
+        print(f"; time {now.isoformat()}", file=fp)
+        print(self.new_soa.to_text(), file=fp)
+        print(self.old_soa.to_text(), file=fp)
+        for rrset in self.deleted:
+            print(rrset.to_text(), file=fp)
+        print(self.new_soa.to_text(), file=fp)
+        for rrset in self.added:
+            print(rrset.to_text(), file=fp)
+        print(self.new_soa.to_text(), file=fp)
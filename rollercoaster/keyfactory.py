@@ -0,0 +1,93 @@
+import logging
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional, Tuple, Type
+
+from dns.dnssecalgs import GenericPrivateKey
+
+from rollercoaster.keypair import KeyPair
+from rollercoaster.metrics import STAGE_DURATION, current_zone
+
+logger = logging.getLogger(__name__)
+
+
+def _generate_pem(
+    private_cls: Type[GenericPrivateKey], kwargs: dict
+) -> Tuple[bytes, float]:
+    """Generate private key (executed in worker process)"""
+    t = time.perf_counter()
+    pem = private_cls.generate(**kwargs).to_pem()
+    return pem, time.perf_counter() - t
+
+
+class KeyFactory:
+    """Generate keys ahead of time in a worker process
+
+    Keys are requested by key specification and name, and returned as
+    key pairs once generated. Several factories (one per keyring) may
+    share the same worker process by passing the same executor.
+    """
+
+    def __init__(self, executor: Optional[ProcessPoolExecutor] = None):
+        self.shared = executor is not None
+        self.executor = executor or ProcessPoolExecutor(max_workers=1)
+        self.pending: List[Tuple[dict, KeyPair, Future]] = []
+
+    def shutdown(self) -> None:
+        if self.shared:
+            for _, _, future in self.pending:
+                future.cancel()
+        else:
+            self.executor.shutdown(cancel_futures=True)
+
+    def submit(self, keyspec: dict, name: str, ksk: bool) -> None:
+        """Request generation of key"""
+        keypair = KeyPair.new(
+            algorithm=keyspec["algorithm"],
+            ksk=ksk,
+            name=name,
+            algorithm_prefix=keyspec.get("algorithm_prefix"),
+        )
+        kwargs = {}
+        if key_size := keyspec.get("key_size"):
+            kwargs["key_size"] = key_size
+        future = self.executor.submit(
+            _generate_pem, keypair.get_algorithm_cls(), kwargs
+        )
+        self.pending.append((keyspec, keypair, future))
+        logger.debug("Requested pre-generation of %s", name)
+
+    def _finish(self, keypair: KeyPair, future: Future) -> KeyPair:
+        pem, elapsed = future.result()
+        keypair.private_key_pem = pem
+        keypair.keytag = keypair.get_keytag()
+        STAGE_DURATION.observe(elapsed, zone=current_zone.get(), stage="pregenerate")
+        logger.info(
+            "Pre-generated %s keytag=%d in %.3f seconds",
+            keypair.name,
+            keypair.keytag,
+            elapsed,
+        )
+        return keypair
+
+    def collect(self) -> List[Tuple[dict, KeyPair]]:
+        """Return keys generated so far"""
+        res = []
+        pending = []
+        for keyspec, keypair, future in self.pending:
+            if future.done():
+                res.append((keyspec, self._finish(keypair, future)))
+            else:
+                pending.append((keyspec, keypair, future))
+        self.pending = pending
+        return res
+
+    def take(self, keyspec: dict, name: str) -> Optional[KeyPair]:
+        """Return pending key matching key specification and name, waiting if needed"""
+        for i, (s, keypair, future) in enumerate(self.pending):
+            if s == keyspec and keypair.name == name:
+                del self.pending[i]
+                if not future.done():
+                    logger.warning("Waiting for pre-generation of %s", name)
+                return self._finish(keypair, future)
+        return None
@@ -1,18 +1,28 @@
+import base64
+import hashlib
 import logging
-from dataclasses import dataclass
-from typing import Optional, Union
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
 
 import dns.dnssec
+import dns.name
+import dns.rdataclass
 import dns.rdatatype
 import dns.zone
 import dns.zonefile
 from dns.dnssecalgs import GenericPrivateKey, get_algorithm_cls
-from dns.dnssectypes import Algorithm
+from dns.dnssectypes import Algorithm, DSDigest
 from dns.rdtypes.ANY.DNSKEY import DNSKEY
+from dns.rdtypes.ANY.DS import DS
 from dns.rdtypes.dnskeybase import Flag
 
 logger = logging.getLogger(__name__)
 
+# changing any of these invalidates cached DNSKEY, key tag and DS
+KEY_MATERIAL_ATTRIBUTES = set(["algorithm", "private_key", "algorithm_prefix"])
+
+DNSKEY_PROTOCOL = 3
+
 
 PRETTY_ALGORTIHM = {
     Algorithm.RSAMD5: "RSA/MD5",
@@ -30,10 +40,30 @@ PRETTY_ALGORTIHM = {
 }
 
 
+class LazyPrivateKey:
+    """Private key parsed from PEM on first use"""
+
+    def __set_name__(self, owner, name):
+        self.attr = f"_{name}"
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return None
+        private_key = obj.__dict__.get(self.attr)
+        if private_key is None and obj.private_key_pem is not None:
+            private_key = obj.get_algorithm_cls().from_pem(obj.private_key_pem)
+            obj.__dict__[self.attr] = private_key
+            logger.debug("Loaded private key %s", obj.name)
+        return private_key
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.attr] = value
+
+
 @dataclass
 class KeyPair:
     algorithm: Algorithm
-    private_key: GenericPrivateKey
+    private_key: Optional[GenericPrivateKey] = LazyPrivateKey()
     ksk: bool = False
     revoked: bool = False
     sign: bool = False
@@ -41,13 +71,18 @@ class KeyPair:
     keytag: Optional[int] = None
     name: Optional[str] = None
     algorithm_prefix: Optional[str] = None
+    private_key_pem: Optional[bytes] = field(default=None, repr=False, compare=False)
+    public_key: Optional[bytes] = field(default=None, repr=False, compare=False)
 
     @property
     def flags(self) -> int:
+        return self.get_flags()
+
+    def get_flags(self, revoked: Optional[bool] = None) -> int:
+        """Return flags, optionally for another revocation state"""
+        revoked = self.revoked if revoked is None else revoked
         return (
-            Flag.ZONE
-            | (Flag.REVOKE if self.revoked else 0)
-            | (Flag.SEP if self.ksk else 0)
+            Flag.ZONE | (Flag.REVOKE if revoked else 0) | (Flag.SEP if self.ksk else 0)
         )
 
     @property
@@ -56,38 +91,123 @@ class KeyPair:
 
     @property
     def dnskey(self) -> DNSKEY:
-        return self.private_key.public_key().to_dnskey(flags=self.flags)
+        return self.get_dnskey()
+
+    @property
+    def pem(self) -> bytes:
+        if self.private_key_pem is None:
+            self.private_key_pem = self.private_key.to_pem()
+        return self.private_key_pem
+
+    @property
+    def key_id(self) -> str:
+        """Identifier of key material"""
+        return hashlib.sha256(self.pem).hexdigest()[:16]
+
+    def __setattr__(self, name, value):
+        if name in KEY_MATERIAL_ATTRIBUTES:
+            self.__dict__.pop("_cache", None)
+        if name == "private_key" and value is not None:
+            # PEM and public key are derived from the new private key
+            self.__dict__["private_key_pem"] = None
+            self.__dict__["public_key"] = None
+        super().__setattr__(name, value)
 
-    def as_dict(self, export: bool = True) -> dict:
+    def get_algorithm_cls(self):
+        return get_algorithm_cls(
+            self.algorithm,
+            (
+                dns.name.from_text(self.algorithm_prefix)
+                if self.algorithm_prefix
+                else None
+            ),
+        )
+
+    def _cached(self, key: tuple, factory: Callable):
+        cache = self.__dict__.setdefault("_cache", {})
+        if key not in cache:
+            cache[key] = factory()
+        return cache[key]
+
+    def get_dnskey(self, flags: Optional[int] = None) -> DNSKEY:
+        """Return DNSKEY for flags (default current flags)"""
+        flags = self.flags if flags is None else int(flags)
+        return self._cached(("dnskey", flags), lambda: self._make_dnskey(flags))
+
+    def _make_dnskey(self, flags: int) -> DNSKEY:
+        if self.public_key is None:
+            dnskey = self.private_key.public_key().to_dnskey(flags=flags)
+            self.public_key = dnskey.key
+            return dnskey
+        return DNSKEY(
+            rdclass=dns.rdataclass.IN,
+            rdtype=dns.rdatatype.DNSKEY,
+            flags=flags,
+            protocol=DNSKEY_PROTOCOL,
+            algorithm=self.algorithm,
+            key=self.public_key,
+        )
+
+    def get_keytag(self, flags: Optional[int] = None) -> int:
+        """Return key tag for flags (default current flags)"""
+        flags = self.flags if flags is None else int(flags)
+        return self._cached(
+            ("keytag", flags),
+            lambda: dns.dnssec.key_id(self.get_dnskey(flags)),
+        )
+
+    def get_ds(
+        self,
+        name: dns.name.Name,
+        flags: Optional[int] = None,
+        digest: DSDigest = DSDigest.SHA256,
+    ) -> DS:
+        """Return DS for owner name and flags (default current flags)"""
+        flags = self.flags if flags is None else int(flags)
+        return self._cached(
+            ("ds", flags, name, digest),
+            lambda: dns.dnssec.make_ds(
+                name=name, key=self.get_dnskey(flags), algorithm=digest
+            ),
+        )
+
+    def as_dict(self, export: bool = True, include_private_key: bool = True) -> dict:
         res = {
             "name": self.name,
             "algorithm": self.algorithm,
-            "keytag": self.keytag,
+            "keytag": self.keytag if export else self.get_keytag(),
             "ksk": self.ksk,
             "sign": self.sign,
             "publish": self.publish,
             "revoked": self.revoked,
-            "private_key": self.private_key.to_pem().decode(),
         }
+        if include_private_key:
+            res["private_key"] = self.pem.decode()
         if self.algorithm_prefix:
             res["algorithm_prefix"] = str(self.algorithm_prefix)
         if not export:
             res["algorithm_name"] = self.algorithm_name
         return res
 
+    def as_state(self) -> dict:
+        """Return key state with reference to key material"""
+        res = self.as_dict(include_private_key=False)
+        res["key_id"] = self.key_id
+        res["public_key"] = base64.b64encode(self.get_dnskey().key).decode()
+        return res
+
     @classmethod
-    def from_dict(cls, data: dict):
-        algorithm = Algorithm(data["algorithm"])
-        algorithm_prefix = data.get("algorithm_prefix")
-        algorithm_cls = get_algorithm_cls(
-            algorithm,
-            dns.name.from_text(algorithm_prefix) if algorithm_prefix else None,
-        )
-        private_key = algorithm_cls.from_pem(data["private_key"].encode())
+    def from_dict(cls, data: dict, private_key_pem: Optional[bytes] = None):
+        """Create key pair, private key is parsed when first used"""
+        if "private_key" in data:
+            private_key_pem = data["private_key"].encode()
+        public_key = data.get("public_key")
         return cls(
-            algorithm=algorithm,
-            algorithm_prefix=algorithm_prefix,
-            private_key=private_key,
+            algorithm=Algorithm(data["algorithm"]),
+            algorithm_prefix=data.get("algorithm_prefix"),
+            private_key=None,
+            private_key_pem=private_key_pem,
+            public_key=base64.b64decode(public_key) if public_key else None,
             ksk=data.get("ksk", False),
             revoked=data.get("revoked", False),
             sign=data.get("sign", True),
@@ -97,34 +217,43 @@ class KeyPair:
         )
 
     @classmethod
-    def generate(
+    def new(
         cls,
         algorithm: Union[str, int, Algorithm],
-        key_size: Optional[int] = None,
         ksk: bool = False,
         name: Optional[str] = None,
         algorithm_prefix: Optional[str] = None,
     ):
+        """Create key pair without key material"""
         if isinstance(algorithm, str):
             algorithm = Algorithm[algorithm.upper()]
         if not isinstance(algorithm, Algorithm):
             algorithm = Algorithm(int(algorithm))
-        kwargs = {}
-        if key_size:
-            kwargs["key_size"] = key_size
-        algorithm_cls = get_algorithm_cls(
-            algorithm,
-            dns.name.from_text(algorithm_prefix) if algorithm_prefix else None,
-        )
-        private_key = algorithm_cls.generate(**kwargs)
-        res = cls(
+        return cls(
             name=name,
             algorithm=algorithm,
-            private_key=private_key,
+            private_key=None,
             ksk=ksk,
             algorithm_prefix=algorithm_prefix,
         )
-        res.keytag = dns.dnssec.key_id(res.dnskey)
+
+    @classmethod
+    def generate(
+        cls,
+        algorithm: Union[str, int, Algorithm],
+        key_size: Optional[int] = None,
+        ksk: bool = False,
+        name: Optional[str] = None,
+        algorithm_prefix: Optional[str] = None,
+    ):
+        kwargs = {}
+        if key_size:
+            kwargs["key_size"] = key_size
+        res = cls.new(
+            algorithm=algorithm, ksk=ksk, name=name, algorithm_prefix=algorithm_prefix
+        )
+        res.private_key = res.get_algorithm_cls().generate(**kwargs)
+        res.keytag = res.get_keytag()
         logger.debug(
             "Generated %s (%d) keytag=%d, ksk=%s",
             res.algorithm.name,
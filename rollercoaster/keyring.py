@@ -1,25 +1,58 @@
 import json
 import logging
-from typing import List, Optional
+import os
+from typing import Dict, List, Optional, Set, Tuple
 
 import dns.dnssec
 import dns.zone
 
+from rollercoaster.canonical import CanonicalCache
+from rollercoaster.keyfactory import KeyFactory
 from rollercoaster.keypair import KeyPair
+from rollercoaster.nsec import NsecChain
+from rollercoaster.publish import write_atomic
+from rollercoaster.schedule import (
+    DOUBLE,
+    HYBRID,
+    PUBLISH,
+    REVOKE,
+    SIGN,
+    SINGLE,
+    Schedule,
+)
+from rollercoaster.sigcache import SignatureCache
+from rollercoaster.signing import RRsetSigner, SigningPool
+from rollercoaster.utils import cmtimer
 
 logger = logging.getLogger(__name__)
 
 
 class KeyRing:
-    def __init__(self, keyspecs: List[dict] = [], filename: Optional[str] = None):
+    schedule = DOUBLE
+
+    def __init__(
+        self,
+        keyspecs: List[dict] = [],
+        filename: Optional[str] = None,
+        schedule: Optional[Schedule] = None,
+        factory: Optional[KeyFactory] = None,
+        keypairs: Optional[List[Dict[str, KeyPair]]] = None,
+    ):
         self.filename = filename
         self.keyspecs = keyspecs
-        self.keypairs = None
-        if self.filename:
-            try:
-                self.load(self.filename)
-            except FileNotFoundError:
-                logger.warning("Generating new keys")
+        self.keypairs = keypairs
+        self.staged: List[Tuple[dict, KeyPair]] = []
+        self.factory = factory
+        self.saved_material: Set[str] = set()
+        self.saved_state: Optional[bytes] = None
+        if schedule is not None:
+            self.schedule = schedule
+        # only a missing keyring file means new keys, a missing key
+        # material file must never replace the keys in use
+        if self.filename and os.path.exists(self.filename):
+            self.load(self.filename)
+        elif self.filename:
+            logger.warning("Generating new keys")
         if self.keypairs is None:
             self.generate()
 
@@ -32,7 +65,7 @@ class KeyRing:
                         keypair.algorithm.name,
                         keypair.algorithm,
                         name,
-                        keypair.keytag,
+                        keypair.get_keytag(),
                         keypair.flags,
                         a,
                     )
@@ -42,7 +75,7 @@ class KeyRing:
                         keypair.algorithm.name,
                         keypair.algorithm,
                         name,
-                        keypair.keytag,
+                        keypair.get_keytag(),
                         keypair.flags,
                         a,
                     )
@@ -52,7 +85,7 @@ class KeyRing:
                         keypair.algorithm.name,
                         keypair.algorithm,
                         name,
-                        keypair.keytag,
+                        keypair.get_keytag(),
                         keypair.flags,
                         a,
                     )
@@ -64,37 +97,85 @@ class KeyRing:
         if self.keypairs is None:
             self.keypairs = [{} for _ in self.keyspecs]
 
+        quarters = self.schedule.quarters
+
         if quarter == 1 and slot == 1:
             del self.keypairs[1]["ksk"]
-            del self.keypairs[1]["zsk-q1"]
-            del self.keypairs[1]["zsk-q2"]
-            del self.keypairs[1]["zsk-q3"]
-            del self.keypairs[1]["zsk-q4"]
+            for q in range(1, quarters + 1):
+                del self.keypairs[1][f"zsk-q{q}"]
         if quarter == 1 and slot == 2:
-            del self.keypairs[0]["zsk-q4"]
+            del self.keypairs[0][f"zsk-q{quarters}"]
+
+        if self.factory is not None:
+            self.staged.extend(self.factory.collect())
 
         for a, keyspec in enumerate(self.keyspecs):
             prefix = "a" + str(int(keyspec["algorithm"]))
             if "ksk" not in self.keypairs[a]:
                 logger.info("Generating new KSK(%d)", a)
-                self.keypairs[a]["ksk"] = KeyPair.generate(
-                    name=f"{prefix}-ksk",
-                    ksk=True,
-                    **keyspec,
-                )
+                self.keypairs[a]["ksk"] = self.new_key(keyspec, f"{prefix}-ksk", True)
             else:
                 logger.debug("Keeping existing KSK(%d)", a)
-            for q in range(1, 5):
+            for q in range(1, quarters + 1):
                 if f"zsk-q{q}" not in self.keypairs[a]:
                     logger.info("Generating new ZSK(%d) for quarter %d", a, q)
-                    self.keypairs[a][f"zsk-q{q}"] = KeyPair.generate(
-                        name=f"{prefix}-zsk-q{q}",
-                        ksk=False,
-                        **keyspec,
+                    self.keypairs[a][f"zsk-q{q}"] = self.new_key(
+                        keyspec, f"{prefix}-zsk-q{q}", False
                     )
                 else:
                     logger.debug("Keeping existing ZSK(%d) for quarter %d", a, q)
 
+        self.pregenerate()
+
+    def new_key(self, keyspec: dict, name: str, ksk: bool) -> KeyPair:
+        """Return pre-generated key if available, otherwise generate key"""
+        for i, (s, keypair) in enumerate(self.staged):
+            if s == keyspec and keypair.name == name:
+                logger.info("Using pre-generated key %s", name)
+                del self.staged[i]
+                return keypair
+        if self.factory is not None:
+            if keypair := self.factory.take(keyspec, name):
+                return keypair
+        with cmtimer(f"Generating {name}", logger=logger, stage="generate"):
+            return KeyPair.generate(name=name, ksk=ksk, **keyspec)
+
+    def next_keys(self) -> List[Tuple[dict, str, bool]]:
+        """Return keys generated at the start of the next cycle"""
+        quarters = self.schedule.quarters
+        res = []
+        # all keys of the outgoing key set are replaced after rotation
+        keyspec = self.keyspecs[0]
+        prefix = "a" + str(int(keyspec["algorithm"]))
+        res.append((keyspec, f"{prefix}-ksk", True))
+        for q in range(1, quarters + 1):
+            res.append((keyspec, f"{prefix}-zsk-q{q}", False))
+        # as is the ZSK of the last quarter of the incoming key set
+        keyspec = self.keyspecs[1]
+        prefix = "a" + str(int(keyspec["algorithm"]))
+        res.append((keyspec, f"{prefix}-zsk-q{quarters}", False))
+        return res
+
+    def pregenerate(self) -> None:
+        """Request keys for the next cycle not already staged or pending"""
+        if self.factory is None:
+            return
+        staged = self.staged
+        pending = [(s, k.name) for s, k, _ in self.factory.pending]
+        self.staged = []
+        for keyspec, name, ksk in self.next_keys():
+            for i, (s, keypair) in enumerate(staged):
+                if s == keyspec and keypair.name == name:
+                    self.staged.append(staged.pop(i))
+                    break
+            else:
+                if (keyspec, name) in pending:
+                    pending.remove((keyspec, name))
+                else:
+                    self.factory.submit(keyspec, name, ksk)
+        for _, keypair in staged:
+            logger.info("Discarding pre-generated key %s", keypair.name)
+
     def delete(self, keyset: int, quarter: int, ksk: bool = False):
         """Delete specific key (to trigger new key generation)"""
         name = "ksk" if ksk else f"zsk-q{quarter}"
@@ -113,138 +194,165 @@ class KeyRing:
                 key.sign = False
                 key.revoked = False
 
-    def save(self, filename: Optional[str] = None) -> None:
+    @staticmethod
+    def material_path(filename: str) -> str:
+        """Return directory of key material for keyring file"""
+        return os.path.splitext(filename)[0] + ".keys"
+
+    def save_material(self, filename: Optional[str] = None) -> Set[str]:
+        """Save key material not already saved and return key ids in use"""
+        path = self.material_path(self.filename or filename)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        key_ids = set()
+        keypairs = [key for _, key in self.staged]
+        for keys in self.keypairs:
+            keypairs.extend(keys.values())
+        for key in keypairs:
+            key_id = key.key_id
+            key_ids.add(key_id)
+            key_filename = os.path.join(path, f"{key_id}.pem")
+            if key_id not in self.saved_material and not os.path.exists(key_filename):
+                logger.info("Saving key material %s to %s", key.name, path)
+                write_atomic(key_filename, key.pem, sync=True, mode=0o600)
+        # key material is removed one save after it was last referenced, as
+        # the previous state file may still be in use until replaced
+        for key_filename in os.listdir(path):
+            key_id, ext = os.path.splitext(key_filename)
+            if ext == ".pem" and key_id not in key_ids | self.saved_material:
+                logger.info("Removing key material %s", key_id)
+                os.unlink(os.path.join(path, key_filename))
+        self.saved_material = key_ids
+        return key_ids
+
+    def state(self) -> bytes:
+        """Return keyring state as saved"""
         keyring_dict = {
             "keyspecs": self.keyspecs,
             "keys": [
-                {name: key.as_dict() for name, key in keys.items()}
+                {name: key.as_state() for name, key in keys.items()}
                 for keys in self.keypairs
             ],
         }
-        filename = filename or self.filename
-        with open(filename, "wt") as fp:
-            logger.info("Saving keys to %s", filename)
-            json.dump(keyring_dict, fp, indent=4)
+        if self.staged:
+            keyring_dict["staged"] = [
+                {"keyspec": keyspec, **key.as_state()} for keyspec, key in self.staged
+            ]
+        return json.dumps(keyring_dict, separators=(",", ":")).encode()
+
+    def changed(self) -> bool:
+        """Check if state differs from the state in the keyring file"""
+        try:
+            with open(self.filename, "rb") as fp:
+                return fp.read() != self.state()
+        except FileNotFoundError:
+            return True
+
+    def save(self, filename: Optional[str] = None) -> None:
+        """Save keyring state, written to filename or atomically replaced"""
+        self.save_material(filename)
+        data = self.state()
+        if filename:
+            logger.info("Saving keyring state to %s", filename)
+            with open(filename, "wb") as fp:
+                fp.write(data)
+        elif data != self.saved_state:
+            logger.info("Saving keyring state to %s", self.filename)
+            write_atomic(self.filename, data, sync=True)
+        self.saved_state = data
+
+    def export(self) -> dict:
+        """Return keyspecs and keys including key material"""
+        return {
+            "keyspecs": self.keyspecs,
+            "keys": [
+                {
+                    name: {**key.as_state(), "private_key": key.pem.decode()}
+                    for name, key in keys.items()
+                }
+                for keys in self.keypairs
+            ],
+        }
+
+    @classmethod
+    def from_export(cls, data: dict, loaded: Optional[Dict[str, KeyPair]] = None):
+        """Create keyring from exported keys
+
+        Key pairs in loaded (by private key) are reused with the exported
+        key state, to avoid parsing the same key material again.
+        """
+        loaded = {} if loaded is None else loaded
+        keypairs = []
+        for keys in data["keys"]:
+            keypairs.append({})
+            for name, key_dict in keys.items():
+                keypair = loaded.get(key_dict["private_key"])
+                if keypair is None:
+                    keypair = KeyPair.from_dict(key_dict)
+                    loaded[key_dict["private_key"]] = keypair
+                else:
+                    keypair.sign = key_dict["sign"]
+                    keypair.publish = key_dict["publish"]
+                    keypair.revoked = key_dict["revoked"]
+                keypairs[-1][name] = keypair
+        return cls(keyspecs=data["keyspecs"], keypairs=keypairs)
 
     def load(self, filename: str) -> None:
-        with open(filename, "rt") as fp:
+        with open(filename, "rb") as fp:
             logger.info("Loading keys from %s", filename)
-            keyring_dict = json.load(fp)
+            data = fp.read()
+        keyring_dict = json.loads(data)
+        path = self.material_path(filename)
         self.keyspecs = keyring_dict["keyspecs"]
         self.keypairs = [
             {
-                name: KeyPair.from_dict(key_dict)
-                for name, key_dict in keyring_dict.items()
+                name: self.load_key(path, key_dict)
+                for name, key_dict in keys_dict.items()
             }
-            for keyring_dict in keyring_dict["keys"]
+            for keys_dict in keyring_dict["keys"]
         ]
+        self.staged = []
+        for key_dict in keyring_dict.get("staged", []):
+            keyspec = key_dict.pop("keyspec")
+            self.staged.append((keyspec, self.load_key(path, key_dict)))
+        self.saved_state = data
+
+    def load_key(self, path: str, key_dict: dict) -> KeyPair:
+        if "private_key" in key_dict:
+            # key material held inline, as in keyrings saved by earlier versions
+            return KeyPair.from_dict(key_dict)
+        key_id = key_dict["key_id"]
+        with open(os.path.join(path, f"{key_id}.pem"), "rb") as fp:
+            private_key_pem = fp.read()
+        self.saved_material.add(key_id)
+        return KeyPair.from_dict(key_dict, private_key_pem)
 
     @classmethod
     def from_file(cls, filename: str):
         res = KeyRing()
+        res.filename = filename
         res.load(filename)
         return res
 
     def update(self, quarter: int, slot: int) -> None:
         """Update keyring based on quarter and slot"""
 
-        self.reset()
-
-        a1 = self.keypairs[0]
-        a2 = self.keypairs[1]
-
-        if quarter == 1:
-            a1["ksk"].publish = True
-            a1["ksk"].sign = True
-            a1["zsk-q1"].publish = True
-            a1["zsk-q1"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["zsk-q4"].publish = True
-
-            if slot == 9:
-                # pre-publication
-                a1["zsk-q2"].publish = True
-
-        elif quarter == 2:
-            a1["ksk"].publish = True
-            a1["ksk"].sign = True
-            a1["zsk-q2"].publish = True
-            a1["zsk-q2"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["zsk-q1"].publish = True
-
-            if slot > 1:
-                # introduce new KSK
-                a2["ksk"].publish = True
-                a2["ksk"].sign = True
-                a2["zsk-q2"].publish = True
-                a2["zsk-q2"].sign = True
-
-            if slot == 9:
-                # post-publication
-                a1["zsk-q3"].publish = True
-                a2["zsk-q3"].publish = True
-
-        elif quarter == 3:
-            a1["ksk"].publish = True
-            a1["ksk"].sign = True
-            a1["zsk-q3"].publish = True
-            a1["zsk-q3"].sign = True
-
-            a2["ksk"].publish = True
-            a2["ksk"].sign = True
-            a2["zsk-q3"].publish = True
-            a2["zsk-q3"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["zsk-q2"].publish = True
-                a2["zsk-q2"].publish = True
-            if slot == 9:
-                # pre-publication
-                a1["zsk-q4"].publish = True
-                a2["zsk-q4"].publish = True
-
-        elif quarter == 4:
-            a1["ksk"].publish = True
-            a1["ksk"].sign = True
-            a1["zsk-q4"].publish = True
-            a1["zsk-q4"].sign = True
-
-            a2["ksk"].publish = True
-            a2["ksk"].sign = True
-            a2["zsk-q4"].publish = True
-            a2["zsk-q4"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["zsk-q3"].publish = True
-                a2["zsk-q3"].publish = True
-
-            if slot > 1:
-                a1["zsk-q4"].publish = False
-                a1["zsk-q4"].sign = False
-
-            if slot > 1 and slot < 9:
-                # revokation
-                a1["ksk"].revoked = True
-
-            if slot == 9:
-                # pre-publication
-                a1["ksk"].publish = False
-                a1["ksk"].sign = False
-                a2["zsk-q1"].publish = True
-
-                # drop alg 1
-                a1["ksk"].publish = False
-                a1["ksk"].sign = False
+        for a, keys in self.enumerate():
+            for name, keypair in keys.items():
+                state = self.schedule.get(quarter, slot, a, name)
+                keypair.publish = bool(state & PUBLISH)
+                keypair.sign = bool(state & SIGN)
+                keypair.revoked = bool(state & REVOKE)
 
     def sign_zone(
-        self, zone: dns.zone.Zone, lifetime: int = 3600, dnskey_ttl: int = 60
+        self,
+        zone: dns.zone.Zone,
+        lifetime: int = 3600,
+        dnskey_ttl: int = 60,
+        inception: Optional[int] = None,
+        cache: Optional[SignatureCache] = None,
+        pool: Optional[SigningPool] = None,
+        chain: Optional[NsecChain] = None,
+        canonical: Optional[CanonicalCache] = None,
     ):
         keypairs = []
         for _, k in enumerate(self.keypairs):
@@ -252,141 +360,47 @@ class KeyRing:
 
         keys = []
         dnskeys = []
+        keytags = set()
         for keypair in keypairs:
             dnskey = keypair.dnskey
+            keytags.add((keypair.get_keytag(), dnskey.algorithm))
             if keypair.publish:
                 dnskeys.append(dnskey)
             if keypair.sign:
                 keys.append((keypair.private_key, dnskey))
 
+        rrset_signer = RRsetSigner(
+            signer=zone.origin,
+            keys=keys,
+            lifetime=lifetime,
+            inception=inception,
+            policy=dns.dnssec.allow_all_policy,
+            cache=cache,
+            pool=pool,
+            canonical=canonical,
+        )
+
+        if chain is None:
+            chain = NsecChain.from_zone(zone)
+
         with zone.writer() as txn:
             for dnskey in dnskeys:
                 txn.add(zone.origin, dnskey_ttl, dnskey)
-            dns.dnssec.sign_zone(
-                zone=zone,
-                add_dnskey=False,
-                keys=keys,
-                lifetime=lifetime,
-                txn=txn,
-                policy=dns.dnssec.allow_all_policy,
-            )
+            chain.sign(zone, txn, rrset_signer)
+            rrset_signer.flush(txn)
+        rrset_signer.update_metrics()
+
+        if cache is not None:
+            cache.expunge(rrset_signer.inception, keys=keytags)
 
 
 class KeyRingDoubleSigner(KeyRing):
-    pass
+    schedule = DOUBLE
 
 
 class KeyRingSingleSigner(KeyRing):
-    def update(self, quarter: int, slot: int) -> None:
-        """Update keyring based on quarter and slot"""
-
-        self.reset()
-
-        a1 = self.keypairs[0]
-        a2 = self.keypairs[1]
-
-        if quarter == 1:
-            a1["ksk"].publish = True
-            a1["ksk"].sign = True
-            a1["zsk-q1"].publish = True
-            a1["zsk-q1"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["zsk-q4"].publish = True
-
-            if slot == 9:
-                # pre-publication
-                a1["zsk-q2"].publish = True
-
-        elif quarter == 2:
-            a1["ksk"].publish = True
-            a1["ksk"].sign = True
-            a1["zsk-q2"].publish = True
-            a1["zsk-q2"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["zsk-q1"].publish = True
-
-            if slot > 1:
-                # introduce new KSK
-                a2["ksk"].publish = True
-                a2["ksk"].sign = False
-                a2["zsk-q2"].publish = False
-                a2["zsk-q2"].sign = False
-
-            if slot == 9:
-                # post-publication
-                a1["zsk-q3"].publish = True
-                a2["zsk-q3"].publish = False
-
-        elif quarter == 3:
-            # a1["ksk"].publish = True
-            # a1["ksk"].sign = True
-            a1["zsk-q3"].publish = False
-            a1["zsk-q3"].sign = False
-
-            a2["ksk"].publish = True
-            a2["ksk"].sign = True
-            a2["zsk-q3"].publish = True
-            a2["zsk-q3"].sign = True
-
-            if slot == 1:
-                # post-publication
-                a1["ksk"].publish = True
-                a1["zsk-q2"].publish = True
-                a2["zsk-q2"].publish = False
-            if slot == 9:
-                # pre-publication
-                a2["zsk-q4"].publish = True
-
-        elif quarter == 4:
-            a1["ksk"].publish = False
-            a1["ksk"].sign = False
-            a1["zsk-q4"].publish = False
-            a1["zsk-q4"].sign = False
-
-            a2["ksk"].publish = True
-            a2["ksk"].sign = True
-            a2["zsk-q4"].publish = True
-            a2["zsk-q4"].sign = True
-
-            if slot == 1:
-                # post-publication
-                # a1["ksk"].publish = True
-                # a1["ksk"].sign = True
-                a1["zsk-q3"].publish = False
-                a2["zsk-q3"].publish = True
-
-            if slot > 1:
-                a1["zsk-q4"].publish = False
-                a1["zsk-q4"].sign = False
-
-            if slot > 1 and slot < 9:
-                # revocation
-                a1["ksk"].sign = True
-                a1["ksk"].publish = True
-                a1["ksk"].revoked = True
-
-            if slot == 9:
-                # pre-publication
-                a1["ksk"].publish = False
-                a1["ksk"].sign = False
-                a2["zsk-q1"].publish = True
-
-                # drop alg 1
-                a1["ksk"].publish = False
-                a1["ksk"].sign = False
+    schedule = SINGLE
 
 
 class KeyRingHybridSigner(KeyRingDoubleSigner):
-    def update(self, quarter: int, slot: int) -> None:
-        """Update keyring based on quarter and slot"""
-
-        super().update(quarter, slot)
-
-        a2 = self.keypairs[1]
-
-        if quarter == 1 or (quarter == 2 and slot == 1):
-            a2["ksk"].publish = True
+    schedule = HYBRID
@@ -0,0 +1,255 @@
+import abc
+import contextvars
+import http.server
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+DEFAULT_PORT = 9153
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+# zone the metrics recorded belong to, set while working on a zone and
+# carried over to threads doing work for it
+current_zone: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_zone", default=""
+)
+
+
+@contextmanager
+def zone_context(zone: str):
+    """Record metrics as belonging to zone"""
+    token = current_zone.set(zone)
+    try:
+        yield
+    finally:
+        current_zone.reset(token)
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric(abc.ABC):
+    """Metric with optional labels, in Prometheus text exposition format"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} requires labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        pass
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self.lock:
+            return [
+                ("", format_labels(self.labelnames, key), value)
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = sorted(buckets) + [math.inf]
+        self.values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        res = []
+        labelnames = self.labelnames + ("le",)
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = format_labels(labelnames, key + (format_value(bound),))
+                    res.append(("_bucket", labels, count))
+                labels = format_labels(self.labelnames, key)
+                res.append(("_sum", labels, total))
+                res.append(("_count", labels, counts[-1]))
+        return res
+
+
+class Registry:
+    """Collection of metrics exposed together"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        return "".join(metric.expose() for metric in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(
+    Histogram(
+        "rollercoaster_stage_duration_seconds",
+        "Duration of pipeline stages",
+        ["zone", "stage"],
+    )
+)
+SIGNATURES_CREATED = REGISTRY.register(
+    Counter(
+        "rollercoaster_signatures_created_total",
+        "Signatures created",
+        ["algorithm", "role"],
+    )
+)
+SIGNATURES_REUSED = REGISTRY.register(
+    Counter(
+        "rollercoaster_signatures_reused_total",
+        "Signatures reused from the signature cache",
+        ["algorithm", "role"],
+    )
+)
+SLOT_OVERRUNS = REGISTRY.register(
+    Counter(
+        "rollercoaster_slot_overruns_total",
+        "Slots published late",
+    )
+)
+SLOT_MARGIN = REGISTRY.register(
+    Gauge(
+        "rollercoaster_slot_margin_seconds",
+        "Time left until the start of the slot when all output was ready",
+    )
+)
+CURRENT_QUARTER = REGISTRY.register(
+    Gauge(
+        "rollercoaster_quarter",
+        "Current quarter",
+        ["zone"],
+    )
+)
+CURRENT_SLOT = REGISTRY.register(
+    Gauge(
+        "rollercoaster_slot",
+        "Current slot",
+        ["zone"],
+    )
+)
+VERIFICATION_FAILURES = REGISTRY.register(
+    Counter(
+        "rollercoaster_verification_failures_total",
+        "Slots not published as the signed zone failed verification",
+        ["zone"],
+    )
+)
+RELOAD_STATUS = REGISTRY.register(
+    Gauge(
+        "rollercoaster_reload_status",
+        "Exit status of last reload command (-1 if failed to run or timed out)",
+        ["zone"],
+    )
+)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        data = self.registry.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class MetricsServer:
+    """HTTP server exposing metrics in a separate thread"""
+
+    def __init__(self, address: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self.httpd = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        self.thread: Optional[threading.Thread] = None
+        logger.info("Serving metrics on %s port %d", address, port)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,178 @@
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+import dns.name
+import dns.node
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+import dns.transaction
+import dns.zone
+from dns.rdtypes.ANY.NSEC import NSEC, Bitmap
+
+logger = logging.getLogger(__name__)
+
+MANDATORY_RDTYPES = frozenset([dns.rdatatype.RRSIG, dns.rdatatype.NSEC])
+
+# signs the RRset given by owner name and rdataset, adding signatures to the
+# transaction
+RRsetSigner = Callable[
+    [dns.transaction.Transaction, dns.name.Name, dns.rdataset.Rdataset], None
+]
+
+
+class NsecChain:
+    """NSEC chain over canonically sorted owner names
+
+    The chain holds all owner names in the zone except names below
+    delegations, and is updated name by name as the zone changes. NSEC
+    records are kept between signing passes and only created again when
+    the next name or the types at a name have changed. The chain may be
+    shared by zones signed in parallel, so the chain is only changed while
+    holding the lock. Names are only added and removed between signing
+    passes, while NSEC records are created during them.
+    """
+
+    def __init__(self, origin: dns.name.Name, rdclass=dns.rdataclass.IN):
+        self.origin = origin
+        self.rdclass = rdclass
+        self.names: List[dns.name.Name] = []
+        self.delegations: Set[dns.name.Name] = set()
+        self.nsecs: Dict[
+            dns.name.Name,
+            Tuple[dns.name.Name, FrozenSet[int], int, dns.rrset.RRset],
+        ] = {}
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_zone(cls, zone: dns.zone.Zone):
+        """Create chain for all names in zone"""
+        res = cls(zone.origin, zone.rdclass)
+        delegation = None
+        for name in sorted(zone.keys()):
+            if delegation is not None and name.is_subdomain(delegation):
+                continue
+            node = zone.get_node(name)
+            if not node:
+                continue
+            if res.is_delegation(name, node):
+                delegation = name
+                res.delegations.add(name)
+            else:
+                delegation = None
+            res.names.append(name)
+        logger.debug("Created NSEC chain with %d names", len(res.names))
+        return res
+
+    def is_delegation(self, name: dns.name.Name, node: dns.node.Node) -> bool:
+        return (
+            name != self.origin
+            and node.get_rdataset(self.rdclass, dns.rdatatype.NS) is not None
+        )
+
+    def is_below_delegation(self, name: dns.name.Name) -> bool:
+        while len(name) > len(self.origin) + 1:
+            name = name.parent()
+            if name in self.delegations:
+                return True
+        return False
+
+    def update(self, zone: dns.zone.Zone, name: dns.name.Name) -> None:
+        """Update chain after RRsets at name have been changed"""
+        with self.lock:
+            node = zone.get_node(name)
+            i = bisect.bisect_left(self.names, name)
+            present = i < len(self.names) and self.names[i] == name
+            secure = bool(node) and not self.is_below_delegation(name)
+
+            if secure and not present:
+                self.names.insert(i, name)
+            elif present and not secure:
+                del self.names[i]
+                self.nsecs.pop(name, None)
+
+            # the previous name now has another next name
+            if secure != present and i > 0:
+                self.nsecs.pop(self.names[i - 1], None)
+
+            delegation = secure and self.is_delegation(name, node)
+            if delegation and name not in self.delegations:
+                self.delegations.add(name)
+                # names below the new delegation are no longer part of the chain
+                start = end = i + 1
+                while end < len(self.names) and self.names[end].is_subdomain(name):
+                    self.delegations.discard(self.names[end])
+                    self.nsecs.pop(self.names[end], None)
+                    end += 1
+                del self.names[start:end]
+            elif not delegation and name in self.delegations:
+                self.delegations.discard(name)
+                # names below the former delegation are now part of the chain
+                below = [n for n in zone.keys() if n != name and n.is_subdomain(name)]
+                for n in sorted(below):
+                    self.update(zone, n)
+
+    def get_nsec(
+        self,
+        name: dns.name.Name,
+        next_name: dns.name.Name,
+        rdtypes: FrozenSet[int],
+        ttl: int,
+    ) -> dns.rrset.RRset:
+        """Return NSEC RRset for name, reused if unchanged"""
+        cached = self.nsecs.get(name)
+        if (
+            cached is not None
+            and cached[0] == next_name
+            and cached[1] == rdtypes
+            and cached[2] == ttl
+        ):
+            return cached[3]
+        rrset = dns.rrset.from_rdata(
+            name,
+            ttl,
+            NSEC(
+                rdclass=self.rdclass,
+                rdtype=dns.rdatatype.NSEC,
+                next=next_name,
+                windows=Bitmap.from_rdtypes(list(rdtypes)),
+            ),
+        )
+        with self.lock:
+            self.nsecs[name] = (next_name, rdtypes, ttl, rrset)
+        return rrset
+
+    def sign(
+        self,
+        zone: dns.zone.Zone,
+        txn: dns.transaction.Transaction,
+        rrset_signer: Optional[RRsetSigner] = None,
+    ) -> None:
+        """Sign RRsets and add NSEC chain (as dns.dnssec.sign_zone does)"""
+        ttl = zone.get_soa(txn).minimum
+        count = len(self.names)
+        for i, name in enumerate(self.names):
+            node = txn.get_node(name)
+            if not node:
+                continue
+            delegation = name in self.delegations
+            rdtypes = set(MANDATORY_RDTYPES)
+            for rdataset in list(node.rdatasets):
+                rdtypes.add(rdataset.rdtype)
+                if rrset_signer is None or rdataset.rdtype == dns.rdatatype.RRSIG:
+                    continue
+                if delegation and rdataset.rdtype != dns.rdatatype.DS:
+                    # do not sign delegations except DS records
+                    continue
+                rrset_signer(txn, name, rdataset)
+            next_name = self.names[i + 1] if i + 1 < count else self.origin
+            rrset = self.get_nsec(name, next_name, frozenset(rdtypes), ttl)
+            txn.add(rrset)
+            if rrset_signer is not None:
+                rrset_signer(txn, name, rrset)
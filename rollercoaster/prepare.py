@@ -0,0 +1,221 @@
+import functools
+import logging
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Type,
+    Union,
+)
+
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.ttl
+import dns.zone
+
+logger = logging.getLogger(__name__)
+
+EXCLUDE_RDTYPES = set(
+    [
+        dns.rdatatype.DNSKEY,
+        dns.rdatatype.RRSIG,
+        dns.rdatatype.NSEC,
+        dns.rdatatype.NSEC3,
+        dns.rdatatype.NSEC3PARAM,
+    ]
+)
+
+# characters requiring a full scan of a line to find the end of a record
+SPECIAL_CHARACTERS = set('()";\\')
+
+
+# fields are looked up once per distinct token
+@functools.lru_cache(maxsize=1024)
+def is_ttl(token: str) -> bool:
+    try:
+        dns.ttl.from_text(token)
+    except dns.ttl.BadTTL:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=1024)
+def is_rdclass(token: str) -> bool:
+    try:
+        dns.rdataclass.from_text(token)
+    except (dns.rdataclass.UnknownRdataclass, ValueError):
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=1024)
+def get_rdtype(token: str) -> Optional[dns.rdatatype.RdataType]:
+    try:
+        return dns.rdatatype.from_text(token)
+    except (dns.rdatatype.UnknownRdatatype, ValueError):
+        return None
+
+
+def paren_depth(line: str, depth: int) -> int:
+    """Return parenthesis depth after line, ignoring quoted strings and comments"""
+    quoted = False
+    escaped = False
+    for c in line:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif c == ";":
+            break
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+    return depth
+
+
+def master_file_records(lines: Iterable[str]) -> Iterator[str]:
+    """Split master file into records, which may span multiple lines"""
+    record: List[str] = []
+    depth = 0
+    for line in lines:
+        if not record and not line.strip():
+            continue
+        if depth or not SPECIAL_CHARACTERS.isdisjoint(line):
+            depth = paren_depth(line, depth)
+        record.append(line if line.endswith("\n") else line + "\n")
+        if depth <= 0:
+            yield "".join(record)
+            record = []
+            depth = 0
+    if record:
+        yield "".join(record)
+
+
+def record_fields(
+    record: str,
+) -> Tuple[Optional[str], Optional[str], Optional[dns.rdatatype.RdataType]]:
+    """Return owner name, TTL and type of record (if given)"""
+    tokens = record.split(";", 1)[0].replace("(", " ").replace(")", " ").split()
+    owner = None
+    if not record[0].isspace() and tokens:
+        owner = tokens.pop(0)
+    ttl = None
+    for token in tokens[:3]:
+        if ttl is None and is_ttl(token):
+            ttl = token
+        elif not is_rdclass(token):
+            return owner, ttl, get_rdtype(token)
+    return owner, ttl, None
+
+
+def filter_records(
+    lines: Iterable[str], exclude_rdtypes: Set[dns.rdatatype.RdataType]
+) -> Iterator[str]:
+    """Filter master file, dropping records of excluded types
+
+    Records of excluded types are dropped without being parsed. Records
+    following a dropped record may inherit its owner name and TTL, which
+    are then made explicit. Lines holding only comments are passed through
+    unchanged.
+    """
+    pending_owner = None
+    pending_ttl = None
+    default_ttl = False
+
+    for record in master_file_records(lines):
+        if record.startswith("$"):
+            if record[1:4].upper() == "TTL":
+                default_ttl = True
+            yield record
+            continue
+
+        owner, ttl, rdtype = record_fields(record)
+
+        if owner is None and rdtype is None:
+            # comment or blank content, nothing is inherited from it
+            yield record
+            continue
+
+        if rdtype in exclude_rdtypes:
+            pending_owner = owner or pending_owner
+            if not default_ttl:
+                pending_ttl = ttl or pending_ttl
+            continue
+
+        if owner is None and pending_owner is not None:
+            owner = pending_owner
+            record = owner + record
+        if ttl is None and pending_ttl is not None:
+            start = len(owner) if owner else 0
+            record = f"{owner or ''} {pending_ttl}{record[start:]}"
+        pending_owner = None
+        pending_ttl = None
+
+        yield record
+
+
+def replace_hints(
+    zone: dns.zone.Zone, hints_rrsets: Optional[List[dns.rrset.RRset]] = None
+) -> None:
+    """Replace apex NS and corresponding glue with hints"""
+    if not hints_rrsets:
+        return
+    with zone.writer() as txn:
+        exclude_glue = set()
+        rdataset = txn.get(zone.origin, dns.rdatatype.NS)
+        if rdataset:
+            exclude_glue.update([rr.target for rr in rdataset])
+            txn.delete(zone.origin, dns.rdatatype.NS)
+        for name in exclude_glue:
+            txn.delete(name, zone.rdclass, dns.rdatatype.A)
+            txn.delete(name, zone.rdclass, dns.rdatatype.AAAA)
+        for rrset in hints_rrsets:
+            txn.add(rrset)
+
+
+def prepare_zone(
+    zone: dns.zone.Zone, hints_rrsets: Optional[List[dns.rrset.RRset]] = None
+) -> None:
+    """Prepare zone by removing signatures and replace hints"""
+    with zone.writer() as txn:
+        for name, rdataset in txn.iterate_rdatasets():
+            if rdataset.rdtype in EXCLUDE_RDTYPES:
+                txn.delete(name, rdataset)
+    replace_hints(zone, hints_rrsets)
+
+
+def read_zone(
+    source: Union[str, TextIO],
+    origin: Union[str, dns.name.Name],
+    hints_rrsets: Optional[List[dns.rrset.RRset]] = None,
+    zone_factory: Type[dns.zone.Zone] = dns.zone.Zone,
+) -> dns.zone.Zone:
+    """Read and prepare zone from master file
+
+    DNSSEC records are dropped while reading, so the signed zone is never
+    parsed as a whole.
+    """
+    if isinstance(source, str):
+        with open(source) as fp:
+            return read_zone(fp, origin, hints_rrsets, zone_factory)
+    text = "".join(filter_records(source, EXCLUDE_RDTYPES))
+    zone = dns.zone.from_text(
+        text,
+        origin=origin,
+        relativize=False,
+        zone_factory=zone_factory,
+        filename=getattr(source, "name", None),
+    )
+    replace_hints(zone, hints_rrsets)
+    return zone
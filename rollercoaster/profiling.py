@@ -0,0 +1,201 @@
+import argparse
+import cProfile
+import logging
+import os
+import pstats
+import re
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from rollercoaster import utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP = 25
+DEFAULT_FRAMES = 10
+
+SLOT_RE = re.compile(r"^q(\d+)s(\d+)$")
+
+
+class SlotSelection:
+    """Slots selected by count (the next n slots) or by name (e.g. q1s1)"""
+
+    def __init__(
+        self, count: Optional[int] = None, slot: Optional[Tuple[int, int]] = None
+    ):
+        self.count = count
+        self.slot = slot
+
+    @classmethod
+    def from_text(cls, text: str):
+        """Parse number of slots or slot name, for use as argparse type"""
+        if match := SLOT_RE.match(text):
+            return cls(slot=(int(match.group(1)), int(match.group(2))))
+        try:
+            count = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid slot selection: {text}")
+        if count < 1:
+            raise argparse.ArgumentTypeError(f"Invalid number of slots: {text}")
+        return cls(count=count)
+
+    def select(self, quarter: int, slot: int) -> bool:
+        """Return True if slot is selected (counting it if selected by count)"""
+        if self.slot is not None:
+            return self.slot == (quarter, slot)
+        if self.count:
+            self.count -= 1
+            return True
+        return False
+
+
+class SlotProfiler:
+    """Profile and trace memory allocations of selected slots
+
+    Stages marked by cmtimer are profiled separately, and the cProfile
+    statistics of each stage are saved as <prefix>.<stage>.prof. With
+    allocation tracing, the memory traced at the end of each stage and the
+    top allocations of the slot are saved as <prefix>.memory.txt, and the
+    snapshot itself as <prefix>.snapshot (to be compared using
+    rollercoaster-snapshot-diff).
+    """
+
+    def __init__(
+        self,
+        directory: str = ".",
+        profile: Optional[SlotSelection] = None,
+        trace_malloc: Optional[SlotSelection] = None,
+        top: int = DEFAULT_TOP,
+        frames: int = DEFAULT_FRAMES,
+    ):
+        self.directory = directory
+        self.profile = profile
+        self.trace_malloc = trace_malloc
+        self.top = top
+        self.frames = frames
+        self.prefix: Optional[str] = None
+        self.profiling = False
+        self.tracing = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles: Dict[str, List[cProfile.Profile]] = {}
+        self.memory: List[Tuple[str, int, int]] = []
+
+    def begin(self, t: int, quarter: int, slot: int) -> None:
+        """Start profiling slot starting at time t, if selected"""
+        self.profiling = self.profile is not None and self.profile.select(quarter, slot)
+        self.tracing = self.trace_malloc is not None and self.trace_malloc.select(
+            quarter, slot
+        )
+        if not (self.profiling or self.tracing):
+            return
+        self.prefix = os.path.join(self.directory, f"q{quarter}s{slot}-{t}")
+        self.profiles = {}
+        self.memory = []
+        if self.tracing:
+            tracemalloc.start(self.frames)
+        utils.stage_hooks.append(self.stage)
+        logger.info("Profiling quarter %d slot %d", quarter, slot)
+
+    def end(self) -> None:
+        """Stop profiling slot and save results"""
+        if not (self.profiling or self.tracing):
+            return
+        utils.stage_hooks.remove(self.stage)
+        if self.profiling:
+            self.save_profiles()
+        if self.tracing:
+            self.save_snapshot(tracemalloc.take_snapshot())
+            tracemalloc.stop()
+        self.profiling = False
+        self.tracing = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profile stage, unless already profiled by an outer stage"""
+        profiler = None
+        if self.profiling and getattr(self.local, "profiler", None) is None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # only one profiler may be active at a time in later Pythons
+                logger.debug("Not profiling concurrent stage %s", name)
+                profiler = None
+            self.local.profiler = profiler
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.local.profiler = None
+                with self.lock:
+                    self.profiles.setdefault(name, []).append(profiler)
+            if self.tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                with self.lock:
+                    self.memory.append((name, current, peak))
+
+    def save_profiles(self) -> None:
+        for name, profiles in self.profiles.items():
+            filename = f"{self.prefix}.{name}.prof"
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(filename)
+            logger.info("Saved profile of stage %s to %s", name, filename)
+
+    def save_snapshot(self, snapshot: tracemalloc.Snapshot) -> None:
+        # ignore allocations made by tracing and profiling themselves
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, module.__file__)
+                for module in (tracemalloc, cProfile, pstats)
+            ]
+        )
+        filename = f"{self.prefix}.snapshot"
+        snapshot.dump(filename)
+        with open(f"{self.prefix}.memory.txt", "wt") as fp:
+            print("# stage current peak", file=fp)
+            for name, current, peak in self.memory:
+                print(f"{name} {current} {peak}", file=fp)
+            print(file=fp)
+            print(f"# top {self.top} allocations", file=fp)
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                print(stat, file=fp)
+        logger.info("Saved allocation snapshot to %s", filename)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare allocation snapshots")
+    parser.add_argument("old", metavar="filename", help="Old snapshot")
+    parser.add_argument("new", metavar="filename", help="New snapshot")
+    parser.add_argument(
+        "--key-type",
+        dest="key_type",
+        choices=["filename", "lineno", "traceback"],
+        default="lineno",
+        help="Group allocations by",
+    )
+    parser.add_argument(
+        "--top",
+        metavar="n",
+        type=int,
+        default=DEFAULT_TOP,
+        help="Number of differences to show",
+    )
+
+    args = parser.parse_args()
+
+    old = tracemalloc.Snapshot.load(args.old)
+    new = tracemalloc.Snapshot.load(args.new)
+
+    for stat in new.compare_to(old, args.key_type)[: args.top]:
+        print(stat)
+        if args.key_type == "traceback":
+            for line in stat.traceback.format():
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
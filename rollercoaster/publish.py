@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import shlex
+import tempfile
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, TextIO
+
+from rollercoaster.metrics import RELOAD_STATUS, STAGE_DURATION, current_zone
+
+DEFAULT_RELOAD_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+# random part of names of temporary files created by tempfile.mkstemp
+TEMPORARY_NAME = r"[a-z0-9_]{8}"
+
+# temporary files are created with mode 0600, and given the mode of files
+# created by open() when moved into place; the umask can only be read by
+# setting it, which is done once before any threads are started
+UMASK = os.umask(0)
+os.umask(UMASK)
+DEFAULT_MODE = 0o666 & ~UMASK
+
+
+def fsync_directory(filename: str) -> None:
+    """Make replacing filename durable by syncing its directory"""
+    fd = os.open(os.path.dirname(filename) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(
+    filename: str, data: bytes, sync: bool = False, mode: int = DEFAULT_MODE
+) -> None:
+    """Write file with mode by moving a temporary file into place"""
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or ".",
+        prefix=f".{os.path.basename(filename)}.",
+    )
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+            if sync:
+                fp.flush()
+                os.fsync(fp.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if sync:
+        fsync_directory(filename)
+
+
+def remove_stale(filename: str) -> None:
+    """Remove temporary files of filename left behind by an interrupted process"""
+    directory = os.path.dirname(filename) or "."
+    pattern = re.compile(re.escape(f".{os.path.basename(filename)}.") + TEMPORARY_NAME)
+    try:
+        entries = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if pattern.fullmatch(entry):
+            logger.info("Removing stale temporary file %s", entry)
+            try:
+                os.unlink(os.path.join(directory, entry))
+            except FileNotFoundError:
+                pass
+
+
+class StagedFiles:
+    """Output files written ahead of time and moved into place atomically
+
+    Outputs may be written in parallel by submitting them to an executor;
+    all outputs are waited for before files are moved into place. Files
+    that are no longer valid may be staged for removal. Files staged with
+    sync (such as state files) are synced to disk, along with their
+    directory, when moved into place.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None):
+        self.files: Dict[str, str] = {}
+        self.synced: Set[str] = set()
+        self.removed: List[str] = []
+        self.futures: List[Future] = []
+        self.executor = executor
+
+    def path(self, filename: str, sync: bool = False) -> str:
+        """Return temporary filename to write in place of filename"""
+        if sync:
+            self.synced.add(filename)
+        if filename not in self.files:
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(filename) or ".",
+                prefix=f".{os.path.basename(filename)}.",
+            )
+            os.close(fd)
+            self.files[filename] = tmp
+        return self.files[filename]
+
+    def remove(self, filename: str) -> None:
+        """Remove filename when staged files are moved into place"""
+        self.removed.append(filename)
+
+    def open(self, filename: str) -> TextIO:
+        return open(self.path(filename), "wt")
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run output function, in parallel with other outputs if an executor is set"""
+        if self.executor is not None:
+            # metrics are recorded for the zone staging the output
+            future = self.executor.submit(contextvars.copy_context().run, fn, *args)
+        else:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+        self.futures.append(future)
+        return future
+
+    def write(self, filename: str, writer: Callable[[TextIO], None]) -> Future:
+        """Write staged file using writer"""
+        path = self.path(filename)
+
+        def write_file() -> None:
+            with open(path, "wt") as fp:
+                writer(fp)
+
+        return self.submit(write_file)
+
+    def wait(self) -> None:
+        """Wait for all outputs, raises the first exception if any output failed"""
+        futures = self.futures
+        self.futures = []
+        for future in futures:
+            future.exception()
+        for future in futures:
+            future.result()
+
+    def commit(self) -> None:
+        """Move all staged files into place"""
+        self.wait()
+        # files are forgotten as published, so abort() removes the rest
+        for filename in list(self.files):
+            tmp = self.files[filename]
+            os.chmod(tmp, DEFAULT_MODE)
+            if filename in self.synced:
+                fd = os.open(tmp, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            os.replace(tmp, filename)
+            if filename in self.synced:
+                fsync_directory(filename)
+            del self.files[filename]
+            logger.debug("Published %s", filename)
+        for filename in self.removed:
+            try:
+                os.unlink(filename)
+                logger.debug("Removed %s", filename)
+            except FileNotFoundError:
+                pass
+        self.removed = []
+
+    def abort(self) -> None:
+        """Remove all staged files"""
+        self.removed = []
+        for future in self.futures:
+            future.cancel()
+            future.exception()
+        self.futures = []
+        for tmp in self.files.values():
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+        self.files = {}
+
+
+async def run_command(args: List[str], timeout: float) -> Optional[int]:
+    """Run command without a shell, return exit status (None on timeout)"""
+    t = time.perf_counter()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+    except OSError as exc:
+        logger.error("Failed to execute %s: %s", args[0], str(exc))
+        RELOAD_STATUS.set(-1, zone=current_zone.get())
+        return None
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        logger.error("Command %s timed out after %.0f seconds", args[0], timeout)
+        RELOAD_STATUS.set(-1, zone=current_zone.get())
+        return None
+    zone = current_zone.get()
+    STAGE_DURATION.observe(time.perf_counter() - t, zone=zone, stage="reload")
+    RELOAD_STATUS.set(proc.returncode, zone=zone)
+    for line in output.decode(errors="replace").splitlines():
+        logger.debug("%s: %s", args[0], line)
+    if proc.returncode:
+        logger.error("Command %s failed with status %d", args[0], proc.returncode)
+    else:
+        logger.info("Command %s completed", args[0])
+    return proc.returncode
+
+
+class Reloader:
+    """Run reload command in the background
+
+    Reloads are run one at a time; a reload requested while the previous
+    one is still running is started when the previous one has completed.
+    """
+
+    def __init__(self, command: str, timeout: float = DEFAULT_RELOAD_TIMEOUT):
+        self.args = shlex.split(command)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+        self.future: Optional[Future] = None
+
+    @property
+    def status(self) -> Optional[int]:
+        """Exit status of last reload (None if running, failed to start or timed out)"""
+        if self.future is None or not self.future.done():
+            return None
+        return self.future.result()
+
+    def reload(self) -> None:
+        if self.future is not None and not self.future.done():
+            logger.warning("Previous reload still running")
+        logger.info("Executing reload command")
+        self.future = self.executor.submit(
+            contextvars.copy_context().run,
+            asyncio.run,
+            run_command(self.args, self.timeout),
+        )
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
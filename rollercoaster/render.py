@@ -1,57 +1,90 @@
+import functools
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional
 
 import jinja2
+import markupsafe
 
-from rollercoaster import QUARTER_COUNT, SLOTS_PER_QUARTER
 from rollercoaster.keyring import KeyRing
+from rollercoaster.schedule import PUBLISH, REVOKE, SIGN
 
 
 def render_text(keyring: KeyRing) -> str:
+    schedule = keyring.schedule
     res = {}
     for a, keys in keyring.enumerate():
         for n in keys.keys():
             res[f"a{a}-{n}"] = f"Algorithm {a}, {n:6}  "
 
-    for quarter in range(1, 5):
-        for slot in range(1, 10):
-            keyring.update(quarter, slot)
-
+    for quarter in range(1, schedule.quarters + 1):
+        for slot in range(1, schedule.slots + 1):
             for a, keys in keyring.enumerate():
-                for name, keypair in keys.items():
+                for name in keys.keys():
                     k = f"a{a}-{name}"
+                    state = schedule.get(quarter, slot, a, name)
 
-                    if keypair.revoked:
+                    if state & REVOKE:
                         status = "R"
-                    elif keypair.sign:
+                    elif state & SIGN:
                         status = "S"
-                    elif keypair.publish:
+                    elif state & PUBLISH:
                         status = "P"
                     else:
                         status = " "
                     res[k] += f" {status}"
-                    if slot == 9:
+                    if slot == schedule.slots:
                         res[k] += " |"
 
     return "\n".join(res.values())
 
 
-def render_html(
-    keyring: KeyRing,
-    refresh: int = 60,
-    delta: Optional[timedelta] = None,
-    current_quarter: Optional[int] = None,
-    current_slot: Optional[int] = None,
-) -> str:
+class KeyState(NamedTuple):
+    """Key state in a single slot, as shown on the dashboard"""
+
+    algorithm: int
+    algorithm_name: str
+    keytag: int
+    ksk: bool
+    publish: bool
+    sign: bool
+    revoked: bool
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(name: str) -> jinja2.Template:
+    """Return compiled template (compiled once per process)"""
+    env = jinja2.Environment(
+        loader=jinja2.PackageLoader("rollercoaster", "templates"),
+        autoescape=jinja2.select_autoescape(),
+    )
+    return env.get_template(name)
+
+
+def get_rows(keyring: KeyRing) -> Dict[str, List[Optional[KeyState]]]:
+    """Return key states per key and slot for the whole schedule"""
+    schedule = keyring.schedule
     rows = defaultdict(list)
-    for quarter in range(1, QUARTER_COUNT + 1):
-        for slot in range(1, SLOTS_PER_QUARTER + 1):
-            keyring.update(quarter, slot)
+    for quarter in range(1, schedule.quarters + 1):
+        for slot in range(1, schedule.slots + 1):
             for a, keypairs in keyring.enumerate():
-                for keypair in keypairs.values():
-                    if keypair.revoked or keypair.sign or keypair.publish:
-                        rows[keypair.name].append(keypair.as_dict(export=False))
+                for name, keypair in keypairs.items():
+                    state = schedule.get(quarter, slot, a, name)
+                    if state:
+                        revoked = bool(state & REVOKE)
+                        rows[keypair.name].append(
+                            KeyState(
+                                algorithm=int(keypair.algorithm),
+                                algorithm_name=keypair.algorithm_name,
+                                keytag=keypair.get_keytag(
+                                    keypair.get_flags(revoked=revoked)
+                                ),
+                                ksk=keypair.ksk,
+                                publish=bool(state & PUBLISH),
+                                sign=bool(state & SIGN),
+                                revoked=revoked,
+                            )
+                        )
                     else:
                         rows[keypair.name].append(None)
 
@@ -59,18 +92,76 @@ def render_html(
         if v.count(None) == len(v):
             del rows[k]
 
-    env = jinja2.Environment(
-        loader=jinja2.PackageLoader("rollercoaster", "templates"),
-        autoescape=jinja2.select_autoescape(),
-    )
-    template = env.get_template("dashboard.j2")
-    return template.render(
-        now=datetime.now(timezone.utc),
-        delta=int(delta.total_seconds()) if delta else None,
+    return rows
+
+
+class Dashboard:
+    """Dashboard renderer
+
+    The key state grid only depends on the keys in the keyring and the
+    schedule, so it is rendered once and reused until the keys change.
+    Each zone has a dashboard of its own, as zones are rendered in
+    parallel.
+    """
+
+    def __init__(self):
+        self.grid_key = None
+        self.grid = None
+
+    def render_grid(self, keyring: KeyRing) -> markupsafe.Markup:
+        grid_key = (
+            id(keyring.schedule),
+            tuple(
+                (a, name, keypair.name, keypair.algorithm, keypair.keytag, keypair.ksk)
+                for a, keypairs in keyring.enumerate()
+                for name, keypair in keypairs.items()
+            ),
+        )
+        if grid_key != self.grid_key:
+            self.grid = markupsafe.Markup(
+                get_template("grid.j2").render(rows=get_rows(keyring))
+            )
+            self.grid_key = grid_key
+        return self.grid
+
+    def render(
+        self,
+        keyring: KeyRing,
+        refresh: int = 60,
+        delta: Optional[timedelta] = None,
+        current_quarter: Optional[int] = None,
+        current_slot: Optional[int] = None,
+        now: Optional[datetime] = None,
+    ) -> str:
+        schedule = keyring.schedule
+        return get_template("dashboard.j2").render(
+            now=now or datetime.now(timezone.utc),
+            delta=int(delta.total_seconds()) if delta else None,
+            refresh=refresh,
+            grid=self.render_grid(keyring),
+            quarters=schedule.quarters,
+            slots=schedule.slots,
+            current_quarter=current_quarter,
+            current_slot=current_slot,
+        )
+
+
+def render_html(
+    keyring: KeyRing,
+    refresh: int = 60,
+    delta: Optional[timedelta] = None,
+    current_quarter: Optional[int] = None,
+    current_slot: Optional[int] = None,
+    now: Optional[datetime] = None,
+    dashboard: Optional[Dashboard] = None,
+) -> str:
+    if dashboard is None:
+        dashboard = Dashboard()
+    return dashboard.render(
+        keyring,
         refresh=refresh,
-        rows=rows,
-        quarters=QUARTER_COUNT,
-        slots=SLOTS_PER_QUARTER,
+        delta=delta,
         current_quarter=current_quarter,
         current_slot=current_slot,
+        now=now,
     )
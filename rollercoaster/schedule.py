@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional, Tuple
+
+from rollercoaster import QUARTER_COUNT, SLOTS_PER_QUARTER
+
+PUBLISH = 1
+SIGN = 2
+REVOKE = 4
+
+# key state per slot as used in schedule rows
+STATE_CODES = {
+    ".": 0,
+    "P": PUBLISH,
+    "S": PUBLISH | SIGN,
+    "R": PUBLISH | SIGN | REVOKE,
+}
+
+# Rollover schedules, one row of states per key and slot for each key set.
+# Key set 1 is the outgoing algorithm and key set 2 the incoming algorithm.
+
+DOUBLE_SCHEDULE = {
+    "1": {
+        "ksk": "SSSSSSSSS SSSSSSSSS SSSSSSSSS SRRRRRRR.",
+        "zsk-q1": "SSSSSSSSS P........ ......... .........",
+        "zsk-q2": "........P SSSSSSSSS P........ .........",
+        "zsk-q3": "......... ........P SSSSSSSSS P........",
+        "zsk-q4": "P........ ......... ........P S........",
+    },
+    "2": {
+        "ksk": "......... .SSSSSSSS SSSSSSSSS SSSSSSSSS",
+        "zsk-q1": "......... ......... ......... ........P",
+        "zsk-q2": "......... .SSSSSSSS P........ .........",
+        "zsk-q3": "......... ........P SSSSSSSSS P........",
+        "zsk-q4": "......... ......... ........P SSSSSSSSS",
+    },
+}
+
+SINGLE_SCHEDULE = {
+    "1": {
+        "ksk": "SSSSSSSSS SSSSSSSSS P........ .RRRRRRR.",
+        "zsk-q1": "SSSSSSSSS P........ ......... .........",
+        "zsk-q2": "........P SSSSSSSSS P........ .........",
+        "zsk-q3": "......... ........P ......... .........",
+        "zsk-q4": "P........ ......... ......... .........",
+    },
+    "2": {
+        "ksk": "......... .PPPPPPPP SSSSSSSSS SSSSSSSSS",
+        "zsk-q1": "......... ......... ......... ........P",
+        "zsk-q2": "......... ......... ......... .........",
+        "zsk-q3": "......... ......... SSSSSSSSS P........",
+        "zsk-q4": "......... ......... ........P SSSSSSSSS",
+    },
+}
+
+HYBRID_SCHEDULE = {
+    "1": DOUBLE_SCHEDULE["1"],
+    "2": {
+        **DOUBLE_SCHEDULE["2"],
+        "ksk": "PPPPPPPPP PSSSSSSSS SSSSSSSSS SSSSSSSSS",
+    },
+}
+
+
+class Schedule:
+    """Rollover schedule compiled into a table of key states per slot"""
+
+    def __init__(
+        self,
+        keys: Dict[str, Dict[str, str]],
+        quarters: int = QUARTER_COUNT,
+        slots: int = SLOTS_PER_QUARTER,
+    ):
+        self.keys = keys
+        self.quarters = quarters
+        self.slots = slots
+        self.names: List[Tuple[int, str]] = []
+        rows = []
+        for keyset, states in sorted(keys.items()):
+            for name, row in states.items():
+                self.names.append((int(keyset) - 1, name))
+                rows.append(self.parse_row(row))
+        self.index = {key: i for i, key in enumerate(self.names)}
+        self.table = [bytes(row[n] for row in rows) for n in range(self.slot_count)]
+
+    @property
+    def slot_count(self) -> int:
+        return self.quarters * self.slots
+
+    def parse_row(self, row: str) -> List[int]:
+        states = [c for c in row if not c.isspace() and c != "|"]
+        if len(states) != self.slot_count:
+            raise ValueError(
+                f"Schedule row has {len(states)} slots, expected {self.slot_count}"
+            )
+        try:
+            return [STATE_CODES[c] for c in states]
+        except KeyError as exc:
+            raise ValueError(f"Unknown key state {exc} in schedule") from exc
+
+    def state(self, quarter: int, slot: int) -> bytes:
+        """Return states for all keys (in order of names) at quarter and slot"""
+        return self.table[(quarter - 1) * self.slots + slot - 1]
+
+    def get(self, quarter: int, slot: int, keyset: int, name: str) -> int:
+        """Return state of key at quarter and slot"""
+        i = self.index.get((keyset, name))
+        return 0 if i is None else self.state(quarter, slot)[i]
+
+    @classmethod
+    def from_dict(cls, data: dict, default: Optional[dict] = None):
+        """Create schedule from configuration"""
+        return cls(
+            keys=data.get("keys", default),
+            quarters=data.get("quarters", QUARTER_COUNT),
+            slots=data.get("slots", SLOTS_PER_QUARTER),
+        )
+
+
+DOUBLE = Schedule(DOUBLE_SCHEDULE)
+SINGLE = Schedule(SINGLE_SCHEDULE)
+HYBRID = Schedule(HYBRID_SCHEDULE)
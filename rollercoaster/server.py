@@ -0,0 +1,453 @@
+import asyncio
+import bisect
+import logging
+import struct
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.renderer
+import dns.rrset
+import dns.zone
+
+from rollercoaster.ixfr import ZoneDiff
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = "127.0.0.1"
+DEFAULT_PORT = 53
+
+EDNS_PAYLOAD = 1232
+TCP_TIMEOUT = 10
+TCP_MAX_SIZE = 65535
+
+TCP_LENGTH = struct.Struct("!H")
+
+# (query name, type, DNSSEC OK)
+ResponseKey = Tuple[dns.name.Name, dns.rdatatype.RdataType, bool]
+
+
+class ServedZone:
+    """Signed zone prepared for serving
+
+    Responses for hot names are rendered to wire format up front and only
+    get the query ID and RD flag patched in. Other queries are answered
+    from the zone. A served zone is never modified once created.
+    """
+
+    def __init__(
+        self,
+        zone: dns.zone.Zone,
+        names: Optional[List[dns.name.Name]] = None,
+        hot: Iterable[Tuple[dns.name.Name, dns.rdatatype.RdataType]] = (),
+        diff: Optional[ZoneDiff] = None,
+    ):
+        self.zone = zone
+        self.origin = zone.origin
+        self.soa = zone.find_rrset(zone.origin, dns.rdatatype.SOA)
+        self.diff = diff
+        if names is None:
+            names = sorted(
+                name
+                for name, node in zone.items()
+                if node.get_rdataset(zone.rdclass, dns.rdatatype.NSEC)
+            )
+        # owner names of the NSEC chain, canonically sorted
+        self.names = names
+        self.responses: Dict[ResponseKey, bytes] = {}
+        for name, rdtype in hot:
+            for dnssec in [False, True]:
+                query = dns.message.make_query(
+                    name, rdtype, use_edns=0, payload=EDNS_PAYLOAD, want_dnssec=dnssec
+                )
+                query.id = 0
+                query.flags &= ~dns.flags.RD
+                # responses too large for a query are answered from the zone
+                response = self.resolve(query)
+                self.responses[(name, rdtype, dnssec)] = response.to_wire(
+                    max_size=TCP_MAX_SIZE
+                )
+
+    @property
+    def serial(self) -> int:
+        return self.soa[0].serial
+
+    def get_rrset(
+        self,
+        name: dns.name.Name,
+        rdtype: dns.rdatatype.RdataType,
+        covers: dns.rdatatype.RdataType = dns.rdatatype.NONE,
+    ) -> Optional[dns.rrset.RRset]:
+        return self.zone.get_rrset(name, rdtype, covers)
+
+    def add_rrset(
+        self, section: List[dns.rrset.RRset], rrset: dns.rrset.RRset, dnssec: bool
+    ) -> None:
+        """Add RRset to section, with its signatures if requested"""
+        section.append(rrset)
+        if dnssec and (
+            rrsig := self.get_rrset(rrset.name, dns.rdatatype.RRSIG, rrset.rdtype)
+        ):
+            section.append(rrsig)
+
+    def find_delegation(self, qname: dns.name.Name) -> Optional[dns.name.Name]:
+        """Return delegation point at or above name, if any"""
+        for depth in range(len(self.origin) + 1, len(qname) + 1):
+            _, name = qname.split(depth)
+            if self.get_rrset(name, dns.rdatatype.NS):
+                return name
+        return None
+
+    def find_nsec(self, qname: dns.name.Name) -> Optional[dns.rrset.RRset]:
+        """Return NSEC RRset covering name"""
+        i = bisect.bisect_right(self.names, qname)
+        return self.get_rrset(self.names[i - 1], dns.rdatatype.NSEC) if i else None
+
+    def is_empty_non_terminal(self, qname: dns.name.Name) -> bool:
+        """Return True if name has no RRsets but names below it exist"""
+        i = bisect.bisect_right(self.names, qname)
+        return i < len(self.names) and self.names[i].is_subdomain(qname)
+
+    def exists(self, qname: dns.name.Name) -> bool:
+        """Return True if name has RRsets or is an empty non-terminal"""
+        if self.zone.get_node(qname) is not None:
+            return True
+        return self.is_empty_non_terminal(qname)
+
+    def closest_encloser(self, qname: dns.name.Name) -> dns.name.Name:
+        name = qname
+        while name != self.origin and not self.exists(name):
+            name = name.parent()
+        return name
+
+    def referral(
+        self, response: dns.message.Message, cut: dns.name.Name, dnssec: bool
+    ) -> None:
+        response.flags &= ~dns.flags.AA
+        ns = self.get_rrset(cut, dns.rdatatype.NS)
+        response.authority.append(ns)
+        if dnssec:
+            if ds := self.get_rrset(cut, dns.rdatatype.DS):
+                self.add_rrset(response.authority, ds, dnssec)
+            elif nsec := self.get_rrset(cut, dns.rdatatype.NSEC):
+                self.add_rrset(response.authority, nsec, dnssec)
+        for rdata in ns:
+            if not rdata.target.is_subdomain(self.origin):
+                continue
+            for rdtype in [dns.rdatatype.A, dns.rdatatype.AAAA]:
+                if glue := self.get_rrset(rdata.target, rdtype):
+                    response.additional.append(glue)
+
+    def negative(
+        self, response: dns.message.Message, qname: dns.name.Name, dnssec: bool
+    ) -> None:
+        self.add_rrset(response.authority, self.soa, dnssec)
+        if not dnssec:
+            return
+        if response.rcode() == dns.rcode.NOERROR:
+            # an empty non-terminal has no NSEC, and is proven to have no
+            # RRsets by the NSEC covering it (RFC 4035, section 3.1.3.2)
+            nsec = self.get_rrset(qname, dns.rdatatype.NSEC) or self.find_nsec(qname)
+            if nsec:
+                self.add_rrset(response.authority, nsec, dnssec)
+            return
+        wildcard = dns.name.Name([b"*"]) + self.closest_encloser(qname)
+        covering = []
+        for name in [qname, wildcard]:
+            nsec = self.find_nsec(name)
+            if nsec is not None and nsec not in covering:
+                covering.append(nsec)
+        for nsec in covering:
+            self.add_rrset(response.authority, nsec, dnssec)
+
+    def resolve(self, query: dns.message.Message) -> dns.message.Message:
+        """Return response to query for name in the zone (no wildcards or CNAMEs)"""
+        response = dns.message.make_response(query, our_payload=EDNS_PAYLOAD)
+        question = query.question[0]
+        qname = question.name
+        rdtype = question.rdtype
+        dnssec = bool(query.ednsflags & dns.flags.DO)
+
+        if not qname.is_subdomain(self.origin) or question.rdclass != self.zone.rdclass:
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        cut = self.find_delegation(qname)
+        if cut is not None and not (cut == qname and rdtype == dns.rdatatype.DS):
+            self.referral(response, cut, dnssec)
+            return response
+
+        response.flags |= dns.flags.AA
+        node = self.zone.get_node(qname)
+        if node is None:
+            if not self.is_empty_non_terminal(qname):
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            self.negative(response, qname, dnssec)
+            return response
+
+        for rdataset in node.rdatasets:
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                continue
+            if rdtype in (rdataset.rdtype, dns.rdatatype.ANY):
+                rrset = dns.rrset.from_rdata(qname, rdataset.ttl, *rdataset)
+                self.add_rrset(response.answer, rrset, dnssec)
+        if not response.answer:
+            self.negative(response, qname, dnssec)
+        return response
+
+    def transfer(self, query: dns.message.Message) -> Iterator[dns.rrset.RRset]:
+        """Return RRsets for AXFR or IXFR response"""
+        if query.question[0].rdtype == dns.rdatatype.IXFR:
+            serial = None
+            for rrset in query.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    serial = rrset[0].serial
+            if serial == self.serial:
+                yield self.soa
+                return
+            if self.diff is not None and serial == self.diff.old_serial:
+                yield self.soa
+                yield self.diff.old_soa
+                yield from self.diff.deleted
+                yield self.soa
+                yield from self.diff.added
+                yield self.soa
+                return
+        # full zone transfer (also used when the difference is not known)
+        yield self.soa
+        for name, node in self.zone.items():
+            for rdataset in node.rdatasets:
+                if name == self.origin and rdataset.rdtype == dns.rdatatype.SOA:
+                    continue
+                yield dns.rrset.from_rdata(name, rdataset.ttl, *rdataset)
+        yield self.soa
+
+
+class ZoneServer:
+    """Authoritative DNS server (UDP and TCP) for the signed zone
+
+    The server runs an asyncio event loop in a separate thread. A new
+    version of the zone is published by replacing the served zone, which
+    is a single reference assignment. With port 0, a free port is selected
+    when the server is started.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        port: int = DEFAULT_PORT,
+        axfr: bool = True,
+    ):
+        self.address = address
+        self.port = port
+        self.axfr = axfr
+        self.served: Optional[ServedZone] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopped: Optional[asyncio.Event] = None
+        self.thread: Optional[threading.Thread] = None
+        self.started = threading.Event()
+        self.error: Optional[Exception] = None
+
+    def publish(self, served: ServedZone) -> None:
+        """Start serving new version of the zone"""
+        self.served = served
+        logger.info("Serving zone %s serial %d", served.origin, served.serial)
+
+    def start(self) -> None:
+        """Start server thread, raises exception if server could not be started"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self.serve())
+        except Exception as exc:
+            self.error = exc
+            self.started.set()
+
+    def stop(self) -> None:
+        if self.loop is not None and self.stopped is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        if self.thread is not None:
+            self.thread.join()
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: UdpProtocol(self), local_addr=(self.address, self.port)
+        )
+        # with port 0, TCP is served on the port selected for UDP
+        self.port = transport.get_extra_info("sockname")[1]
+        server = await asyncio.start_server(self.handle_tcp, self.address, self.port)
+        logger.info("Listening on %s port %d", self.address, self.port)
+        self.started.set()
+        try:
+            await self.stopped.wait()
+        finally:
+            transport.close()
+            server.close()
+            await server.wait_closed()
+
+    def handle(self, wire: bytes, max_size: int) -> Optional[bytes]:
+        """Return response to query received over UDP"""
+        served = self.served
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException as exc:
+            logger.debug("Dropping malformed query: %s", str(exc))
+            return None
+        if query.flags & dns.flags.QR or len(query.question) != 1:
+            return None
+
+        if query.edns >= 0:
+            max_size = max(512, min(query.payload, EDNS_PAYLOAD))
+            dnssec = bool(query.ednsflags & dns.flags.DO)
+            question = query.question[0]
+            # templates only answer standard queries for the class of the zone
+            template = (
+                served
+                and query.opcode() == dns.opcode.QUERY
+                and question.rdclass == served.zone.rdclass
+                and served.responses.get((question.name, question.rdtype, dnssec))
+            )
+            # the question is echoed as is, so the case must match as well
+            qname = question.name.to_wire()
+            end = 12 + len(qname)
+            if template and len(template) <= max_size and template[12:end] == qname:
+                return self.patch(template, query)
+
+        response = self.respond(served, query)
+        try:
+            return response.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            response.flags |= dns.flags.TC
+            response.answer = []
+            response.authority = []
+            response.additional = []
+            return response.to_wire(max_size=max_size)
+
+    def respond(
+        self, served: Optional[ServedZone], query: dns.message.Message
+    ) -> dns.message.Message:
+        if query.opcode() != dns.opcode.QUERY:
+            response = dns.message.make_response(query, our_payload=EDNS_PAYLOAD)
+            response.set_rcode(dns.rcode.NOTIMP)
+            return response
+        if served is None:
+            response = dns.message.make_response(query, our_payload=EDNS_PAYLOAD)
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response
+        if query.question[0].rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            # zone transfers are only done over TCP, answer with SOA
+            response = dns.message.make_response(query, our_payload=EDNS_PAYLOAD)
+            response.flags |= dns.flags.AA
+            response.answer.append(served.soa)
+            return response
+        return served.resolve(query)
+
+    @staticmethod
+    def patch(template: bytes, query: dns.message.Message) -> bytes:
+        """Return precomputed response with ID and RD flag from query"""
+        flags = template[2] | (query.flags >> 8 & dns.flags.RD >> 8)
+        return struct.pack("!HB", query.id, flags) + template[3:]
+
+    def transfer(
+        self, served: ServedZone, query: dns.message.Message
+    ) -> Iterator[bytes]:
+        """Return zone transfer response messages"""
+        question = query.question[0]
+        renderer = None
+        for rrset in served.transfer(query):
+            while True:
+                if renderer is None:
+                    renderer = dns.renderer.Renderer(
+                        id=query.id,
+                        flags=dns.flags.QR | dns.flags.AA,
+                        max_size=TCP_MAX_SIZE,
+                    )
+                    renderer.add_question(
+                        question.name, question.rdtype, question.rdclass
+                    )
+                try:
+                    renderer.add_rrset(dns.renderer.ANSWER, rrset)
+                    break
+                except dns.exception.TooBig:
+                    renderer.write_header()
+                    yield renderer.get_wire()
+                    renderer = None
+        if renderer is not None:
+            renderer.write_header()
+            yield renderer.get_wire()
+
+    async def handle_tcp(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    (length,) = TCP_LENGTH.unpack(
+                        await asyncio.wait_for(reader.readexactly(2), TCP_TIMEOUT)
+                    )
+                    wire = await asyncio.wait_for(
+                        reader.readexactly(length), TCP_TIMEOUT
+                    )
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                for response in self.handle_stream(wire):
+                    writer.write(TCP_LENGTH.pack(len(response)) + response)
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def handle_stream(self, wire: bytes) -> Iterator[bytes]:
+        """Return responses to query received over TCP"""
+        served = self.served
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException as exc:
+            logger.debug("Dropping malformed query: %s", str(exc))
+            return
+        if query.flags & dns.flags.QR or len(query.question) != 1:
+            return
+        rdtype = query.question[0].rdtype
+        if served is not None and rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            if not self.axfr:
+                response = dns.message.make_response(query)
+                response.set_rcode(dns.rcode.REFUSED)
+                yield response.to_wire()
+                return
+            logger.info(
+                "Zone transfer (%s) of serial %d",
+                dns.rdatatype.to_text(rdtype),
+                served.serial,
+            )
+            yield from self.transfer(served, query)
+            return
+        yield self.respond(served, query).to_wire(max_size=TCP_MAX_SIZE)
+
+
+class UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: ZoneServer):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if response := self.server.handle(data, 512):
+            self.transport.sendto(response, addr)
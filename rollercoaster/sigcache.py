@@ -0,0 +1,149 @@
+import logging
+import mmap
+import struct
+from typing import Dict, Optional, Set, Tuple, Union
+
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+from dns.rdtypes.ANY.RRSIG import RRSIG
+
+from rollercoaster.canonical import canonical_rrset
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH = 900
+DEFAULT_JITTER = 300
+
+# signature store file format: magic followed by records of
+# RRset digest, key tag, algorithm, RRSIG rdata length and RRSIG rdata
+STORE_MAGIC = b"RCSIGS01"
+STORE_RECORD = struct.Struct("!16sHBH")
+
+# offset of signature expiration in RRSIG rdata
+RRSIG_EXPIRATION = struct.Struct("!8xI")
+
+SignatureKey = Tuple[bytes, int, int]
+
+
+def rrset_digest(rrset: dns.rrset.RRset, origin: Optional[dns.name.Name]) -> bytes:
+    """Return digest of RRset in canonical form (RFC 4034, section 6)"""
+    return canonical_rrset(rrset.name, rrset, origin).digest
+
+
+class SignatureCache:
+    """Cache of RRSIGs reused between signing passes
+
+    Signatures are keyed by the canonical digest of the covered RRset
+    together with the key tag and algorithm of the signing key, so a
+    signature is only reused as long as the RRset content, TTL and key
+    are unchanged. Signatures are refreshed when less than `refresh`
+    seconds of validity remain. Expiration times are spread out by up
+    to `jitter` seconds to avoid having all signatures expire at once.
+
+    The cache can be saved to and loaded from a signature store file.
+    Signatures loaded from file are kept in wire format until used.
+    """
+
+    def __init__(self, refresh: int = DEFAULT_REFRESH, jitter: int = DEFAULT_JITTER):
+        self.refresh = refresh
+        self.jitter = jitter
+        self.signatures: Dict[SignatureKey, Union[RRSIG, bytes]] = {}
+        self.reused = 0
+        self.signed = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def begin(self) -> None:
+        """Start new signing pass"""
+        self.reused = 0
+        self.signed = 0
+
+    def get(self, key: SignatureKey, now: int) -> Optional[RRSIG]:
+        """Return cached signature if fresh enough to be reused"""
+        rrsig = self.signatures.get(key)
+        if rrsig is None or self.expires(rrsig) - now < self.refresh:
+            return None
+        if isinstance(rrsig, bytes):
+            rrsig = dns.rdata.from_wire(
+                dns.rdataclass.IN, dns.rdatatype.RRSIG, rrsig, 0, len(rrsig)
+            )
+            self.signatures[key] = rrsig
+        self.reused += 1
+        return rrsig
+
+    def put(self, key: SignatureKey, rrsig: RRSIG) -> None:
+        self.signatures[key] = rrsig
+        self.signed += 1
+        self.dirty = True
+
+    def clear(self) -> None:
+        """Drop all signatures (e.g. after the signed zone failed verification)"""
+        if self.signatures:
+            self.signatures = {}
+            self.dirty = True
+
+    @staticmethod
+    def expires(rrsig: Union[RRSIG, bytes]) -> int:
+        if isinstance(rrsig, bytes):
+            return RRSIG_EXPIRATION.unpack_from(rrsig)[0]
+        return rrsig.expiration
+
+    def expiration(self, digest: bytes, inception: int, lifetime: int) -> int:
+        """Return jittered signature expiration time for RRset digest"""
+        jitter = min(self.jitter, max(lifetime - self.refresh, 0))
+        return inception + lifetime - int.from_bytes(digest[:4], "big") % (jitter + 1)
+
+    def expunge(self, now: int, keys: Optional[Set[Tuple[int, int]]] = None) -> None:
+        """Drop signatures due for refresh or made by keys no longer in use
+
+        Keys are given as a set of (key tag, algorithm).
+        """
+        expunged = 0
+        for key, rrsig in list(self.signatures.items()):
+            if self.expires(rrsig) - now < self.refresh or (
+                keys is not None and key[1:] not in keys
+            ):
+                del self.signatures[key]
+                expunged += 1
+        if expunged:
+            self.dirty = True
+        logger.info(
+            "Reused %d signatures, created %d signatures, expunged %d signatures",
+            self.reused,
+            self.signed,
+            expunged,
+        )
+
+    def save(self, filename: str) -> None:
+        """Save signatures to signature store file"""
+        with open(filename, "wb") as fp:
+            fp.write(STORE_MAGIC)
+            for (digest, keytag, algorithm), rrsig in self.signatures.items():
+                wire = rrsig if isinstance(rrsig, bytes) else rrsig.to_wire()
+                fp.write(STORE_RECORD.pack(digest, keytag, algorithm, len(wire)))
+                fp.write(wire)
+        self.dirty = False
+        logger.info("Saved %d signatures to %s", len(self.signatures), filename)
+
+    def load(self, filename: str) -> None:
+        """Load signatures from signature store file"""
+        with open(filename, "rb") as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[: len(STORE_MAGIC)] != STORE_MAGIC:
+                    raise ValueError(f"{filename} is not a signature store")
+                offset = len(STORE_MAGIC)
+                while offset < len(buf):
+                    digest, keytag, algorithm, length = STORE_RECORD.unpack_from(
+                        buf, offset
+                    )
+                    offset += STORE_RECORD.size
+                    end = offset + length
+                    self.signatures[(digest, keytag, algorithm)] = buf[offset:end]
+                    offset = end
+        self.dirty = False
+        logger.info("Loaded %d signatures from %s", len(self.signatures), filename)
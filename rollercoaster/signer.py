@@ -1,14 +1,19 @@
 import argparse
+import functools
 import logging
 import os
+import signal
 import time
 import tomllib
-from datetime import timedelta
-from typing import List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, TextIO, Tuple
 
 import dns.dnssec
+import dns.exception
 import dns.name
 import dns.rdatatype
+import dns.rrset
 import dns.zone
 import dns.zonefile
 from dns.dnssecalgs import register_algorithm_cls
@@ -18,13 +23,72 @@ from dns.rdtypes.dnskeybase import Flag
 
 import rollercoaster.keyring
 from rollercoaster import QUARTER_COUNT, SLOTS_PER_QUARTER
+from rollercoaster.ixfr import ZoneDiff, next_serial
+from rollercoaster.keyfactory import KeyFactory
+from rollercoaster.keypair import KeyPair
+from rollercoaster.metrics import (
+    CURRENT_QUARTER,
+    CURRENT_SLOT,
+)
+from rollercoaster.metrics import DEFAULT_PORT as DEFAULT_METRICS_PORT
+from rollercoaster.metrics import (
+    REGISTRY,
+    SLOT_MARGIN,
+    SLOT_OVERRUNS,
+    VERIFICATION_FAILURES,
+    MetricsServer,
+    zone_context,
+)
 from rollercoaster.private import MyPrivateKey
-from rollercoaster.render import render_html
+from rollercoaster.profiling import SlotProfiler, SlotSelection
+from rollercoaster.publish import (
+    DEFAULT_RELOAD_TIMEOUT,
+    Reloader,
+    StagedFiles,
+    remove_stale,
+    write_atomic,
+)
+from rollercoaster.render import Dashboard, render_html
+from rollercoaster.schedule import Schedule
+from rollercoaster.server import DEFAULT_PORT, ServedZone, ZoneServer
+from rollercoaster.sigcache import SignatureCache
+from rollercoaster.signing import SigningPool
+from rollercoaster.unsigned import UnsignedZone
 from rollercoaster.utils import cmtimer
+from rollercoaster.verify import ZoneVerifier
 
 DEFAULT_SLOT_TIMEDELTA = timedelta(seconds=30)
 DEFAULT_DNSKEY_TTL = 60
 DEFAULT_LIFETIME = 3600
+DEFAULT_SIGNATURE_REFRESH = 900
+DEFAULT_SIGNATURE_JITTER = 300
+
+# signed zone, difference, keyring, signatures, anchors and dashboard
+OUTPUT_WORKERS = 6
+
+# configured files written through temporary files
+STAGED_OUTPUTS = [
+    "signed",
+    "ixfr",
+    "keyring",
+    "signatures",
+    "anchors",
+    "dashboard",
+    "store",
+]
+
+
+class SlotJob(NamedTuple):
+    """Slot to sign in fast-forward mode"""
+
+    quarter: int
+    slot: int
+    t: int
+    keyring: dict
+    directory: str
+    signed: str
+    anchors: Optional[str]
+
 
 logger = logging.getLogger(__name__)
 
@@ -32,23 +96,46 @@ logger = logging.getLogger(__name__)
 def get_current_qs(
     td: timedelta = DEFAULT_SLOT_TIMEDELTA,
     t: Optional[int] = None,
+    quarters: int = QUARTER_COUNT,
+    slots: int = SLOTS_PER_QUARTER,
 ) -> Tuple[int, int]:
     slot_length = td.total_seconds()
     t = t or int(time.time())
-    n = t // slot_length % (QUARTER_COUNT * SLOTS_PER_QUARTER)
-    q = int(n // SLOTS_PER_QUARTER)
-    s = int(n % SLOTS_PER_QUARTER)
+    n = t // slot_length % (quarters * slots)
+    q = int(n // slots)
+    s = int(n % slots)
     return q + 1, s + 1
 
 
-def get_next_qs(td: timedelta = DEFAULT_SLOT_TIMEDELTA) -> Tuple[int, int]:
-    slot_length = td.total_seconds()
-    t1 = int(time.time())
+def get_next_slot(
+    td: timedelta = DEFAULT_SLOT_TIMEDELTA,
+    t: Optional[int] = None,
+    quarters: int = QUARTER_COUNT,
+    slots: int = SLOTS_PER_QUARTER,
+) -> Tuple[int, int, int]:
+    """Return start time, quarter and slot of the slot following time t (or now)"""
+    slot_length = int(td.total_seconds())
+    t1 = max(t or 0, int(time.time()))
     t2 = t1 // slot_length * slot_length + slot_length
-    w = t2 - t1
-    logger.info("Waiting %d seconds for next slot", w)
-    time.sleep(w)
-    return get_current_qs(td=td, t=t2)
+    return (t2, *get_current_qs(td=td, t=t2, quarters=quarters, slots=slots))
+
+
+def wait_for_slot(t: int, catch_up: bool = False) -> None:
+    """Wait for slot starting at time t
+
+    The slot being signed when starting (catch_up) has already started,
+    and is published as soon as ready without counting it as late.
+    """
+    if catch_up:
+        return
+    w = t - time.time()
+    SLOT_MARGIN.set(w)
+    if w > 0:
+        logger.info("Waiting %.1f seconds for next slot", w)
+        time.sleep(w)
+    elif w < -1:
+        logger.warning("Slot published %.1f seconds late", -w)
+        SLOT_OVERRUNS.inc()
 
 
 def get_zone_trust_anchors_ds(zone: dns.zone.Zone) -> dns.rrset.RRset:
@@ -73,40 +160,61 @@ def get_zone_trust_anchors_dnskey(zone: dns.zone.Zone) -> dns.rrset.RRset:
     return dns.rrset.from_rdata_list(zone.origin, dnskey_rrset.ttl, ta_dnskey_rdatasets)
 
 
-def prepare_zone(
-    zone: dns.zone.Zone, hints_rrsets: Optional[List[dns.rrset.RRset]] = None
-):
-    """Prepare zone by removing signatures and replace hints"""
+def write_zone(zone: dns.zone.Zone, fp: TextIO) -> None:
+    with cmtimer("Saving zone", logger=logger, stage="save"):
+        zone.to_file(fp)
+    logger.info("Saved signed zone")
+
+
+def write_zone_diff(
+    filename: str, old: dns.zone.Zone, new: dns.zone.Zone, t: int
+) -> ZoneDiff:
+    with cmtimer("Computing zone difference", logger=logger, stage="ixfr"):
+        diff = ZoneDiff.from_zones(old, new)
+    with open(filename, "wt") as fp:
+        diff.to_file(fp, t)
+    logger.info(
+        "Saved difference from serial %d to %d (%d records)",
+        diff.old_serial,
+        diff.new_serial,
+        len(diff),
+    )
+    return diff
 
-    exclude_rdtypes = set(
-        [
-            dns.rdatatype.DNSKEY,
-            dns.rdatatype.RRSIG,
-            dns.rdatatype.NSEC,
-            dns.rdatatype.NSEC3,
-            dns.rdatatype.NSEC3PARAM,
-        ]
+
+def write_trust_anchors(zone: dns.zone.Zone, fp: TextIO) -> None:
+    with cmtimer("Saving trust anchors", logger=logger, stage="anchors"):
+        ds_ta_rrset = get_zone_trust_anchors_ds(zone)
+        dnskey_ta_rrset = get_zone_trust_anchors_dnskey(zone)
+        for rdata in ds_ta_rrset:
+            print(f"{zone.origin} IN DS {rdata}", file=fp)
+        for rdata in dnskey_ta_rrset:
+            print(f"; {zone.origin} IN DNSKEY {rdata}", file=fp)
+    logger.info("Saved trust anchors")
+
+
+def write_dashboard(fp: TextIO, **kwargs) -> None:
+    with cmtimer("Rendering dashboard", logger=logger, stage="dashboard"):
+        fp.write(render_html(**kwargs))
+    logger.info("Rendered dashboard")
+
+
+def read_hints(filename: str) -> List[dns.rrset.RRset]:
+    with open(filename) as fp:
+        return dns.zonefile.read_rrsets(fp.read())
+
+
+def register_private_algorithm() -> None:
+    register_algorithm_cls(
+        algorithm=MyPrivateKey.public_cls.algorithm,
+        algorithm_cls=MyPrivateKey,
+        name=MyPrivateKey.public_cls.name,
     )
-    exclude_glue = set()
-    with zone.writer() as txn:
-        for name, rdataset in txn.iterate_rdatasets():
-            if rdataset.rdtype in exclude_rdtypes:
-                txn.delete(name, rdataset)
-            elif (
-                hints_rrsets
-                and name == zone.origin
-                and rdataset.rdtype == dns.rdatatype.NS
-            ):
-                exclude_glue.update([rr.target for rr in rdataset])
-                txn.delete(name, rdataset)
-        for name in exclude_glue:
-            txn.delete(name, zone.rdclass, dns.rdatatype.A)
-            txn.delete(name, zone.rdclass, dns.rdatatype.AAAA)
-        for rrset in hints_rrsets:
-            txn.add(rrset)
-
-
-def get_keyring(config: dict) -> rollercoaster.keyring.KeyRing:
+
+
+def get_keyring(
+    config: dict, factory: Optional[KeyFactory] = None
+) -> rollercoaster.keyring.KeyRing:
     """Generate keyring"""
 
     mode = config.get("mode", "double")
@@ -132,7 +240,597 @@ def get_keyring(config: dict) -> rollercoaster.keyring.KeyRing:
     for k in keyspecs:
         if isinstance(k["algorithm"], str):
             k["algorithm"] = Algorithm[k["algorithm"].upper()]
-    return keyring_cls(filename=config["keyring"], keyspecs=keyspecs)
+
+    if "schedule" in config:
+        schedule = Schedule.from_dict(
+            config["schedule"], default=keyring_cls.schedule.keys
+        )
+    else:
+        schedule = None
+
+    return keyring_cls(
+        filename=config["keyring"],
+        keyspecs=keyspecs,
+        schedule=schedule,
+        factory=factory,
+    )
+
+
+class SharedResources:
+    """Resources shared between zones signed by the same process
+
+    Unsigned zones are shared between zones with the same origin, upstream,
+    unsigned zone and hints, and are only parsed once. Signing workers, key
+    generation and output threads are shared by all zones.
+    """
+
+    def __init__(self, config: dict, sections: List[str]):
+        self.hints: Dict[str, List[dns.rrset.RRset]] = {}
+        self.unsigned: Dict[Tuple, UnsignedZone] = {}
+
+        workers = max(config[section].get("workers", 1) for section in sections)
+        self.pool = SigningPool(workers) if workers > 1 else None
+
+        if any(config[section].get("pregenerate", False) for section in sections):
+            self.key_executor = ProcessPoolExecutor(max_workers=1)
+        else:
+            self.key_executor = None
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=OUTPUT_WORKERS * len(sections), thread_name_prefix="output"
+        )
+
+    def get_hints(self, filename: Optional[str]) -> Optional[List[dns.rrset.RRset]]:
+        if not filename:
+            return None
+        if filename not in self.hints:
+            self.hints[filename] = read_hints(filename)
+        return self.hints[filename]
+
+    def get_unsigned(self, config: dict) -> UnsignedZone:
+        key = (
+            config["origin"],
+            config.get("upstream"),
+            config["unsigned"],
+            config.get("hints"),
+            config.get("store"),
+        )
+        if key not in self.unsigned:
+            unsigned = UnsignedZone(
+                origin=config["origin"],
+                unsigned=config["unsigned"],
+                upstream=config.get("upstream"),
+                hints_rrsets=self.get_hints(config.get("hints")),
+                store=config.get("store"),
+            )
+            unsigned.refresh()
+            self.unsigned[key] = unsigned
+        return self.unsigned[key]
+
+    def refresh(self) -> None:
+        for unsigned in self.unsigned.values():
+            unsigned.refresh()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.key_executor is not None:
+            self.key_executor.shutdown(cancel_futures=True)
+
+
+def zone_metrics(method):
+    """Record metrics of method for the zone of the signer"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with zone_context(self.name):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class ZoneSigner:
+    """Signer for the zone of a single configuration section
+
+    Each slot is prepared in three steps: begin() takes a snapshot of the
+    unsigned zone, sign() signs it and stages all outputs, and commit()
+    publishes the outputs when the slot starts. With verification, the
+    signed zone is verified while the outputs are staged, and nothing is
+    published for the slot if verification fails.
+    """
+
+    def __init__(
+        self, name: str, config: dict, td: timedelta, resources: SharedResources
+    ):
+        self.name = name
+        self.config = config
+        self.td = td
+        self.refresh = (int(td.total_seconds()) // 5) or 5
+        self.resources = resources
+
+        # outputs staged by an interrupted process are never published
+        for output in STAGED_OUTPUTS:
+            if filename := config.get(output):
+                remove_stale(filename)
+
+        self.unsigned = resources.get_unsigned(config)
+
+        if resources.key_executor is not None and config.get("pregenerate", False):
+            self.factory = KeyFactory(executor=resources.key_executor)
+        else:
+            self.factory = None
+
+        self.keyring = get_keyring(config, factory=self.factory)
+        self.schedule = self.keyring.schedule
+        self.dashboard = Dashboard()
+
+        self.dnskey_ttl = config.get("dnskey_ttl", DEFAULT_DNSKEY_TTL)
+        self.lifetime = config.get("lifetime", DEFAULT_LIFETIME)
+
+        if config.get("incremental", False):
+            self.cache = SignatureCache(
+                refresh=config.get("signature_refresh", DEFAULT_SIGNATURE_REFRESH),
+                jitter=config.get("signature_jitter", DEFAULT_SIGNATURE_JITTER),
+            )
+            signatures = config.get("signatures")
+            if signatures and os.path.exists(signatures):
+                self.cache.load(signatures)
+        else:
+            self.cache = None
+
+        self.pool = resources.pool if config.get("workers", 1) > 1 else None
+
+        if config.get("verify", False):
+            self.verifier = ZoneVerifier(
+                sample=config.get("verify_sample"), pool=self.pool
+            )
+        else:
+            self.verifier = None
+
+        self.signed = config.get("signed")
+        self.ixfr = config.get("ixfr")
+        self.previous_zone = None
+        if self.ixfr and self.signed and os.path.exists(self.signed):
+            try:
+                with cmtimer("Loading signed zone", logger=logger):
+                    self.previous_zone = dns.zone.from_file(
+                        self.signed,
+                        origin=self.unsigned.zone.origin,
+                        relativize=False,
+                        zone_factory=self.unsigned.zone_factory,
+                    )
+            except dns.exception.DNSException as exc:
+                logger.warning(
+                    "Failed to load signed zone %s: %s", self.signed, str(exc)
+                )
+
+        if listen := config.get("listen"):
+            self.server = ZoneServer(
+                address=listen,
+                port=config.get("listen_port", DEFAULT_PORT),
+                axfr=config.get("allow_axfr", True),
+            )
+            self.server.start()
+        else:
+            self.server = None
+
+        if reload_command := config.get("reload"):
+            self.reloader = Reloader(
+                reload_command,
+                timeout=config.get("reload_timeout", DEFAULT_RELOAD_TIMEOUT),
+            )
+        else:
+            self.reloader = None
+
+        self.t = 0
+        self.quarter = 0
+        self.slot = 0
+        self.zone: Optional[dns.zone.Zone] = None
+        self.state_name: Optional[dns.name.Name] = None
+        self.staged: Optional[StagedFiles] = None
+        self.served: Optional[ServedZone] = None
+        self.blocked = False
+        self.chain_version: Optional[Tuple[int, dns.name.Name]] = None
+
+    @zone_metrics
+    def begin(self, t: int) -> None:
+        """Take snapshot of unsigned zone for slot starting at time t"""
+        self.t = t
+        self.quarter, self.slot = get_current_qs(
+            self.td, t, quarters=self.schedule.quarters, slots=self.schedule.slots
+        )
+        logger.info(
+            "Preparing %s quarter %d slot %d", self.name, self.quarter, self.slot
+        )
+
+        zone = self.unsigned.snapshot()
+        state_name = dns.name.Name(["_rollercoaster"]) + zone.origin
+        with zone.writer() as txn:
+            txn.replace(
+                state_name,
+                0,
+                TXT(
+                    dns.rdataclass.IN,
+                    dns.rdatatype.TXT,
+                    [f"q{self.quarter}s{self.slot}"],
+                ),
+            )
+            if self.ixfr:
+                # every slot is a new version of the zone
+                soa = zone.get_soa(txn)
+                previous_soa = (
+                    self.previous_zone.get_soa() if self.previous_zone else None
+                )
+                serial = next_serial(
+                    previous_soa.serial if previous_soa else None, soa.serial
+                )
+                rdataset = txn.get(zone.origin, dns.rdatatype.SOA)
+                txn.replace(zone.origin, rdataset.ttl, soa.replace(serial=serial))
+        # the state name is added to the chain once per version of the
+        # unsigned zone, as it is the same in every snapshot
+        chain_version = (self.unsigned.generation, state_name)
+        if chain_version != self.chain_version:
+            self.unsigned.chain.update(zone, state_name)
+            self.chain_version = chain_version
+        self.zone = zone
+        self.state_name = state_name
+
+    @zone_metrics
+    def sign(self) -> None:
+        """Sign zone and stage all outputs"""
+        zone = self.zone
+        keyring = self.keyring
+        quarter = self.quarter
+        slot = self.slot
+        t = self.t
+
+        keyring.generate(quarter, slot)
+        keyring.update(quarter, slot)
+
+        keyring.print_state()
+
+        with cmtimer(f"Signing zone {self.name}", logger=logger, stage="sign"):
+            keyring.sign_zone(
+                zone,
+                lifetime=self.lifetime,
+                dnskey_ttl=self.dnskey_ttl,
+                inception=t,
+                cache=self.cache,
+                pool=self.pool,
+                chain=self.unsigned.chain,
+                canonical=self.unsigned.canonical,
+            )
+
+        if quarter == self.schedule.quarters and slot == self.schedule.slots:
+            logger.info("Rotate keys")
+            keyring.rotate()
+
+        # all output is staged and moved into place when the slot starts,
+        # independent outputs are written in parallel (and verified while
+        # being written)
+        staged = StagedFiles(executor=self.resources.executor)
+        self.staged = staged
+        self.blocked = False
+        previous_zone = self.previous_zone
+
+        if self.verifier is not None:
+            staged.submit(self.verify, zone)
+
+        if self.signed:
+            staged.write(self.signed, functools.partial(write_zone, zone))
+
+        diff = None
+        if self.ixfr:
+            if self.previous_zone is not None:
+                diff = staged.submit(
+                    write_zone_diff,
+                    staged.path(self.ixfr),
+                    self.previous_zone,
+                    zone,
+                    t,
+                )
+            else:
+                # a difference left by an earlier run does not lead to this zone
+                staged.remove(self.ixfr)
+            self.previous_zone = zone
+
+        # the keyring file is only replaced when the keyring has changed
+        if keyring.changed():
+            staged.submit(keyring.save, staged.path(keyring.filename, sync=True))
+
+        if self.cache is not None and self.cache.dirty:
+            if signatures := self.config.get("signatures"):
+                staged.submit(self.cache.save, staged.path(signatures))
+
+        if anchors := self.config.get("anchors"):
+            staged.write(anchors, functools.partial(write_trust_anchors, zone))
+
+        if dashboard := self.config.get("dashboard"):
+            staged.write(
+                dashboard,
+                functools.partial(
+                    write_dashboard,
+                    keyring=keyring,
+                    dashboard=self.dashboard,
+                    delta=self.td,
+                    refresh=self.refresh,
+                    current_quarter=quarter,
+                    current_slot=slot,
+                    now=datetime.fromtimestamp(t, tz=timezone.utc),
+                ),
+            )
+
+        try:
+            staged.wait()
+        except dns.dnssec.ValidationFailure as exc:
+            logger.error(
+                "Verification of %s quarter %d slot %d failed: %s",
+                self.name,
+                quarter,
+                slot,
+                str(exc),
+            )
+            VERIFICATION_FAILURES.inc(zone=self.name)
+            # nothing from this slot is published, and no signature from it
+            # is reused
+            staged.abort()
+            self.staged = None
+            self.served = None
+            self.previous_zone = previous_zone
+            if self.cache is not None:
+                self.cache.clear()
+            self.blocked = True
+            return
+
+        if self.server is not None:
+            with cmtimer("Preparing responses", logger=logger, stage="serve"):
+                self.served = ServedZone(
+                    zone,
+                    names=list(self.unsigned.chain.names),
+                    hot=[
+                        (zone.origin, dns.rdatatype.SOA),
+                        (zone.origin, dns.rdatatype.NS),
+                        (zone.origin, dns.rdatatype.DNSKEY),
+                        (self.state_name, dns.rdatatype.TXT),
+                    ],
+                    diff=diff.result() if diff else None,
+                )
+
+    def verify(self, zone: dns.zone.Zone) -> None:
+        """Verify signed zone, raises ValidationFailure on failure"""
+        with cmtimer(f"Verifying zone {self.name}", logger=logger, stage="verify"):
+            self.verifier.verify(zone, self.t, get_zone_trust_anchors_ds(zone))
+
+    @zone_metrics
+    def commit(self) -> None:
+        """Publish staged outputs, unless verification failed"""
+        if self.blocked:
+            logger.error(
+                "Not publishing %s quarter %d slot %d",
+                self.name,
+                self.quarter,
+                self.slot,
+            )
+            return
+        logger.info(
+            "Starting %s quarter %d slot %d", self.name, self.quarter, self.slot
+        )
+        CURRENT_QUARTER.set(self.quarter, zone=self.name)
+        CURRENT_SLOT.set(self.slot, zone=self.name)
+        if self.staged is not None:
+            self.staged.commit()
+            self.staged = None
+
+        if self.server is not None and self.served is not None:
+            self.server.publish(self.served)
+
+        if self.reloader is not None:
+            self.reloader.reload()
+
+    def abort(self) -> None:
+        """Remove staged outputs"""
+        if self.staged is not None:
+            self.staged.abort()
+            self.staged = None
+
+    def shutdown(self) -> None:
+        if self.reloader is not None:
+            self.reloader.shutdown()
+        if self.server is not None:
+            self.server.stop()
+        if self.factory is not None:
+            self.factory.shutdown()
+
+
+# state of fast-forward worker processes
+_fast_forward_unsigned: Optional[UnsignedZone] = None
+
+
+def _init_fast_forward(unsigned: UnsignedZone) -> None:
+    global _fast_forward_unsigned
+    _fast_forward_unsigned = unsigned
+    register_private_algorithm()
+
+
+def _fast_forward_slots(config: dict, jobs: List[SlotJob]) -> List[Tuple[int, int]]:
+    """Sign and write slots using the same signing keys (executed in worker process)"""
+    unsigned = _fast_forward_unsigned
+    # signatures are shared by all slots signed by the same keys
+    cache = SignatureCache(
+        refresh=config.get("signature_refresh", DEFAULT_SIGNATURE_REFRESH),
+        jitter=config.get("signature_jitter", DEFAULT_SIGNATURE_JITTER),
+    )
+    loaded: Dict[str, KeyPair] = {}
+    res = []
+    for i, job in enumerate(jobs):
+        keyring = rollercoaster.keyring.KeyRing.from_export(job.keyring, loaded)
+        zone = unsigned.snapshot()
+        state_name = dns.name.Name(["_rollercoaster"]) + zone.origin
+        with zone.writer() as txn:
+            txn.replace(
+                state_name,
+                0,
+                TXT(
+                    dns.rdataclass.IN,
+                    dns.rdatatype.TXT,
+                    [f"q{job.quarter}s{job.slot}"],
+                ),
+            )
+        if i == 0:
+            # the unsigned zone is the same for all slots
+            unsigned.chain.update(zone, state_name)
+        keyring.sign_zone(
+            zone,
+            lifetime=config.get("lifetime", DEFAULT_LIFETIME),
+            dnskey_ttl=config.get("dnskey_ttl", DEFAULT_DNSKEY_TTL),
+            inception=job.t,
+            cache=cache,
+            chain=unsigned.chain,
+            canonical=unsigned.canonical,
+        )
+        if config.get("verify", False):
+            verifier = ZoneVerifier(sample=config.get("verify_sample"))
+            verifier.verify(zone, job.t, get_zone_trust_anchors_ds(zone))
+        with open(os.path.join(job.directory, job.signed), "wt") as fp:
+            write_zone(zone, fp)
+        if job.anchors:
+            with open(os.path.join(job.directory, job.anchors), "wt") as fp:
+                write_trust_anchors(zone, fp)
+        res.append((job.quarter, job.slot))
+    return res
+
+
+def get_cycle_start(td: timedelta, schedule: Schedule, t: Optional[int] = None) -> int:
+    """Return start time of the cycle at time t (or now)"""
+    cycle_length = int(td.total_seconds()) * schedule.slot_count
+    t = t or int(time.time())
+    return t // cycle_length * cycle_length
+
+
+def fast_forward(
+    name: str,
+    config: dict,
+    td: timedelta,
+    directory: str,
+    start: Optional[int] = None,
+) -> None:
+    """Sign all slots of a cycle, writing outputs to a directory per slot
+
+    Slot times are simulated from the start of the cycle, so the output
+    only depends on the start time, keys and unsigned zone. Slots signed
+    by the same keys are signed in the same worker process to reuse
+    signatures, while slots with different signing keys are signed in
+    parallel. The keyring file is only written to keep the keys generated
+    for the cycle as pre-generated keys, so fast-forwarding again (or the
+    signer reaching these slots) uses the same keys.
+    """
+    unsigned = UnsignedZone(
+        origin=config["origin"],
+        unsigned=config["unsigned"],
+        upstream=config.get("upstream"),
+        hints_rrsets=read_hints(config["hints"]) if config.get("hints") else None,
+        store=config.get("store"),
+    )
+    unsigned.refresh()
+
+    keyring = get_keyring(config)
+    if not os.path.exists(keyring.filename):
+        keyring.save()
+    schedule = keyring.schedule
+    t = get_cycle_start(td, schedule, start)
+    known = set(
+        keypair.key_id for _, keys in keyring.enumerate() for keypair in keys.values()
+    )
+    known.update(keypair.key_id for _, keypair in keyring.staged)
+    generated: List[Tuple[dict, KeyPair]] = []
+    refresh = (int(td.total_seconds()) // 5) or 5
+
+    signed = os.path.basename(config.get("signed") or "zone.signed")
+    anchors = config.get("anchors") and os.path.basename(config["anchors"])
+    dashboard = config.get("dashboard") and os.path.basename(config["dashboard"])
+    renderer = Dashboard()
+
+    groups: Dict[FrozenSet[str], List[SlotJob]] = {}
+    for quarter in range(1, schedule.quarters + 1):
+        for slot in range(1, schedule.slots + 1):
+            keyring.generate(quarter, slot)
+            keyring.update(quarter, slot)
+            for a, keys in keyring.enumerate():
+                for keypair in keys.values():
+                    if keypair.key_id not in known:
+                        known.add(keypair.key_id)
+                        generated.append((keyring.keyspecs[a], keypair))
+            slot_directory = os.path.join(directory, f"q{quarter}s{slot}")
+            os.makedirs(slot_directory, exist_ok=True)
+            if dashboard:
+                with open(os.path.join(slot_directory, dashboard), "wt") as fp:
+                    write_dashboard(
+                        fp,
+                        keyring=keyring,
+                        dashboard=renderer,
+                        delta=td,
+                        refresh=refresh,
+                        current_quarter=quarter,
+                        current_slot=slot,
+                        now=datetime.fromtimestamp(t, tz=timezone.utc),
+                    )
+            signing_keys = frozenset(
+                keypair.key_id
+                for _, keys in keyring.enumerate()
+                for keypair in keys.values()
+                if keypair.sign
+            )
+            groups.setdefault(signing_keys, []).append(
+                SlotJob(
+                    quarter=quarter,
+                    slot=slot,
+                    t=t,
+                    keyring=keyring.export(),
+                    directory=slot_directory,
+                    signed=signed,
+                    anchors=anchors,
+                )
+            )
+            t += int(td.total_seconds())
+
+    if generated:
+        logger.info("Saving %d generated keys as pre-generated keys", len(generated))
+        persisted = get_keyring(config)
+        persisted.staged.extend(generated)
+        persisted.save()
+
+    workers = min(config.get("workers", os.cpu_count() or 1), len(groups))
+    logger.info(
+        "Signing %d slots of %s with %d key sets in %d processes",
+        schedule.slot_count,
+        name,
+        len(groups),
+        workers,
+    )
+    with cmtimer(f"Fast-forward of {name}", logger=logger):
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_fast_forward,
+            initargs=(unsigned,),
+        ) as executor:
+            futures = [
+                executor.submit(_fast_forward_slots, config, jobs)
+                for jobs in groups.values()
+            ]
+            for future in futures:
+                for quarter, slot in future.result():
+                    logger.info("Signed %s quarter %d slot %d", name, quarter, slot)
+
+
+def terminate(signum: int, frame) -> None:
+    """Exit on SIGTERM, so staged outputs are removed as on other exceptions"""
+    raise SystemExit(128 + signum)
+
+
+def get_sections(config: dict) -> List[str]:
+    """Return all zone sections in configuration"""
+    return [name for name, value in config.items() if isinstance(value, dict)]
 
 
 def main():
@@ -141,10 +839,55 @@ def main():
         "--config-file", dest="config_file", type=str, default="rollercoaster.toml"
     )
     parser.add_argument(
-        "--config-section", dest="config_section", type=str, default="default"
+        "--config-section",
+        dest="config_sections",
+        metavar="section",
+        type=str,
+        action="append",
+        help="Configuration section to sign (may be repeated, default: default)",
+    )
+    parser.add_argument(
+        "--all-sections",
+        dest="all_sections",
+        action="store_true",
+        help="Sign all configuration sections",
     )
     parser.add_argument("--debug", action="store_true", help="Enable debugging")
     parser.add_argument("--loop", action="store_true", help="Continuous signing")
+    parser.add_argument(
+        "--fast-forward",
+        dest="fast_forward",
+        metavar="directory",
+        type=str,
+        help="Sign all slots of a cycle into directory and exit",
+    )
+    parser.add_argument(
+        "--start",
+        metavar="timestamp",
+        type=int,
+        help="Simulated time (in seconds since epoch) within cycle to fast-forward",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="n|qNsM",
+        type=SlotSelection.from_text,
+        help="Profile stages of the next n slots or of named slot",
+    )
+    parser.add_argument(
+        "--trace-malloc",
+        dest="trace_malloc",
+        metavar="n|qNsM",
+        type=SlotSelection.from_text,
+        help="Trace memory allocations of the next n slots or of named slot",
+    )
+    parser.add_argument(
+        "--profile-directory",
+        dest="profile_directory",
+        metavar="directory",
+        type=str,
+        default=".",
+        help="Directory for profiles and allocation snapshots",
+    )
     args = parser.parse_args()
 
     if args.debug:
@@ -155,107 +898,118 @@ def main():
     with open(args.config_file, "rb") as fp:
         config = tomllib.load(fp)
 
-    if hints := config[args.config_section].get("hints"):
-        with open(hints) as fp:
-            hints_rrsets = dns.zonefile.read_rrsets(fp.read())
+    if args.all_sections:
+        sections = get_sections(config)
     else:
-        hints_rrsets = None
-
-    if filename := config[args.config_section].get("upstream"):
-        with cmtimer("Prepare zone", logger=logger):
-            zone = dns.zone.from_file(
-                open(filename),
-                origin=config[args.config_section]["origin"],
-                relativize=False,
-            )
-            prepare_zone(zone, hints_rrsets)
-            with open(config[args.config_section]["unsigned"], "wt") as fp:
-                zone.to_file(fp)
+        sections = args.config_sections or ["default"]
 
-    register_algorithm_cls(
-        algorithm=MyPrivateKey.public_cls.algorithm,
-        algorithm_cls=MyPrivateKey,
-        name=MyPrivateKey.public_cls.name,
-    )
+    for section in sections:
+        if section not in config:
+            parser.error(f"Configuration section {section} not found")
 
-    keyring = get_keyring(config[args.config_section])
+    register_private_algorithm()
+    signal.signal(signal.SIGTERM, terminate)
 
     td = timedelta(seconds=config["delta"])
-    refresh = (int(td.total_seconds()) // 5) or 5
-
-    dnskey_ttl = config[args.config_section].get("dnskey_ttl", DEFAULT_DNSKEY_TTL)
-    lifetime = config[args.config_section].get("lifetime", DEFAULT_LIFETIME)
 
-    quarter, slot = get_current_qs(td)
+    if args.fast_forward:
+        for section in sections:
+            if len(sections) > 1:
+                directory = os.path.join(args.fast_forward, section)
+            else:
+                directory = args.fast_forward
+            fast_forward(section, config[section], td, directory, start=args.start)
+        return
+
+    if metrics_listen := config.get("metrics_listen"):
+        metrics_server = MetricsServer(
+            address=metrics_listen,
+            port=config.get("metrics_port", DEFAULT_METRICS_PORT),
+        )
+        metrics_server.start()
+    else:
+        metrics_server = None
 
-    while True:
-        with cmtimer("Loading zone"):
-            zone = dns.zone.from_file(
-                open(config[args.config_section]["unsigned"]),
-                origin=config[args.config_section]["origin"],
-                relativize=False,
-            )
+    if metrics := config.get("metrics"):
+        remove_stale(metrics)
 
-        logger.info("Starting quarter %d slot %d", quarter, slot)
+    resources = SharedResources(config, sections)
+    zones = [ZoneSigner(name, config[name], td, resources) for name in sections]
 
-        keyring.generate(quarter, slot)
-        keyring.update(quarter, slot)
+    # zones are signed concurrently when signing is done by worker processes
+    if resources.pool is not None and len(zones) > 1:
+        zone_executor = ThreadPoolExecutor(
+            max_workers=len(zones), thread_name_prefix="zone"
+        )
+    else:
+        zone_executor = None
+
+    if args.profile or args.trace_malloc:
+        profiler = SlotProfiler(
+            directory=args.profile_directory,
+            profile=args.profile,
+            trace_malloc=args.trace_malloc,
+        )
+    else:
+        profiler = None
 
-        keyring.print_state()
+    t = int(time.time())
+    first = True
 
-        with zone.writer() as txn:
-            txn.replace(
-                dns.name.Name(["_rollercoaster"]) + zone.origin,
-                0,
-                TXT(dns.rdataclass.IN, dns.rdatatype.TXT, [f"q{quarter}s{slot}"]),
+    while True:
+        if profiler is not None:
+            schedule = zones[0].schedule
+            quarter, slot = get_current_qs(
+                td, t, quarters=schedule.quarters, slots=schedule.slots
             )
-
-        with cmtimer("Signing zone", logger=logger):
-            keyring.sign_zone(zone, lifetime=lifetime, dnskey_ttl=dnskey_ttl)
-
-        if filename := config[args.config_section].get("signed"):
-            with open(filename, "wt") as fp:
-                with cmtimer("Saving zone", logger=logger):
-                    zone.to_file(fp)
-            logger.info("Saved signed zone to %s", filename)
-
-        if quarter == 4 and slot == 9:
-            logger.info("Rotate keys")
-            keyring.rotate()
-
-        keyring.save()
-
-        if anchors := config[args.config_section].get("anchors"):
-            logger.info("Saving trust anchors to %s", anchors)
-            ds_ta_rrset = get_zone_trust_anchors_ds(zone)
-            dnskey_ta_rrset = get_zone_trust_anchors_dnskey(zone)
-            with open(anchors, "wt") as fp:
-                for rdata in ds_ta_rrset:
-                    print(f"{zone.origin} IN DS {rdata}", file=fp)
-                for rdata in dnskey_ta_rrset:
-                    print(f"; {zone.origin} IN DNSKEY {rdata}", file=fp)
-
-        if dashboard := config[args.config_section].get("dashboard"):
-            logger.info("Render dashboard to %s", dashboard)
-            with open(dashboard, "wt") as fp:
-                fp.write(
-                    render_html(
-                        keyring,
-                        delta=td,
-                        refresh=refresh,
-                        current_quarter=quarter,
-                        current_slot=slot,
-                    )
-                )
-
-        if reload_command := config[args.config_section].get("reload"):
-            logger.info("Executing reload command")
-            os.system(reload_command)
+            profiler.begin(t, quarter, slot)
+
+        resources.refresh()
+
+        for zone in zones:
+            zone.begin(t)
+
+        futures = []
+        try:
+            if zone_executor is not None:
+                futures = [zone_executor.submit(zone.sign) for zone in zones]
+                for future in futures:
+                    future.exception()
+                for future in futures:
+                    future.result()
+            else:
+                for zone in zones:
+                    zone.sign()
+            wait_for_slot(t, catch_up=first)
+            for zone in zones:
+                zone.commit()
+        except BaseException:
+            # zones still being signed (when interrupted by a signal) are
+            # waited for, as they may stage outputs until done
+            wait(futures)
+            for zone in zones:
+                zone.abort()
+            raise
+
+        if metrics := config.get("metrics"):
+            write_atomic(metrics, REGISTRY.expose().encode())
+
+        if profiler is not None:
+            profiler.end()
 
         if not args.loop:
             break
 
-        quarter, slot = get_next_qs(td)
+        t, _, _ = get_next_slot(td, t)
+        first = False
+
+    if zone_executor is not None:
+        zone_executor.shutdown()
+    for zone in zones:
+        zone.shutdown()
+    resources.shutdown()
+    if metrics_server is not None:
+        metrics_server.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,315 @@
+import logging
+import math
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+import dns.dnssec
+import dns.name
+import dns.rdataset
+import dns.rdatatype
+import dns.transaction
+from dns.dnssecalgs import GenericPrivateKey
+from dns.rdtypes.ANY.DNSKEY import DNSKEY
+from dns.rdtypes.ANY.RRSIG import RRSIG
+from dns.rdtypes.dnskeybase import Flag
+
+from rollercoaster.canonical import CanonicalCache, CanonicalRRset, canonical_rrset
+from rollercoaster.metrics import SIGNATURES_CREATED, SIGNATURES_REUSED
+from rollercoaster.sigcache import SignatureCache, SignatureKey
+
+logger = logging.getLogger(__name__)
+
+KSK_RDTYPES = set(
+    [
+        dns.rdatatype.DNSKEY,
+        dns.rdatatype.CDS,
+        dns.rdatatype.CDNSKEY,
+    ]
+)
+
+SHARDS_PER_WORKER = 4
+
+# RRSIG RDATA up to the signer name: type covered, algorithm, labels,
+# original TTL, signature expiration, signature inception and key tag
+RRSIG_FIXED = struct.Struct("!HBBIIIH")
+
+# (owner name, signature data following the RRSIG fields, and the key
+# index and RRSIG fields of each signature)
+SigningJob = Tuple[dns.name.Name, bytes, List[Tuple[int, bytes]]]
+
+_worker_keys: Dict[bytes, GenericPrivateKey] = {}
+
+
+def _sign_shard(
+    keys: List[Tuple[Type[GenericPrivateKey], bytes]],
+    jobs: List[SigningJob],
+) -> List[bytes]:
+    """Sign shard of RRsets (executed in worker process)"""
+    private_keys: List[Optional[GenericPrivateKey]] = [None] * len(keys)
+    res = []
+    for _, data, signatures in jobs:
+        for index, fields in signatures:
+            private_key = private_keys[index]
+            if private_key is None:
+                private_cls, pem = keys[index]
+                private_key = _worker_keys.get(pem)
+                if private_key is None:
+                    private_key = private_cls.from_pem(pem)
+                    _worker_keys[pem] = private_key
+                private_keys[index] = private_key
+            res.append(private_key.sign(fields + data))
+    return res
+
+
+class SigningPool:
+    """Pool of worker processes signing RRsets in shards of owner names
+
+    Each job holds the signature data of an RRset once, with the RRSIG
+    fields of every key signing it.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        logger.info("Started signing pool with %d workers", workers)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+
+    def shards(self, jobs: List[SigningJob]) -> List[List[SigningJob]]:
+        """Split jobs into shards without splitting owner names"""
+        shard_size = math.ceil(len(jobs) / (self.workers * SHARDS_PER_WORKER))
+        res: List[List[SigningJob]] = []
+        shard: List[SigningJob] = []
+        for job in jobs:
+            if len(shard) >= shard_size and job[0] != shard[-1][0]:
+                res.append(shard)
+                shard = []
+            shard.append(job)
+        if shard:
+            res.append(shard)
+        return res
+
+    def sign(
+        self,
+        keys: List[Tuple[Type[GenericPrivateKey], bytes]],
+        jobs: List[SigningJob],
+    ) -> List[bytes]:
+        """Sign jobs and return all signatures in the order of the jobs"""
+        if not jobs:
+            return []
+        shards = self.shards(jobs)
+        logger.debug("Signing %d RRsets in %d shards", len(jobs), len(shards))
+        res = []
+        for signatures in self.executor.map(_sign_shard, [keys] * len(shards), shards):
+            res.extend(signatures)
+        return res
+
+
+class RRsetSigner:
+    """RRset signer used when signing zones
+
+    Signatures are reused from the signature cache (if any) or created,
+    either directly or deferred to a signing pool. Deferred signatures
+    are added to the transaction by flush() in the same order as they
+    would have been added when signing serially.
+
+    The signature data is made from the canonical form of the RRset,
+    taken from the canonical cache (if any) when the RRset is unchanged,
+    so signing only involves the cryptographic operation of each key.
+    Each RRset is prepared once for all keys signing it, as the signature
+    data of the keys only differ in the RRSIG fields, and the signatures
+    of all keys are added to the zone together.
+    """
+
+    def __init__(
+        self,
+        signer: dns.name.Name,
+        keys: List[Tuple[GenericPrivateKey, DNSKEY]],
+        lifetime: int,
+        inception: Optional[int] = None,
+        policy: Optional[dns.dnssec.Policy] = None,
+        cache: Optional[SignatureCache] = None,
+        pool: Optional[SigningPool] = None,
+        canonical: Optional[CanonicalCache] = None,
+    ):
+        self.signer = signer
+        self.signer_wire = signer.to_digestable()
+        self.lifetime = lifetime
+        self.inception = inception or int(time.time())
+        self.cache = cache
+        self.pool = pool
+        self.canonical = canonical
+
+        # keys are checked against the policy once, as dns.dnssec.sign
+        # would do for every signature
+        if policy is None:
+            policy = dns.dnssec.default_policy
+        for _, dnskey in keys:
+            if not policy.ok_to_sign(dnskey):
+                raise dns.dnssec.DeniedByPolicy
+
+        self.keys = [
+            (private_key, dnskey, dns.dnssec.key_id(dnskey))
+            for private_key, dnskey in keys
+        ]
+        self.ksks = [i for i, k in enumerate(self.keys) if k[1].flags & Flag.SEP]
+        self.zsks = [i for i, k in enumerate(self.keys) if not k[1].flags & Flag.SEP]
+
+        # same key selection as dns.dnssec.sign_zone
+        if not self.ksks:
+            self.ksks = self.zsks
+        if not self.zsks:
+            self.zsks = self.ksks
+
+        self.pending: List[
+            Tuple[dns.name.Name, dns.rdataset.Rdataset, List[Union[RRSIG, int]]]
+        ] = []
+        self.jobs: List[SigningJob] = []
+        self.job_rrsigs: List[Tuple[CanonicalRRset, int, int]] = []
+        self.job_keys: List[Optional[SignatureKey]] = []
+
+        # signatures created and reused per key index
+        self.created = [0] * len(self.keys)
+        self.reused = [0] * len(self.keys)
+
+        if self.cache is not None:
+            self.cache.begin()
+
+    def __call__(
+        self,
+        txn: dns.transaction.Transaction,
+        name: dns.name.Name,
+        rdataset: dns.rdataset.Rdataset,
+    ):
+        if self.canonical is not None:
+            form = self.canonical.get(name, rdataset)
+        else:
+            form = canonical_rrset(name, rdataset, self.signer)
+        indices = self.ksks if rdataset.rdtype in KSK_RDTYPES else self.zsks
+
+        if self.cache is not None:
+            expiration = self.cache.expiration(
+                form.digest, self.inception, self.lifetime
+            )
+        else:
+            expiration = self.inception + self.lifetime
+
+        # signature data only differs between keys in the RRSIG fields, so
+        # the rest is put together once for all keys
+        data = self.signer_wire + form.data
+        signatures: List[Union[RRSIG, int]] = []
+        job: List[Tuple[int, bytes]] = []
+
+        for index in indices:
+            private_key, dnskey, keytag = self.keys[index]
+            cache_key = None
+            if self.cache is not None:
+                cache_key = (form.digest, keytag, dnskey.algorithm)
+                rrsig = self.cache.get(cache_key, self.inception)
+                if rrsig is not None:
+                    self.reused[index] += 1
+                    signatures.append(rrsig)
+                    continue
+
+            self.created[index] += 1
+            fields = RRSIG_FIXED.pack(
+                form.rdtype,
+                dnskey.algorithm,
+                form.labels,
+                form.ttl,
+                expiration,
+                self.inception,
+                keytag,
+            )
+            if self.pool is not None:
+                signatures.append(len(self.job_rrsigs))
+                job.append((index, fields))
+                self.job_rrsigs.append((form, index, expiration))
+                self.job_keys.append(cache_key)
+            else:
+                signature = private_key.sign(fields + data)
+                rrsig = self.rrsig(form, index, expiration, signature)
+                if cache_key is not None:
+                    self.cache.put(cache_key, rrsig)
+                signatures.append(rrsig)
+
+        if job:
+            self.jobs.append((name, data, job))
+        if self.pool is not None:
+            self.pending.append((name, rdataset, signatures))
+        elif signatures:
+            # all signatures of the RRset are added at once
+            txn.add(name, dns.rdataset.from_rdata_list(form.ttl, signatures))
+
+    def rrsig(
+        self, form: CanonicalRRset, index: int, expiration: int, signature: bytes
+    ) -> RRSIG:
+        _, dnskey, keytag = self.keys[index]
+        return RRSIG(
+            rdclass=dnskey.rdclass,
+            rdtype=dns.rdatatype.RRSIG,
+            type_covered=form.rdtype,
+            algorithm=dnskey.algorithm,
+            labels=form.labels,
+            original_ttl=form.ttl,
+            expiration=expiration,
+            inception=self.inception,
+            key_tag=keytag,
+            signer=self.signer,
+            signature=signature,
+        )
+
+    def update_metrics(self) -> None:
+        """Add signatures created and reused to metrics"""
+        for index, (_, dnskey, _) in enumerate(self.keys):
+            # keys are labelled by role, as key tags change every cycle
+            labels = {
+                "algorithm": dnskey.algorithm.name,
+                "role": "ksk" if dnskey.flags & Flag.SEP else "zsk",
+            }
+            if self.created[index]:
+                SIGNATURES_CREATED.inc(self.created[index], **labels)
+            if self.reused[index]:
+                SIGNATURES_REUSED.inc(self.reused[index], **labels)
+        self.created = [0] * len(self.keys)
+        self.reused = [0] * len(self.keys)
+
+    def flush(self, txn: dns.transaction.Transaction) -> None:
+        """Add deferred signatures to transaction"""
+
+        if self.pool is None:
+            return
+
+        keys = []
+        for private_key, _, _ in self.keys:
+            keys.append((type(private_key), private_key.to_pem()))
+        signatures = [
+            self.rrsig(form, index, expiration, signature)
+            for (form, index, expiration), signature in zip(
+                self.job_rrsigs, self.pool.sign(keys, self.jobs)
+            )
+        ]
+
+        if self.cache is not None:
+            for cache_key, rrsig in zip(self.job_keys, signatures):
+                self.cache.put(cache_key, rrsig)
+
+        for name, rdataset, items in self.pending:
+            if rdataset.rdtype == dns.rdatatype.NSEC:
+                # move NSEC after the signatures of the other RRsets at this
+                # name, as when signing serially
+                txn.replace(name, rdataset)
+            if items:
+                rrsigs = [
+                    signatures[item] if isinstance(item, int) else item
+                    for item in items
+                ]
+                txn.add(name, dns.rdataset.from_rdata_list(rdataset.ttl, rrsigs))
+
+        self.pending = []
+        self.jobs = []
+        self.job_rrsigs = []
+        self.job_keys = []
@@ -0,0 +1,238 @@
+import hashlib
+import logging
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import dns.name
+import dns.node
+import dns.rdataset
+import dns.rrset
+import dns.zone
+
+from rollercoaster.canonical import CanonicalCache
+from rollercoaster.nsec import NsecChain
+from rollercoaster.prepare import read_zone
+from rollercoaster.utils import cmtimer
+from rollercoaster.zonestore import NodeStore, PackedNodes, StoreZone
+
+logger = logging.getLogger(__name__)
+
+FileStamp = Tuple[int, int, bytes]
+
+
+def file_stamp(filename: str, previous: Optional[FileStamp] = None) -> FileStamp:
+    """Return modification time, size and digest of file
+
+    The file is only hashed again if the modification time or size differs
+    from the previous stamp.
+    """
+    st = os.stat(filename)
+    if previous and previous[0] == st.st_mtime_ns and previous[1] == st.st_size:
+        return previous
+    with open(filename, "rb") as fp:
+        digest = hashlib.file_digest(fp, "sha256").digest()
+    return (st.st_mtime_ns, st.st_size, digest)
+
+
+def diff_nodes(
+    old_node: Optional[dns.node.Node], new_node: Optional[dns.node.Node]
+) -> Iterator[Tuple[Optional[dns.rdataset.Rdataset], Optional[dns.rdataset.Rdataset]]]:
+    """Return old and new rdataset for all RRsets that differ between nodes"""
+    old_rdatasets = old_node.rdatasets if old_node else []
+    new_rdatasets = new_node.rdatasets if new_node else []
+    for rdataset in new_rdatasets:
+        existing = None
+        if old_node is not None:
+            existing = old_node.get_rdataset(
+                rdataset.rdclass, rdataset.rdtype, rdataset.covers
+            )
+        if existing is None or existing != rdataset or existing.ttl != rdataset.ttl:
+            yield existing, rdataset
+    for rdataset in old_rdatasets:
+        if (
+            new_node is None
+            or new_node.get_rdataset(rdataset.rdclass, rdataset.rdtype, rdataset.covers)
+            is None
+        ):
+            yield rdataset, None
+
+
+def diff_zones(
+    old: dns.zone.Zone, new: dns.zone.Zone
+) -> Iterator[
+    Tuple[
+        dns.name.Name, Optional[dns.rdataset.Rdataset], Optional[dns.rdataset.Rdataset]
+    ]
+]:
+    """Return owner name, old and new rdataset for all RRsets that differ"""
+    if isinstance(old.nodes, NodeStore) and isinstance(new.nodes, NodeStore):
+        yield from diff_stores(old.nodes, new.nodes)
+        return
+    for name, new_node in new.items():
+        old_node = old.get_node(name)
+        if old_node is new_node:
+            # nodes not written since a snapshot was taken are shared
+            continue
+        for old_rdataset, new_rdataset in diff_nodes(old_node, new_node):
+            yield name, old_rdataset, new_rdataset
+    for name, old_node in old.items():
+        if new.get_node(name) is None:
+            for rdataset in old_node.rdatasets:
+                yield name, rdataset, None
+
+
+def diff_stores(
+    old: NodeStore, new: NodeStore
+) -> Iterator[
+    Tuple[
+        dns.name.Name, Optional[dns.rdataset.Rdataset], Optional[dns.rdataset.Rdataset]
+    ]
+]:
+    """Return differences as diff_zones, only decoding nodes that differ"""
+    for name, data in new.items_encoded():
+        old_data = old.encoded(name)
+        if old_data == data:
+            continue
+        old_node = old[name] if old_data is not None else None
+        for old_rdataset, new_rdataset in diff_nodes(old_node, new[name]):
+            yield name, old_rdataset, new_rdataset
+    for name, _ in old.items_encoded():
+        if name not in new:
+            for rdataset in old[name].rdatasets:
+                yield name, rdataset, None
+
+
+class UnsignedZone:
+    """Prepared unsigned zone kept in memory between slots
+
+    The zone is parsed once and only parsed again when the upstream or
+    unsigned zone file changes, in which case only the RRsets that differ
+    are applied to the zone in memory. Each slot signs a snapshot of the
+    zone; nodes are copied on write, so the prepared zone itself is never
+    modified by signing. The NSEC chain of the zone is kept along with
+    it; names added to every snapshot are added to the chain as well.
+    So is the canonical form of the RRsets to be signed, unless a store is
+    used (nodes are then decoded when read, and cannot be recognised as
+    unchanged).
+
+    With a store, zones are kept in a compact StoreZone, and the unsigned
+    zone is saved to the store to be memory-mapped instead of parsed when
+    loaded again.
+    """
+
+    def __init__(
+        self,
+        origin: str,
+        unsigned: str,
+        upstream: Optional[str] = None,
+        hints_rrsets: Optional[List[dns.rrset.RRset]] = None,
+        store: Optional[str] = None,
+    ):
+        self.origin = dns.name.from_text(origin)
+        self.unsigned = unsigned
+        self.upstream = upstream
+        self.hints_rrsets = hints_rrsets
+        self.store = store
+        self.zone_factory = StoreZone if store else dns.zone.Zone
+        self.stamps: Dict[str, FileStamp] = {}
+        self.zone: Optional[dns.zone.Zone] = None
+        self.chain: Optional[NsecChain] = None
+        self.canonical: Optional[CanonicalCache] = None
+        # incremented whenever the zone is replaced or changed
+        self.generation = 0
+
+    def changed(self, filename: str) -> bool:
+        """Check if file has changed since last seen"""
+        stamp = file_stamp(filename, self.stamps.get(filename))
+        if self.stamps.get(filename, (None, None, None))[2] == stamp[2]:
+            self.stamps[filename] = stamp
+            return False
+        return True
+
+    def refresh(self) -> bool:
+        """Update zone if the upstream or unsigned zone has changed"""
+        if self.upstream and self.changed(self.upstream):
+            self.prepare()
+            return True
+        if self.zone is None or self.changed(self.unsigned):
+            self.load()
+            return True
+        return False
+
+    def prepare(self) -> None:
+        """Prepare zone from upstream and save as unsigned zone"""
+        stamp = file_stamp(self.upstream)
+        with cmtimer("Prepare zone", logger=logger, stage="prepare"):
+            zone = read_zone(
+                self.upstream, self.origin, self.hints_rrsets, self.zone_factory
+            )
+            with open(self.unsigned, "wt") as fp:
+                zone.to_file(fp)
+        self.stamps[self.upstream] = stamp
+        self.stamps[self.unsigned] = file_stamp(self.unsigned)
+        if self.store:
+            zone = self.save_store(zone, self.stamps[self.unsigned])
+        self.replace(zone)
+
+    def load(self) -> None:
+        """Load unsigned zone"""
+        stamp = file_stamp(self.unsigned)
+        if self.store and PackedNodes.read_digest(self.store) == stamp[2]:
+            zone = StoreZone.load(self.store, self.origin)
+            logger.info("Loaded zone from store %s", self.store)
+        else:
+            with cmtimer("Loading zone", logger=logger, stage="load"):
+                zone = dns.zone.from_file(
+                    open(self.unsigned),
+                    origin=self.origin,
+                    relativize=False,
+                    zone_factory=self.zone_factory,
+                )
+            if self.store:
+                zone = self.save_store(zone, stamp)
+        self.stamps[self.unsigned] = stamp
+        self.replace(zone)
+
+    def save_store(self, zone: StoreZone, stamp: FileStamp) -> StoreZone:
+        """Save zone to store, and return zone memory-mapped from store"""
+        zone.save(self.store, digest=stamp[2])
+        return StoreZone.load(self.store, self.origin)
+
+    def replace(self, zone: dns.zone.Zone) -> None:
+        """Replace zone, applying only the changes if a zone is already loaded"""
+        self.generation += 1
+        if self.zone is None:
+            self.zone = zone
+            self.chain = NsecChain.from_zone(zone)
+            if not self.store:
+                with cmtimer(
+                    "Creating canonical form", logger=logger, stage="canonical"
+                ):
+                    self.canonical = CanonicalCache.from_zone(zone, self.chain)
+            return
+        with cmtimer("Applying changes", logger=logger, stage="apply"):
+            names = set()
+            changes = 0
+            for name, _, _ in diff_zones(self.zone, zone):
+                names.add(name)
+                changes += 1
+            with self.zone.writer() as txn:
+                # changed names are replaced as a whole to keep the order
+                # of RRsets the same as when loading the zone
+                for name in names:
+                    if txn.name_exists(name):
+                        txn.delete(name)
+                    if node := zone.get_node(name):
+                        for rdataset in node.rdatasets:
+                            txn.add(name, rdataset)
+            for name in sorted(names):
+                self.chain.update(self.zone, name)
+            if self.canonical is not None:
+                self.canonical.update(self.zone, self.chain, names)
+        logger.info("Applied %d changed RRsets at %d names", changes, len(names))
+
+    def snapshot(self) -> dns.zone.Zone:
+        """Return copy-on-write snapshot of the prepared zone"""
+        zone = self.zone_factory(self.zone.origin, self.zone.rdclass, relativize=False)
+        zone.nodes = self.zone.nodes.copy()
+        return zone
@@ -1,17 +1,40 @@
 import logging
 import time
-from contextlib import ContextDecorator
+from contextlib import AbstractContextManager, ContextDecorator, ExitStack
+from typing import Callable, List, Optional
+
+from rollercoaster.metrics import STAGE_DURATION, current_zone
+
+# context managers entered around every stage, e.g. for profiling
+StageHook = Callable[[str], AbstractContextManager]
+stage_hooks: List[StageHook] = []
 
 
 class cmtimer(ContextDecorator):
-    def __init__(self, msg, logger=None):
+    """Log elapsed time, and record it as duration of stage (if given)
+
+    The duration is recorded for the current zone, if any.
+    """
+
+    def __init__(self, msg, logger=None, stage: Optional[str] = None):
         self.msg = msg
         self.logger = logger or logging.getLogger(__name__)
+        self.stage = stage
+        self.hooks: Optional[ExitStack] = None
 
     def __enter__(self):
+        if self.stage is not None and stage_hooks:
+            self.hooks = ExitStack()
+            for hook in list(stage_hooks):
+                self.hooks.enter_context(hook(self.stage))
         self.time = time.perf_counter()
         return self
 
     def __exit__(self, type, value, traceback):
         elapsed = time.perf_counter() - self.time
+        if self.hooks is not None:
+            self.hooks.close()
+            self.hooks = None
         self.logger.debug(f"{self.msg} took {elapsed:.3f} seconds")
+        if self.stage is not None:
+            STAGE_DURATION.observe(elapsed, zone=current_zone.get(), stage=self.stage)
@@ -0,0 +1,264 @@
+import logging
+import random
+from typing import Dict, List, Optional, Set, Tuple, Type
+
+import dns.dnssec
+import dns.exception
+import dns.name
+import dns.node
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+from cryptography.exceptions import InvalidSignature
+from dns.dnssecalgs import get_algorithm_cls_from_dnskey
+from dns.dnssecalgs.base import GenericPublicKey
+from dns.rdtypes.ANY.DNSKEY import DNSKEY
+from dns.rdtypes.dnskeybase import Flag
+
+from rollercoaster.canonical import canonical_rrset
+from rollercoaster.signing import RRSIG_FIXED, SigningPool
+
+logger = logging.getLogger(__name__)
+
+# failures included in the exception raised
+MAX_REPORTED_FAILURES = 10
+
+# (owner name, key index, signature data, signature)
+VerificationJob = Tuple[dns.name.Name, int, bytes, bytes]
+
+_worker_public_keys: Dict[DNSKEY, GenericPublicKey] = {}
+
+
+def _verify_shard(
+    keys: List[Tuple[Optional[Type[GenericPublicKey]], DNSKEY]],
+    jobs: List[VerificationJob],
+) -> List[bool]:
+    """Verify shard of signatures (executed in worker process)"""
+    public_keys: List[Optional[GenericPublicKey]] = [None] * len(keys)
+    res = []
+    for _, index, data, signature in jobs:
+        public_key = public_keys[index]
+        if public_key is None:
+            public_cls, dnskey = keys[index]
+            public_key = _worker_public_keys.get(dnskey)
+            if public_key is None:
+                public_key = public_cls.from_dnskey(dnskey)
+                _worker_public_keys[dnskey] = public_key
+            public_keys[index] = public_key
+        try:
+            public_key.verify(signature, data)
+            res.append(True)
+        except InvalidSignature:
+            res.append(False)
+    return res
+
+
+class ZoneVerifier:
+    """Verify signed zones before they are published
+
+    The DNSKEY RRset must be signed by a key matching one of the trust
+    anchors, and all RRsets in the zone (or a random sample of them) must
+    be signed. Every signature checked must be valid at the given time and
+    made by a key in the DNSKEY RRset. Public keys are created once per key,
+    and signatures are verified by the signing pool (if any).
+
+    As by validating resolvers, signatures made by keys of algorithms that
+    are not supported (such as the private algorithm) are not verified.
+    """
+
+    def __init__(
+        self, sample: Optional[int] = None, pool: Optional[SigningPool] = None
+    ):
+        self.sample = sample
+        self.pool = pool
+
+    def verify(
+        self,
+        zone: dns.zone.Zone,
+        now: int,
+        anchors: Optional[dns.rrset.RRset] = None,
+    ) -> None:
+        """Verify zone at time now, raises ValidationFailure on failure
+
+        Without trust anchors, the DNSKEY RRset must be signed by one of
+        its own non-revoked SEP keys.
+        """
+        origin = zone.origin
+        dnskeys = zone.get_rdataset(origin, dns.rdatatype.DNSKEY)
+        if not dnskeys:
+            raise dns.dnssec.ValidationFailure("No DNSKEY RRset at apex")
+
+        keys: List[Tuple[Optional[Type[GenericPublicKey]], DNSKEY]] = []
+        candidates: Dict[Tuple[int, int], List[int]] = {}
+        for dnskey in dnskeys:
+            try:
+                public_cls = get_algorithm_cls_from_dnskey(dnskey).public_cls
+            except dns.exception.DNSException:
+                public_cls = None
+            candidates.setdefault(
+                (dns.dnssec.key_id(dnskey), dnskey.algorithm), []
+            ).append(len(keys))
+            keys.append((public_cls, dnskey))
+
+        trusted = set()
+        for index, (_, dnskey) in enumerate(keys):
+            if self.is_trusted(origin, dnskey, anchors):
+                trusted.add(index)
+
+        rrsets = self.rrsets(zone)
+        if self.sample and len(rrsets) > self.sample:
+            rrsets = random.sample(rrsets, self.sample)
+        rrsets.append((origin, dnskeys, zone.get_node(origin)))
+
+        signer = origin.to_digestable()
+        failures: List[str] = []
+        jobs: List[VerificationJob] = []
+        # owner name, type covered and key tag of each signature, and the
+        # signature verified by each job
+        signatures: List[Tuple[dns.name.Name, int, int]] = []
+        job_signatures: List[int] = []
+        signed_by: Set[int] = set()
+        unsupported = 0
+
+        for name, rdataset, node in rrsets:
+            rdtype = rdataset.rdtype
+            rrsigs = node.get_rdataset(zone.rdclass, dns.rdatatype.RRSIG, rdtype)
+            if not rrsigs:
+                failures.append(f"{name} {dns.rdatatype.to_text(rdtype)} not signed")
+                continue
+            form = canonical_rrset(name, rdataset, origin)
+            for rrsig in rrsigs:
+                failure = None
+                indices = candidates.get((rrsig.key_tag, rrsig.algorithm))
+                if rrsig.signer != origin:
+                    failure = f"signer {rrsig.signer}"
+                elif not indices:
+                    failure = "unknown key"
+                elif rrsig.inception > now:
+                    failure = "not yet valid"
+                elif rrsig.expiration < now:
+                    failure = "expired"
+                elif rrsig.labels != form.labels or rrsig.original_ttl != form.ttl:
+                    failure = "labels or original TTL differ"
+                if failure is not None:
+                    failures.append(
+                        f"{name} {dns.rdatatype.to_text(rdtype)} RRSIG"
+                        f" ({rrsig.key_tag}) {failure}"
+                    )
+                    continue
+                data = (
+                    RRSIG_FIXED.pack(
+                        rdtype,
+                        rrsig.algorithm,
+                        rrsig.labels,
+                        rrsig.original_ttl,
+                        rrsig.expiration,
+                        rrsig.inception,
+                        rrsig.key_tag,
+                    )
+                    + signer
+                    + form.data
+                )
+                if rdtype == dns.rdatatype.DNSKEY and name == origin:
+                    signed_by.update(indices)
+                indices = [i for i in indices if keys[i][0] is not None]
+                if not indices:
+                    unsupported += 1
+                    continue
+                # key tags are not unique, any key with the key tag may do
+                for index in indices:
+                    jobs.append((name, index, data, rrsig.signature))
+                    job_signatures.append(len(signatures))
+                signatures.append((name, rdtype, rrsig.key_tag))
+
+        valid = [False] * len(signatures)
+        for signature, ok in zip(job_signatures, self.run(keys, jobs)):
+            valid[signature] = valid[signature] or ok
+        for (name, rdtype, keytag), ok in zip(signatures, valid):
+            if not ok:
+                failures.append(
+                    f"{name} {dns.rdatatype.to_text(rdtype)} RRSIG ({keytag}) invalid"
+                )
+
+        if not signed_by & trusted:
+            failures.append("DNSKEY RRset not signed by a trust anchor")
+
+        if failures:
+            shown = "; ".join(failures[:MAX_REPORTED_FAILURES])
+            raise dns.dnssec.ValidationFailure(f"{len(failures)} failures: {shown}")
+
+        logger.info(
+            "Verified %d signatures of %d RRsets (not verified %d signatures"
+            " of unsupported algorithms)",
+            len(signatures),
+            len(rrsets),
+            unsupported,
+        )
+
+    @staticmethod
+    def is_trusted(
+        origin: dns.name.Name, dnskey: DNSKEY, anchors: Optional[dns.rrset.RRset]
+    ) -> bool:
+        if dnskey.flags & Flag.REVOKE:
+            return False
+        if anchors is None:
+            return bool(dnskey.flags & Flag.SEP)
+        return any(
+            ds.key_tag == dns.dnssec.key_id(dnskey)
+            and ds.algorithm == dnskey.algorithm
+            and dns.dnssec.make_ds(origin, dnskey, ds.digest_type) == ds
+            for ds in anchors
+        )
+
+    @staticmethod
+    def rrsets(
+        zone: dns.zone.Zone,
+    ) -> List[Tuple[dns.name.Name, dns.rdataset.Rdataset, dns.node.Node]]:
+        """Return RRsets to be signed, except the DNSKEY RRset at the apex"""
+        origin = zone.origin
+        nodes = list(zone.items())
+        delegations = set()
+        for name, node in nodes:
+            if name != origin and node.get_rdataset(zone.rdclass, dns.rdatatype.NS):
+                delegations.add(name)
+
+        res = []
+        for name, node in nodes:
+            parent = name
+            below = False
+            while len(parent) > len(origin) + 1:
+                parent = parent.parent()
+                if parent in delegations:
+                    below = True
+                    break
+            if below:
+                continue
+            delegation = name in delegations
+            for rdataset in node.rdatasets:
+                rdtype = rdataset.rdtype
+                if rdtype == dns.rdatatype.RRSIG:
+                    continue
+                if delegation and rdtype not in (dns.rdatatype.DS, dns.rdatatype.NSEC):
+                    continue
+                if name == origin and rdtype == dns.rdatatype.DNSKEY:
+                    continue
+                res.append((name, rdataset, node))
+        return res
+
+    def run(
+        self,
+        keys: List[Tuple[Optional[Type[GenericPublicKey]], DNSKEY]],
+        jobs: List[VerificationJob],
+    ) -> List[bool]:
+        """Verify signatures, by the signing pool if any"""
+        if self.pool is None or not jobs:
+            return _verify_shard(keys, jobs)
+        shards = self.pool.shards(jobs)
+        logger.debug("Verifying %d signatures in %d shards", len(jobs), len(shards))
+        res = []
+        for results in self.pool.executor.map(
+            _verify_shard, [keys] * len(shards), shards
+        ):
+            res.extend(results)
+        return res
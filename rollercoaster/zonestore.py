@@ -0,0 +1,500 @@
+import array
+import bisect
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+
+import dns.name
+import dns.node
+import dns.rdata
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.zone
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RCZS"
+FORMAT_VERSION = 2
+BYTEORDER = 0 if sys.byteorder == "little" else 1
+
+# magic, format version, byte order, class, number of names, source digest
+HEADER = struct.Struct("<4sBBHQ32s")
+
+# type, covered type, TTL and number of records of RRset
+RRSET_HEADER = struct.Struct("!HHIH")
+RDATA_LENGTH = struct.Struct("!H")
+
+OFFSET_SIZE = 8
+
+# compact when changes exceed this fraction of the packed names
+COMPACT_RATIO = 4
+COMPACT_MIN = 1024
+
+# nodes kept decoded while writing
+HOT_NODES = 16
+
+Buffer = Union[bytes, bytearray, mmap.mmap]
+
+
+def name_hash(name: dns.name.Name) -> int:
+    """Return 64-bit hash of name, independent of case"""
+    return int.from_bytes(
+        hashlib.blake2b(name.to_digestable(), digest_size=8).digest(), "little"
+    )
+
+
+def name_from_wire(wire: Union[bytes, memoryview]) -> dns.name.Name:
+    """Return name from uncompressed wire format"""
+    labels = []
+    i = 0
+    while True:
+        length = wire[i]
+        start = i + 1
+        i = start + length
+        labels.append(bytes(wire[start:i]))
+        if length == 0:
+            return dns.name.Name(labels)
+
+
+def encode_node(node: dns.node.Node) -> bytes:
+    """Encode RRsets at node as uncompressed wire format
+
+    RDATA is kept as is, including the case of embedded names; RRsets are
+    brought into canonical form only when signed.
+    """
+    parts = []
+    for rdataset in node.rdatasets:
+        parts.append(
+            RRSET_HEADER.pack(
+                rdataset.rdtype, rdataset.covers, rdataset.ttl, len(rdataset)
+            )
+        )
+        for rdata in rdataset:
+            wire = rdata.to_wire()
+            parts.append(RDATA_LENGTH.pack(len(wire)))
+            parts.append(wire)
+    return b"".join(parts)
+
+
+def decode_node(data: bytes, rdclass: dns.rdataclass.RdataClass) -> dns.node.Node:
+    """Decode RRsets encoded by encode_node()"""
+    node = dns.node.Node()
+    offset = 0
+    while offset < len(data):
+        rdtype, covers, ttl, count = RRSET_HEADER.unpack_from(data, offset)
+        offset += RRSET_HEADER.size
+        rdataset = dns.rdataset.Rdataset(rdclass, rdtype, covers, ttl)
+        for _ in range(count):
+            (length,) = RDATA_LENGTH.unpack_from(data, offset)
+            offset += RDATA_LENGTH.size
+            rdataset.add(dns.rdata.from_wire(rdclass, rdtype, data, offset, length))
+            offset += length
+        node.rdatasets.append(rdataset)
+    return node
+
+
+def padding(length: int) -> bytes:
+    return bytes(-length % OFFSET_SIZE)
+
+
+class PackedNodes:
+    """Immutable table of owner names and encoded nodes in contiguous buffers
+
+    Owner names are stored once in canonical order, each followed by the
+    encoded RRsets at the name. Names are looked up using a sorted index of
+    name hashes. The table is either built in memory or memory-mapped from
+    a file written by save(), in which case nodes are only paged in when
+    accessed.
+
+    Layout (after the header): offsets of names, offsets of nodes, sorted
+    name hashes and the corresponding name positions (all 64-bit integers
+    in native byte order), followed by name data and node data.
+    """
+
+    def __init__(
+        self,
+        data: Buffer,
+        filename: Optional[str] = None,
+    ):
+        self.data = data
+        self.filename = filename
+        view = memoryview(data)
+
+        magic, version, byteorder, rdclass, count, digest = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a zone store")
+        if byteorder != BYTEORDER:
+            raise ValueError("Zone store has different byte order")
+        self.rdclass = dns.rdataclass.RdataClass(rdclass)
+        self.count = count
+        self.digest = digest
+
+        offset = HEADER.size
+
+        def section(length: int) -> memoryview:
+            nonlocal offset
+            start = offset
+            offset += length
+            return view[start:offset]
+
+        self.name_offsets = section((count + 1) * OFFSET_SIZE).cast("Q")
+        self.node_offsets = section((count + 1) * OFFSET_SIZE).cast("Q")
+        self.hashes = section(count * OFFSET_SIZE).cast("Q")
+        self.positions = section(count * OFFSET_SIZE).cast("Q")
+        names_length = self.name_offsets[count]
+        self.names = section(names_length)
+        section(len(padding(names_length)))
+        self.nodes = section(self.node_offsets[count])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __reduce__(self):
+        # memory-mapped tables are mapped again when unpickled
+        if self.filename is not None:
+            return (PackedNodes.load, (self.filename,))
+        return (PackedNodes, (bytes(self.data),))
+
+    @classmethod
+    def build(
+        cls,
+        items: Iterable[Tuple[dns.name.Name, bytes]],
+        rdclass: dns.rdataclass.RdataClass = dns.rdataclass.IN,
+        digest: bytes = bytes(32),
+    ):
+        """Build table from names (in canonical order) and encoded nodes"""
+        names = bytearray()
+        nodes = bytearray()
+        name_offsets = array.array("Q", [0])
+        node_offsets = array.array("Q", [0])
+        hashes = array.array("Q")
+        for name, data in items:
+            hashes.append(name_hash(name))
+            names += name.to_wire()
+            nodes += data
+            name_offsets.append(len(names))
+            node_offsets.append(len(nodes))
+        count = len(hashes)
+        positions = sorted(range(count), key=hashes.__getitem__)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTEORDER, rdclass, count, digest)
+        data = b"".join(
+            [
+                header,
+                name_offsets.tobytes(),
+                node_offsets.tobytes(),
+                array.array("Q", [hashes[i] for i in positions]).tobytes(),
+                array.array("Q", positions).tobytes(),
+                names,
+                padding(len(names)),
+                nodes,
+            ]
+        )
+        return cls(data)
+
+    @classmethod
+    def load(cls, filename: str):
+        """Memory-map table saved to file"""
+        with open(filename, "rb") as fp:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, filename)
+
+    @staticmethod
+    def read_digest(filename: str) -> Optional[bytes]:
+        """Return digest of source saved in file, if a usable table"""
+        try:
+            with open(filename, "rb") as fp:
+                header = fp.read(HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) < HEADER.size:
+            return None
+        magic, version, byteorder, _, _, digest = HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION or byteorder != BYTEORDER:
+            return None
+        return digest
+
+    def save(self, filename: str, digest: Optional[bytes] = None) -> None:
+        """Save table to file, with digest of its source"""
+        view = memoryview(self.data)
+        start = HEADER.size
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(filename) or ".",
+            prefix=f".{os.path.basename(filename)}.",
+        )
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                magic, version, byteorder, rdclass, count, _ = HEADER.unpack_from(view)
+                fp.write(
+                    HEADER.pack(
+                        magic,
+                        version,
+                        byteorder,
+                        rdclass,
+                        count,
+                        digest or self.digest,
+                    )
+                )
+                fp.write(view[start:])
+            os.replace(tmp, filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        logger.info("Saved %d names to %s", self.count, filename)
+
+    def name(self, position: int) -> dns.name.Name:
+        start, end = self.name_offsets[position], self.name_offsets[position + 1]
+        return name_from_wire(self.names[start:end])
+
+    def node(self, position: int) -> bytes:
+        start, end = self.node_offsets[position], self.node_offsets[position + 1]
+        return bytes(self.nodes[start:end])
+
+    def find(self, name: dns.name.Name) -> Optional[int]:
+        """Return position of name, or None if not found"""
+        h = name_hash(name)
+        i = bisect.bisect_left(self.hashes, h)
+        while i < self.count and self.hashes[i] == h:
+            position = self.positions[i]
+            if self.name(position) == name:
+                return position
+            i += 1
+        return None
+
+    def __iter__(self) -> Iterator[dns.name.Name]:
+        for position in range(self.count):
+            yield self.name(position)
+
+
+EMPTY = PackedNodes.build([])
+
+
+class NodeStore(MutableMapping):
+    """Compact mapping of owner names to nodes, used as nodes of a StoreZone
+
+    Nodes are kept encoded in a packed table, with changes kept encoded
+    by name until the store is compacted into a new table. Nodes are
+    decoded on every access, so the node returned is never shared and
+    changing it does not change the store; nodes are changed by assigning
+    them to the store again. Names are iterated in canonical order.
+    """
+
+    def __init__(
+        self,
+        rdclass: dns.rdataclass.RdataClass = dns.rdataclass.IN,
+        packed: PackedNodes = EMPTY,
+    ):
+        self.rdclass = rdclass
+        self.packed = packed
+        # encoded nodes by name (None if deleted from the packed table)
+        self.changes: Dict[dns.name.Name, Optional[bytes]] = {}
+        # names not in the packed table
+        self.added: Set[dns.name.Name] = set()
+        self.length = len(packed)
+
+    def copy(self):
+        res = NodeStore(self.rdclass, self.packed)
+        res.changes = self.changes.copy()
+        res.added = self.added.copy()
+        res.length = self.length
+        return res
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __contains__(self, name) -> bool:
+        if name in self.changes:
+            return self.changes[name] is not None
+        return self.packed.find(name) is not None
+
+    def encoded(self, name: dns.name.Name) -> Optional[bytes]:
+        """Return encoded node at name, or None if not found"""
+        if name in self.changes:
+            return self.changes[name]
+        position = self.packed.find(name)
+        return self.packed.node(position) if position is not None else None
+
+    def __getitem__(self, name: dns.name.Name) -> dns.node.Node:
+        data = self.encoded(name)
+        if data is None:
+            raise KeyError(name)
+        return decode_node(data, self.rdclass)
+
+    def __setitem__(self, name: dns.name.Name, node: dns.node.Node) -> None:
+        if name not in self:
+            self.length += 1
+            if self.packed.find(name) is None:
+                self.added.add(name)
+        self.changes[name] = encode_node(node)
+
+    def __delitem__(self, name: dns.name.Name) -> None:
+        if name not in self:
+            raise KeyError(name)
+        self.length -= 1
+        if name in self.added:
+            self.added.discard(name)
+            del self.changes[name]
+        else:
+            self.changes[name] = None
+
+    def __iter__(self) -> Iterator[dns.name.Name]:
+        for name, _ in self.items_encoded():
+            yield name
+
+    def items_encoded(self) -> Iterator[Tuple[dns.name.Name, bytes]]:
+        """Return names and encoded nodes in canonical order"""
+        packed = self.packed
+
+        def packed_items():
+            for position in range(packed.count):
+                name = packed.name(position)
+                if name in self.changes:
+                    data = self.changes[name]
+                    if data is not None:
+                        yield name, data
+                else:
+                    yield name, packed.node(position)
+
+        added = [(name, self.changes[name]) for name in sorted(self.added)]
+        return heapq.merge(packed_items(), added, key=lambda item: item[0])
+
+    def fragmented(self) -> bool:
+        return len(self.changes) > max(COMPACT_MIN, len(self.packed) // COMPACT_RATIO)
+
+    def compacted(self):
+        """Return store with all changes packed into a new table"""
+        return NodeStore(
+            self.rdclass,
+            PackedNodes.build(self.items_encoded(), self.rdclass, self.packed.digest),
+        )
+
+
+class StoreVersion(dns.zone.WritableVersion):
+    """Writable version of a StoreZone
+
+    Nodes written are kept decoded until HOT_NODES other nodes have been
+    written (or the version is committed), as all RRsets at a name are
+    usually written together when reading or signing a zone.
+    """
+
+    def __init__(self, zone: dns.zone.Zone, replacement: bool = False):
+        super().__init__(zone, replacement=True)
+        if replacement:
+            self.nodes = NodeStore(zone.rdclass)
+        else:
+            self.nodes = zone.nodes.copy()
+        self.hot: OrderedDict[dns.name.Name, dns.node.Node] = OrderedDict()
+
+    def flush(self) -> None:
+        """Encode all nodes written"""
+        for name, node in self.hot.items():
+            self.nodes[name] = node
+        self.hot.clear()
+
+    def get_node(self, name: dns.name.Name) -> Optional[dns.node.Node]:
+        name = self._validate_name(name)
+        node = self.hot.get(name)
+        if node is None:
+            node = self.nodes.get(name)
+        return node
+
+    def keys(self):
+        self.flush()
+        return self.nodes.keys()
+
+    def items(self):
+        self.flush()
+        return self.nodes.items()
+
+    def _write_node(self, name: dns.name.Name) -> dns.node.Node:
+        node = self.get_node(name)
+        if node is None:
+            node = self.zone.node_factory()
+        self.hot[name] = node
+        self.hot.move_to_end(name)
+        if len(self.hot) > HOT_NODES:
+            coldest, cold_node = self.hot.popitem(last=False)
+            self.nodes[coldest] = cold_node
+        self.changed.add(name)
+        return node
+
+    def put_rdataset(
+        self, name: dns.name.Name, rdataset: dns.rdataset.Rdataset
+    ) -> None:
+        name = self._validate_name(name)
+        self._write_node(name).replace_rdataset(rdataset)
+
+    def delete_rdataset(
+        self,
+        name: dns.name.Name,
+        rdtype: dns.rdatatype.RdataType,
+        covers: dns.rdatatype.RdataType,
+    ) -> None:
+        name = self._validate_name(name)
+        node = self._write_node(name)
+        node.delete_rdataset(self.zone.rdclass, rdtype, covers)
+        if len(node) == 0:
+            self.delete_node(name)
+
+    def delete_node(self, name: dns.name.Name) -> None:
+        name = self._validate_name(name)
+        self.hot.pop(name, None)
+        if name in self.nodes:
+            del self.nodes[name]
+        self.changed.add(name)
+
+
+class StoreZone(dns.zone.Zone):
+    """Zone with nodes kept in a compact NodeStore
+
+    Zones must not be relativized. Nodes returned by the zone are decoded
+    copies, so zones may only be changed using transactions (as the signer
+    does). RDATA is kept as read, including the case of embedded names.
+    """
+
+    map_factory = NodeStore
+    writable_version_factory = StoreVersion
+
+    def __init__(
+        self,
+        origin: Optional[Union[dns.name.Name, str]],
+        rdclass: dns.rdataclass.RdataClass = dns.rdataclass.IN,
+        relativize: bool = False,
+    ):
+        if relativize:
+            raise ValueError("Zone store does not support relative names")
+        super().__init__(origin, rdclass, relativize=False)
+        self.nodes = NodeStore(rdclass)
+
+    @classmethod
+    def load(cls, filename: str, origin: Union[dns.name.Name, str]) -> "StoreZone":
+        """Return zone memory-mapped from file saved by save()"""
+        packed = PackedNodes.load(filename)
+        zone = cls(origin, packed.rdclass)
+        zone.nodes = NodeStore(packed.rdclass, packed)
+        return zone
+
+    def save(self, filename: str, digest: Optional[bytes] = None) -> None:
+        """Save zone to file, with digest of its source"""
+        if self.nodes.changes:
+            self.nodes = self.nodes.compacted()
+        self.nodes.packed.save(filename, digest)
+
+    def _commit_version(self, txn, version, origin):
+        version.flush()
+        super()._commit_version(txn, version, origin)
+        if self.nodes.fragmented():
+            self.nodes = self.nodes.compacted()
+
+    def to_file(self, f, sorted: bool = True, *args, **kwargs) -> None:
+        # names are always iterated in canonical order, so the zone is
+        # written while iterating instead of sorting all names first
+        return super().to_file(f, False, *args, **kwargs)
@@ -0,0 +1,121 @@
+import io
+import os
+from datetime import timedelta
+
+import dns.rdatatype
+import dns.zone
+import pytest
+
+from rollercoaster.ixfr import ZoneDiff, next_serial, serial_gt
+from rollercoaster.publish import StagedFiles
+from rollercoaster.signer import SharedResources, ZoneSigner, write_zone_diff
+
+ZONE = """$ORIGIN example.
+@ 3600 IN SOA ns hostmaster {serial} 3600 900 604800 60
+@ 3600 IN NS ns
+ns 3600 IN A 192.0.2.53
+www 300 IN A {address}
+"""
+
+T = 1700000000
+
+
+def make_zone(serial: int, address: str = "192.0.2.80") -> dns.zone.Zone:
+    return dns.zone.from_text(
+        ZONE.format(serial=serial, address=address), relativize=False
+    )
+
+
+def test_next_serial():
+    assert next_serial(None, 5) == 5
+    assert next_serial(4, 5) == 5
+    assert next_serial(5, 5) == 6
+    assert next_serial(7, 5) == 8
+    # wraps around (RFC 1982)
+    assert next_serial(2**32 - 1, 5) == 5
+    assert next_serial(2**32 - 1, 2**32 - 1) == 0
+    assert next_serial(2**32 - 1, 2**32 - 2) == 0
+    assert serial_gt(0, 2**32 - 1)
+    assert not serial_gt(2**32 - 1, 0)
+    assert not serial_gt(5, 5)
+
+
+def test_diff_file():
+    diff = ZoneDiff.from_zones(make_zone(1), make_zone(2, "192.0.2.81"))
+    assert len(diff) == 2
+    fp = io.StringIO()
+    diff.to_file(fp, T)
+    lines = [line for line in fp.getvalue().splitlines() if not line.startswith(";")]
+    records = [line.split() for line in lines]
+    # new SOA, old SOA, deleted records, new SOA, added records, new SOA
+    assert [(r[0], r[3], r[6]) for r in records if r[3] == "SOA"] == [
+        ("example.", "SOA", "2"),
+        ("example.", "SOA", "1"),
+        ("example.", "SOA", "2"),
+        ("example.", "SOA", "2"),
+    ]
+    assert [r[3] for r in records] == ["SOA", "SOA", "A", "SOA", "A", "SOA"]
+    assert records[2] == ["www.example.", "300", "IN", "A", "192.0.2.80"]
+    assert records[4] == ["www.example.", "300", "IN", "A", "192.0.2.81"]
+    assert "; from_serial 1" in fp.getvalue()
+    assert "; to_serial 2" in fp.getvalue()
+
+
+def test_serial_not_advancing(tmp_path):
+    filename = str(tmp_path / "zone.ixfr")
+    staged = StagedFiles()
+    staged.submit(write_zone_diff, staged.path(filename), make_zone(2), make_zone(2), T)
+    with pytest.raises(ValueError):
+        staged.wait()
+    staged.abort()
+    assert os.listdir(tmp_path) == []
+
+
+def zone_config(tmp_path) -> dict:
+    return {
+        "origin": "example.",
+        "mode": "single",
+        "unsigned": str(tmp_path / "example.unsigned"),
+        "keyring": str(tmp_path / "keyring.json"),
+        "signed": str(tmp_path / "example.signed"),
+        "ixfr": str(tmp_path / "example.signed.ixfr"),
+        "algorithms": {
+            "1": {"algorithm": "ECDSAP256SHA256"},
+            "2": {"algorithm": "ED25519"},
+        },
+    }
+
+
+def sign_slot(signer: ZoneSigner, t: int) -> None:
+    signer.begin(t)
+    signer.sign()
+    signer.commit()
+
+
+def test_zone_signer_diff(tmp_path):
+    config = zone_config(tmp_path)
+    with open(config["unsigned"], "wt") as fp:
+        fp.write(ZONE.format(serial=2**32 - 1, address="192.0.2.80"))
+    # left by an earlier run, and does not lead to the signed zone
+    with open(config["ixfr"], "wt") as fp:
+        fp.write("; stale\n")
+
+    resources = SharedResources({"zone": config}, ["zone"])
+    try:
+        signer = ZoneSigner("zone", config, timedelta(hours=1), resources)
+        sign_slot(signer, T)
+        assert not os.path.exists(config["ixfr"])
+        signed = dns.zone.from_file(config["signed"], "example.", relativize=False)
+        assert signed.get_soa().serial == 2**32 - 1
+
+        # the serial is bumped although the unsigned zone is unchanged
+        sign_slot(signer, T + 3600)
+        ixfr = open(config["ixfr"]).read()
+        assert "; from_serial 4294967295" in ixfr
+        assert "; to_serial 0" in ixfr
+        signed = dns.zone.from_file(config["signed"], "example.", relativize=False)
+        assert signed.get_soa().serial == 0
+        assert signed.get_rdataset("_rollercoaster.example.", dns.rdatatype.TXT)
+        signer.shutdown()
+    finally:
+        resources.shutdown()
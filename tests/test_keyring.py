@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+from dns.dnssectypes import Algorithm
+
+from rollercoaster.keyring import KeyRing, KeyRingDoubleSigner
+
+KEYSPECS = [
+    {"algorithm": Algorithm.ECDSAP256SHA256},
+    {"algorithm": Algorithm.ED25519},
+]
+
+
+def key_states(keyring: KeyRing) -> list:
+    return [
+        {name: (key.pem, key.as_state()) for name, key in keys.items()}
+        for keys in keyring.keypairs
+    ]
+
+
+def test_state_round_trip(tmp_path):
+    filename = str(tmp_path / "keyring.json")
+    keyring = KeyRingDoubleSigner(filename=filename, keyspecs=KEYSPECS)
+    keyring.update(2, 3)
+    keyring.save()
+
+    with open(filename) as fp:
+        state = json.load(fp)
+    assert all(
+        "key_id" in key and "private_key" not in key
+        for keys in state["keys"]
+        for key in keys.values()
+    )
+    material = os.listdir(KeyRing.material_path(filename))
+    assert sorted(material) == sorted(
+        f"{key.key_id}.pem" for _, keys in keyring.enumerate() for key in keys.values()
+    )
+
+    loaded = KeyRingDoubleSigner(filename=filename)
+    assert key_states(loaded) == key_states(keyring)
+    assert not loaded.changed()
+
+
+def test_inline_pem_keyring(tmp_path):
+    filename = str(tmp_path / "keyring.json")
+    keyring = KeyRingDoubleSigner(keyspecs=KEYSPECS)
+    keyring.update(1, 4)
+    # keyrings saved before key material was split out hold the keys inline
+    data = keyring.export()
+    for keys in data["keys"]:
+        for key in keys.values():
+            del key["key_id"]
+    with open(filename, "w") as fp:
+        json.dump(data, fp, indent=4)
+
+    loaded = KeyRingDoubleSigner(filename=filename)
+    assert key_states(loaded) == key_states(keyring)
+    assert loaded.changed()
+
+    loaded.save()
+    assert "private_key" not in open(filename).read()
+    assert key_states(KeyRingDoubleSigner(filename=filename)) == key_states(keyring)
+
+
+def test_missing_key_material(tmp_path):
+    filename = str(tmp_path / "keyring.json")
+    keyring = KeyRingDoubleSigner(filename=filename, keyspecs=KEYSPECS)
+    keyring.save()
+    key_id = keyring.keypairs[0]["ksk"].key_id
+    os.unlink(os.path.join(KeyRing.material_path(filename), f"{key_id}.pem"))
+    state = open(filename).read()
+
+    with pytest.raises(FileNotFoundError):
+        KeyRingDoubleSigner(filename=filename)
+    assert open(filename).read() == state
@@ -0,0 +1,45 @@
+import io
+
+import dns.name
+import dns.rdatatype
+
+from rollercoaster.prepare import (
+    EXCLUDE_RDTYPES,
+    filter_records,
+    get_rdtype,
+    is_rdclass,
+    read_zone,
+)
+
+ZONE = """$ORIGIN example.
+example. 3600 IN SOA ns.example. hostmaster.example. 1 3600 900 604800 60
+         3600 IN NS ns.example.
+foo.example. 60 IN NSEC example. A RRSIG NSEC
+; comment following a dropped record
+             IN A 192.0.2.1
+ns.example. 3600 IN A 192.0.2.53
+"""
+
+
+def test_comment_after_dropped_record():
+    records = list(filter_records(io.StringIO(ZONE), EXCLUDE_RDTYPES))
+    assert "; comment following a dropped record\n" in records
+    assert "foo.example. 60             IN A 192.0.2.1\n" in records
+
+
+def test_read_zone_comment_after_dropped_record():
+    zone = read_zone(io.StringIO(ZONE), "example.")
+    foo = dns.name.from_text("foo.example.")
+    rdataset = zone.get_rdataset(foo, dns.rdatatype.A)
+    assert rdataset.ttl == 60
+    assert zone.get_rdataset(foo, dns.rdatatype.NSEC) is None
+
+
+def test_field_tokens():
+    assert is_rdclass("IN")
+    assert is_rdclass("CLASS5")
+    assert not is_rdclass("3600")
+    assert not is_rdclass("CLASS99999999")
+    assert get_rdtype("NSEC") == dns.rdatatype.NSEC
+    assert get_rdtype("example.") is None
+    assert get_rdtype("TYPE99999999") is None
@@ -0,0 +1,188 @@
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.xfr
+import dns.zone
+import pytest
+from dns.dnssectypes import Algorithm
+
+from rollercoaster.ixfr import ZoneDiff
+from rollercoaster.keyring import KeyRingSingleSigner
+from rollercoaster.server import ServedZone, ZoneServer
+
+ZONE = """$ORIGIN example.
+@ 3600 IN SOA ns hostmaster {serial} 3600 900 604800 60
+@ 3600 IN NS ns
+ns 3600 IN A 192.0.2.53
+www 300 IN A {address}
+a.b 300 IN A 192.0.2.1
+sub 3600 IN NS ns.sub
+ns.sub 3600 IN A 192.0.2.54
+"""
+
+ORIGIN = dns.name.from_text("example.")
+ADDRESS = "127.0.0.1"
+T = 1700000000
+
+
+def make_zone(serial: int, address: str) -> dns.zone.Zone:
+    return dns.zone.from_text(
+        ZONE.format(serial=serial, address=address), relativize=False
+    )
+
+
+@pytest.fixture(scope="module")
+def zones():
+    keyring = KeyRingSingleSigner(
+        keyspecs=[
+            {"algorithm": Algorithm.ECDSAP256SHA256},
+            {"algorithm": Algorithm.ED25519},
+        ]
+    )
+    keyring.update(1, 1)
+    res = []
+    for serial, address in [(1, "192.0.2.80"), (2, "192.0.2.81")]:
+        zone = make_zone(serial, address)
+        keyring.sign_zone(zone, inception=T)
+        res.append(zone)
+    return res
+
+
+@pytest.fixture(scope="module")
+def server(zones):
+    old, new = zones
+    server = ZoneServer(address=ADDRESS, port=0)
+    server.start()
+    server.publish(
+        ServedZone(
+            new,
+            hot=[(ORIGIN, dns.rdatatype.SOA), (ORIGIN, dns.rdatatype.DNSKEY)],
+            diff=ZoneDiff.from_zones(old, new),
+        )
+    )
+    yield server
+    server.stop()
+
+
+def query(server: ZoneServer, qname: str, rdtype: str, tcp: bool = False, **kwargs):
+    q = dns.message.make_query(qname, rdtype, use_edns=0, want_dnssec=True, **kwargs)
+    if tcp:
+        return dns.query.tcp(q, ADDRESS, port=server.port, timeout=5)
+    return dns.query.udp(q, ADDRESS, port=server.port, timeout=5)
+
+
+def rdtypes(section) -> list:
+    return [(rrset.name.to_text(), rrset.rdtype, rrset.covers) for rrset in section]
+
+
+@pytest.mark.parametrize("tcp", [False, True])
+@pytest.mark.parametrize("rdtype", ["SOA", "DNSKEY"])
+def test_hot_answers(server, zones, tcp, rdtype):
+    assert (ORIGIN, dns.rdatatype.from_text(rdtype), True) in server.served.responses
+    response = query(server, "example.", rdtype, tcp=tcp)
+    assert response.rcode() == dns.rcode.NOERROR
+    assert response.flags & dns.flags.AA
+    assert response.flags & dns.flags.RD
+    rrset = response.find_rrset(
+        response.answer, ORIGIN, dns.rdataclass.IN, dns.rdatatype.from_text(rdtype)
+    )
+    assert rrset == zones[1].find_rrset(ORIGIN, rdtype)
+    assert response.get_rrset(
+        response.answer,
+        ORIGIN,
+        dns.rdataclass.IN,
+        dns.rdatatype.RRSIG,
+        dns.rdatatype.from_text(rdtype),
+    )
+
+
+def test_referral(server):
+    response = query(server, "www.sub.example.", "A")
+    assert response.rcode() == dns.rcode.NOERROR
+    assert not response.flags & dns.flags.AA
+    assert response.answer == []
+    assert rdtypes(response.authority) == [
+        ("sub.example.", dns.rdatatype.NS, dns.rdatatype.NONE),
+        ("sub.example.", dns.rdatatype.NSEC, dns.rdatatype.NONE),
+        ("sub.example.", dns.rdatatype.RRSIG, dns.rdatatype.NSEC),
+    ]
+    assert rdtypes(response.additional) == [
+        ("ns.sub.example.", dns.rdatatype.A, dns.rdatatype.NONE)
+    ]
+
+
+def test_nxdomain(server):
+    response = query(server, "nope.example.", "A", tcp=True)
+    assert response.rcode() == dns.rcode.NXDOMAIN
+    assert response.flags & dns.flags.AA
+    nsecs = [
+        rrset for rrset in response.authority if rrset.rdtype == dns.rdatatype.NSEC
+    ]
+    qname = dns.name.from_text("nope.example.")
+    assert any(rrset.name < qname < rrset[0].next for rrset in nsecs)
+    assert len(response.authority) == 2 * (1 + len(nsecs))
+
+
+def test_empty_non_terminal(server):
+    response = query(server, "b.example.", "A")
+    assert response.rcode() == dns.rcode.NOERROR
+    assert response.flags & dns.flags.AA
+    assert response.answer == []
+    nsec = response.find_rrset(
+        response.authority, ORIGIN, dns.rdataclass.IN, dns.rdatatype.NSEC
+    )
+    assert nsec[0].next == dns.name.from_text("a.b.example.")
+    assert rdtypes(response.authority) == [
+        ("example.", dns.rdatatype.SOA, dns.rdatatype.NONE),
+        ("example.", dns.rdatatype.RRSIG, dns.rdatatype.SOA),
+        ("example.", dns.rdatatype.NSEC, dns.rdatatype.NONE),
+        ("example.", dns.rdatatype.RRSIG, dns.rdatatype.NSEC),
+    ]
+
+
+def test_refused_class(server):
+    response = query(server, "example.", "SOA", rdclass=dns.rdataclass.CH)
+    assert response.rcode() == dns.rcode.REFUSED
+    assert response.answer == []
+
+
+def test_notify_not_implemented(server):
+    q = dns.message.make_query("example.", "SOA")
+    q.set_opcode(dns.opcode.NOTIFY)
+    response = dns.query.udp(q, ADDRESS, port=server.port, timeout=5)
+    assert response.rcode() == dns.rcode.NOTIMP
+    assert response.answer == []
+
+
+def test_axfr(server, zones):
+    zone = dns.zone.Zone(ORIGIN, relativize=False)
+    dns.query.inbound_xfr(ADDRESS, zone, port=server.port, timeout=5)
+    assert zone == zones[1]
+
+
+def test_ixfr(server, zones):
+    zone = dns.zone.from_text(zones[0].to_text(), ORIGIN, relativize=False)
+    assert zone != zones[1]
+    q, serial = dns.xfr.make_query(zone)
+    assert q.question[0].rdtype == dns.rdatatype.IXFR and serial == 1
+    dns.query.inbound_xfr(ADDRESS, zone, q, port=server.port, timeout=5)
+    assert zone == zones[1]
+
+    # incremental transfer (RFC 1995), not the full zone
+    messages = dns.query.xfr(
+        ADDRESS,
+        ORIGIN,
+        rdtype=dns.rdatatype.IXFR,
+        serial=1,
+        port=server.port,
+        timeout=5,
+        relativize=False,
+    )
+    answer = [rrset for message in messages for rrset in message.answer]
+    soa = [rrset[0].serial for rrset in answer if rrset.rdtype == dns.rdatatype.SOA]
+    assert soa == [2, 1, 2, 2]
@@ -0,0 +1,137 @@
+import dns.dnssec
+import dns.zone
+import pytest
+from dns.dnssectypes import Algorithm
+
+from rollercoaster.canonical import CanonicalCache
+from rollercoaster.keyring import KeyRingDoubleSigner
+from rollercoaster.nsec import NsecChain
+from rollercoaster.sigcache import SignatureCache
+from rollercoaster.signing import SigningPool
+
+ZONE = """$ORIGIN example.
+@ 3600 IN SOA ns hostmaster 1 3600 900 604800 60
+@ 3600 IN NS ns
+@ 3600 IN MX 10 Mail.Example.
+ns 3600 IN A 192.0.2.53
+Mail 3600 IN A 192.0.2.25
+www 300 IN A 192.0.2.80
+www 300 IN A 192.0.2.81
+a.b 300 IN TXT "below an empty non-terminal"
+* 300 IN TXT "wildcard"
+sub 3600 IN NS ns.sub
+sub 3600 IN DS 12345 13 2 0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef
+ns.sub 3600 IN A 192.0.2.54
+insecure 3600 IN NS ns.insecure
+ns.insecure 3600 IN A 192.0.2.55
+"""
+
+T = 1700000000
+LIFETIME = 86400
+DNSKEY_TTL = 60
+
+
+def make_zone() -> dns.zone.Zone:
+    return dns.zone.from_text(ZONE, relativize=False)
+
+
+@pytest.fixture(scope="module")
+def keyring():
+    keyring = KeyRingDoubleSigner(
+        keyspecs=[
+            {"algorithm": Algorithm.RSASHA256, "key_size": 2048},
+            {"algorithm": Algorithm.ED25519},
+        ]
+    )
+    # both algorithms sign during the algorithm rollover
+    keyring.update(2, 5)
+    signing = {
+        (keypair.dnskey.algorithm, keypair.dnskey.flags)
+        for keys in keyring.keypairs
+        for keypair in keys.values()
+        if keypair.sign
+    }
+    assert {algorithm for algorithm, _ in signing} == {
+        Algorithm.RSASHA256,
+        Algorithm.ED25519,
+    }
+    assert len(signing) == 4
+    return keyring
+
+
+@pytest.fixture(scope="module")
+def expected(keyring) -> str:
+    """Zone signed by dnspython, using the same keys"""
+    keypairs = [keypair for keys in keyring.keypairs for keypair in keys.values()]
+    zone = make_zone()
+    with zone.writer() as txn:
+        for keypair in keypairs:
+            if keypair.publish:
+                txn.add(zone.origin, DNSKEY_TTL, keypair.dnskey)
+        dns.dnssec.sign_zone(
+            zone,
+            txn,
+            keys=[
+                (keypair.private_key, keypair.dnskey)
+                for keypair in keypairs
+                if keypair.sign
+            ],
+            add_dnskey=False,
+            inception=T,
+            lifetime=LIFETIME,
+            policy=dns.dnssec.allow_all_policy,
+        )
+    return zone.to_text()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SigningPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def sign(keyring, **kwargs) -> str:
+    zone = make_zone()
+    keyring.sign_zone(
+        zone, lifetime=LIFETIME, dnskey_ttl=DNSKEY_TTL, inception=T, **kwargs
+    )
+    return zone.to_text()
+
+
+def test_sign_zone(keyring, expected):
+    assert sign(keyring) == expected
+
+
+def test_sign_zone_pool(keyring, expected, pool):
+    assert sign(keyring, pool=pool) == expected
+
+
+def test_sign_zone_chain(keyring, expected, pool):
+    zone = make_zone()
+    chain = NsecChain.from_zone(zone)
+    canonical = CanonicalCache.from_zone(zone, chain)
+    assert sign(keyring, chain=chain, canonical=canonical) == expected
+    # the chain and canonical forms are reused by the next slot
+    assert sign(keyring, chain=chain, canonical=canonical, pool=pool) == expected
+
+
+@pytest.mark.parametrize("use_pool", [False, True])
+def test_sign_zone_cache(keyring, expected, pool, use_pool):
+    cache = SignatureCache(refresh=3600, jitter=0)
+    assert sign(keyring, cache=cache, pool=pool if use_pool else None) == expected
+    signatures = len(cache)
+    assert signatures > 0
+
+    # signatures made for the first slot are reused by the next
+    zone = make_zone()
+    keyring.sign_zone(
+        zone,
+        lifetime=LIFETIME,
+        dnskey_ttl=DNSKEY_TTL,
+        inception=T + 600,
+        cache=cache,
+        pool=pool if use_pool else None,
+    )
+    assert zone.to_text() == expected
+    assert len(cache) == signatures
@@ -0,0 +1,47 @@
+import dns.name
+import dns.zone
+
+from rollercoaster.zonestore import PackedNodes, StoreZone
+
+ZONE = """$ORIGIN Example.
+@ 3600 IN SOA NS.Example. HostMaster.Example. 1 3600 900 604800 60
+  3600 IN NS NS.Example.
+  3600 IN MX 10 Mail.Example.
+NS 3600 IN A 192.0.2.53
+Mail 3600 IN A 192.0.2.25
+www 300 IN CNAME Web.Example.
+Sub 3600 IN NS NS.Sub.Example.
+NS.Sub 3600 IN A 192.0.2.54
+_sip._tcp 3600 IN SRV 0 5 5060 SIP.Example.
+b 60 IN TXT "Mixed Case" "text"
+"""
+
+
+def load_zone(zone_factory=dns.zone.Zone) -> dns.zone.Zone:
+    return dns.zone.from_text(ZONE, relativize=False, zone_factory=zone_factory)
+
+
+def test_store_round_trip(tmp_path):
+    zone = load_zone()
+    filename = str(tmp_path / "zone.store")
+    load_zone(StoreZone).save(filename)
+
+    packed = PackedNodes.load(filename)
+    store = StoreZone.load(filename, zone.origin)
+    assert len(packed) == len(zone.nodes)
+    assert list(packed) == sorted(zone.nodes)
+    assert store.to_text() == zone.to_text(sorted=True)
+    for name, node in zone.items():
+        assert store[name] == node
+        for rdataset in node.rdatasets:
+            stored = store.get_rdataset(name, rdataset.rdtype, rdataset.covers)
+            assert stored.ttl == rdataset.ttl
+            assert sorted(rdata.to_text() for rdata in stored) == sorted(
+                rdata.to_text() for rdata in rdataset
+            )
+
+    # embedded names keep their case
+    mx = store.get_rdataset("Example.", "MX")
+    assert mx[0].exchange.labels == (b"Mail", b"Example", b"")
+    srv = store.get_rdataset("_sip._tcp.Example.", "SRV")
+    assert srv[0].target.labels == (b"SIP", b"Example", b"")
@@ -0,0 +1,416 @@
+"""Benchmark of the prepare, sign, write and render pipeline on synthetic zones"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import dns.dnssec
+import dns.name
+import dns.version
+import dns.zonefile
+from dns.dnssecalgs import register_algorithm_cls
+
+import rollercoaster
+from rollercoaster.private import MyPrivateKey
+from rollercoaster.render import render_html
+from rollercoaster.sigcache import SignatureCache
+from rollercoaster.signer import get_keyring
+from rollercoaster.signing import SigningPool
+from rollercoaster.unsigned import UnsignedZone
+
+DEFAULT_DELEGATIONS = 1500
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_MODES = ["single", "double", "hybrid"]
+DEFAULT_ALGORITHMS = [
+    "RSASHA256:ECDSAP256SHA256",
+    "ECDSAP256SHA256:ED25519",
+    "ECDSAP256SHA256:PRIVATEDNS",
+]
+DEFAULT_SLOT = "q2s5"
+DEFAULT_SEED = 4711
+
+KEYSPECS = {
+    "RSASHA256": {"algorithm": "RSASHA256", "key_size": 2048},
+    "RSASHA512": {"algorithm": "RSASHA512", "key_size": 2048},
+    "ECDSAP256SHA256": {"algorithm": "ECDSAP256SHA256"},
+    "ECDSAP384SHA384": {"algorithm": "ECDSAP384SHA384"},
+    "ED25519": {"algorithm": "ED25519"},
+    "ED448": {"algorithm": "ED448"},
+    "PRIVATEDNS": {
+        "algorithm": "PRIVATEDNS",
+        "algorithm_prefix": MyPrivateKey.public_cls.name,
+    },
+}
+
+HINTS_FILENAME = os.path.join(os.path.dirname(__file__), "..", "root.hints")
+
+logger = logging.getLogger(__name__)
+
+
+def label(rnd: random.Random, length: int) -> str:
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def generate_zone(filename: str, delegations: int, seed: int = DEFAULT_SEED) -> int:
+    """Write signed root-like zone with delegations, return number of records
+
+    Signatures, DNSKEY and NSEC records are synthetic, they are only there
+    to be removed when the zone is prepared.
+    """
+    rnd = random.Random(seed)
+    tlds = set()
+    while len(tlds) < delegations:
+        tlds.add(label(rnd, rnd.randint(2, 12)) + ".")
+    tlds = sorted(tlds, key=dns.name.from_text)
+    root_servers = [f"{c}.root-servers.net." for c in "abcdefghijklm"]
+    records = 0
+
+    with open(filename, "wt") as fp:
+
+        def emit(owner: str, ttl: int, rdtype: str, rdata: str) -> None:
+            nonlocal records
+            print(f"{owner} {ttl} IN {rdtype} {rdata}", file=fp)
+            records += 1
+
+        def emit_rrsig(owner: str, ttl: int, rdtype: str) -> None:
+            labels = 0 if owner == "." else owner.count(".")
+            signature = base64.b64encode(rnd.randbytes(256)).decode()
+            emit(
+                owner,
+                ttl,
+                "RRSIG",
+                f"{rdtype} 8 {labels} {ttl} 20300101000000 20200101000000 "
+                f"20326 . {signature}",
+            )
+
+        emit(
+            ".",
+            86400,
+            "SOA",
+            "a.root-servers.net. nstld.verisign-grs.com. 2024010100 1800 900 604800 86400",
+        )
+        emit_rrsig(".", 86400, "SOA")
+        for ns in root_servers:
+            emit(".", 518400, "NS", ns)
+        emit_rrsig(".", 518400, "NS")
+        for flags in [257, 256]:
+            key = base64.b64encode(rnd.randbytes(260)).decode()
+            emit(".", 172800, "DNSKEY", f"{flags} 3 8 {key}")
+        emit_rrsig(".", 172800, "DNSKEY")
+        emit(".", 86400, "NSEC", f"{tlds[0]} NS SOA RRSIG NSEC DNSKEY")
+        emit_rrsig(".", 86400, "NSEC")
+
+        for i, tld in enumerate(tlds):
+            nameservers = [f"ns{n}.nic.{tld}" for n in range(rnd.randint(2, 6))]
+            for ns in nameservers:
+                emit(tld, 172800, "NS", ns)
+            for _ in range(rnd.randint(1, 2)):
+                digest = rnd.randbytes(32).hex().upper()
+                emit(tld, 86400, "DS", f"{rnd.randint(1, 65535)} 8 2 {digest}")
+            emit_rrsig(tld, 86400, "DS")
+            following = tlds[i + 1] if i + 1 < len(tlds) else "."
+            emit(tld, 86400, "NSEC", f"{following} NS DS RRSIG NSEC")
+            emit_rrsig(tld, 86400, "NSEC")
+            for ns in nameservers:
+                emit(ns, 172800, "A", f"192.0.2.{rnd.randint(1, 254)}")
+                emit(ns, 172800, "AAAA", f"2001:db8::{rnd.randint(1, 65535):x}")
+
+        for ns in root_servers:
+            emit(ns, 518400, "A", "192.0.2.1")
+            emit(ns, 518400, "AAAA", "2001:db8::1")
+
+    return records
+
+
+def get_rss() -> Optional[int]:
+    """Return current resident set size (if available)"""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def get_cpu() -> float:
+    """Return CPU time of this process and of all children waited for"""
+    res = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        res += usage.ru_utime + usage.ru_stime
+    return res
+
+
+def get_max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stages:
+    """Wall time, CPU time and memory per stage
+
+    CPU time includes child processes (such as signing workers) that have
+    exited by the end of the stage. Memory is given as the change of the
+    resident set size during the stage, and as how much the stage raised
+    the peak resident set size of the process.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, dict] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        rss = get_rss()
+        max_rss = get_max_rss()
+        wall = time.perf_counter()
+        cpu = get_cpu()
+        yield
+        self.stages[name] = {
+            "wall": round(time.perf_counter() - wall, 6),
+            "cpu": round(get_cpu() - cpu, 6),
+            "rss_delta": get_rss() - rss if rss is not None else None,
+            "max_rss_delta": get_max_rss() - max_rss,
+        }
+        logger.info("%s took %.3f seconds", name, self.stages[name]["wall"])
+
+
+def run_scenario(scenario: dict) -> dict:
+    """Run scenario in this process and return results per stage"""
+
+    register_algorithm_cls(
+        algorithm=MyPrivateKey.public_cls.algorithm,
+        algorithm_cls=MyPrivateKey,
+        name=MyPrivateKey.public_cls.name,
+    )
+
+    directory = scenario["directory"]
+    quarter, slot = (int(x) for x in scenario["slot"][1:].split("s"))
+    algorithms = scenario["algorithms"].split(":")
+    stages = Stages()
+
+    with open(HINTS_FILENAME) as fp:
+        hints_rrsets = dns.zonefile.read_rrsets(fp.read())
+
+    def unsigned_zone() -> UnsignedZone:
+        return UnsignedZone(
+            origin=".",
+            unsigned=os.path.join(directory, "root.unsigned"),
+            upstream=scenario["upstream"],
+            hints_rrsets=hints_rrsets,
+            store=os.path.join(directory, "root.store") if scenario["store"] else None,
+        )
+
+    with stages.stage("prepare"):
+        unsigned_zone().prepare()
+    # the prepared zone is loaded as when starting, not applied as changes
+    # to the zone already prepared
+    unsigned = unsigned_zone()
+    with stages.stage("load"):
+        unsigned.load()
+
+    config = {
+        "mode": scenario["mode"],
+        "keyring": os.path.join(directory, "keyring.json"),
+        "algorithms": {
+            str(i + 1): {**KEYSPECS[algorithm]}
+            for i, algorithm in enumerate(algorithms)
+        },
+    }
+    with stages.stage("keygen"):
+        keyring = get_keyring(config)
+        keyring.generate(quarter, slot)
+        keyring.update(quarter, slot)
+
+    cache = SignatureCache() if scenario["incremental"] else None
+
+    passes = ["sign", "resign"] if cache is not None else ["sign"]
+    for name in passes:
+        zone = unsigned.snapshot()
+        with stages.stage(name):
+            # the pool is shut down within the stage, as the CPU time of
+            # workers is only accounted for when they have exited
+            if scenario["workers"] > 1:
+                pool = SigningPool(scenario["workers"])
+            else:
+                pool = None
+            keyring.sign_zone(
+                zone,
+                cache=cache,
+                pool=pool,
+                chain=unsigned.chain,
+                canonical=unsigned.canonical,
+            )
+            if pool is not None:
+                pool.shutdown()
+
+    with stages.stage("write"):
+        with open(os.path.join(directory, "root.signed"), "wt") as fp:
+            zone.to_file(fp)
+
+    with stages.stage("render"):
+        render_html(
+            keyring,
+            delta=timedelta(seconds=30),
+            refresh=6,
+            current_quarter=quarter,
+            current_slot=slot,
+        )
+
+    return stages.stages
+
+
+def run_subprocess(scenario: dict) -> dict:
+    """Run scenario in a fresh process to get a separate peak RSS"""
+    res = subprocess.run(
+        [sys.executable, __file__, "--scenario", json.dumps(scenario)],
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return json.loads(res.stdout)
+
+
+def get_commit() -> Optional[str]:
+    try:
+        res = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return res.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rollercoaster Benchmark")
+    parser.add_argument(
+        "--delegations",
+        metavar="n",
+        type=int,
+        default=DEFAULT_DELEGATIONS,
+        help="Number of delegations at scale 1",
+    )
+    parser.add_argument(
+        "--scale",
+        metavar="n",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SCALES,
+        help="Zone scale factors",
+    )
+    parser.add_argument(
+        "--mode",
+        metavar="mode",
+        nargs="+",
+        choices=DEFAULT_MODES,
+        default=DEFAULT_MODES,
+        help="Signing modes",
+    )
+    parser.add_argument(
+        "--algorithms",
+        metavar="alg1:alg2",
+        nargs="+",
+        default=DEFAULT_ALGORITHMS,
+        help="Algorithm pairs",
+    )
+    parser.add_argument(
+        "--slot", metavar="qNsM", default=DEFAULT_SLOT, help="Slot to sign"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Use signature cache (and sign twice)",
+    )
+    parser.add_argument(
+        "--workers", metavar="n", type=int, default=1, help="Signing workers"
+    )
+    parser.add_argument(
+        "--store", action="store_true", help="Keep zones in compact zone store"
+    )
+    parser.add_argument("--output", metavar="filename", help="Output filename")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--debug", action="store_true", help="Enable debugging")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    if args.scenario:
+        json.dump(run_scenario(json.loads(args.scenario)), sys.stdout)
+        return
+
+    for pair in args.algorithms:
+        for algorithm in pair.split(":"):
+            if algorithm not in KEYSPECS:
+                parser.error(f"Unknown algorithm {algorithm}")
+
+    results: List[dict] = []
+
+    with tempfile.TemporaryDirectory(prefix="rollercoaster-bench-") as tmpdir:
+        for scale in args.scale:
+            delegations = args.delegations * scale
+            upstream = os.path.join(tmpdir, f"root-{scale}.zone")
+            logger.info("Generating zone with %d delegations", delegations)
+            records = generate_zone(upstream, delegations)
+            for mode in args.mode:
+                for algorithms in args.algorithms:
+                    directory = tempfile.mkdtemp(dir=tmpdir)
+                    scenario = {
+                        "directory": directory,
+                        "upstream": upstream,
+                        "mode": mode,
+                        "algorithms": algorithms,
+                        "slot": args.slot,
+                        "incremental": args.incremental,
+                        "workers": args.workers,
+                        "store": args.store,
+                    }
+                    logger.info("Running %s %s at scale %d", mode, algorithms, scale)
+                    results.append(
+                        {
+                            "scale": scale,
+                            "delegations": delegations,
+                            "records": records,
+                            "mode": mode,
+                            "algorithms": algorithms,
+                            "slot": args.slot,
+                            "incremental": args.incremental,
+                            "workers": args.workers,
+                            "store": args.store,
+                            "stages": run_subprocess(scenario),
+                        }
+                    )
+
+    report = {
+        "version": rollercoaster.__version__,
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "dnspython": dns.version.version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "wt") as fp:
+            json.dump(report, fp, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+
+if __name__ == "__main__":
+    main()